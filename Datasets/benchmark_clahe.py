@@ -0,0 +1,81 @@
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+from clahe_engine import ClaheEngine, BACKENDS
+
+# ================= CONFIGURATION =================
+# Synthetic smear-sized frames (H, W): BCCD / Raabin captures, then a
+# full-resolution microscope camera frame.
+FRAME_SHAPES = [(480, 640), (1200, 1600), (2048, 2448)]
+NUM_FRAMES = 16      # Frames per shape (also the batch size for "batched")
+REPEATS = 3          # Timed passes per backend; best pass is reported
+WARMUP = 1
+SEED = 0
+# =================================================
+
+def make_smear(h, w, rng):
+    """Pinkish background with darker purple blobs, roughly like a stained smear."""
+    img = np.empty((h, w, 3), dtype=np.uint8)
+    img[:] = (200, 170, 215)  # BGR
+    n_cells = max(20, (h * w) // 4000)
+    ys = rng.integers(0, h, n_cells)
+    xs = rng.integers(0, w, n_cells)
+    rs = rng.integers(8, 24, n_cells)
+    for y, x, r in zip(ys, xs, rs):
+        color = (150, 90, 160) if r > 18 else (175, 120, 190)
+        cv2.circle(img, (int(x), int(y)), int(r), color, -1)
+    noise = rng.normal(0, 6, img.shape)
+    img = np.clip(img.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    # Uneven illumination, the thing CLAHE is there to fix
+    ramp = np.linspace(0.6, 1.0, w, dtype=np.float32)[None, :, None]
+    return (img * ramp).astype(np.uint8)
+
+def run_pass(mode, engine, frames):
+    if mode == "batched":
+        engine.apply_batch(frames)
+    else:
+        for f in frames:
+            engine.apply(f)
+
+def bench(mode, frames):
+    backend = "reference" if mode == "reference" else "inplace"
+    engine = ClaheEngine(backend=backend)
+    for _ in range(WARMUP):
+        run_pass(mode, engine, frames)
+
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        run_pass(mode, engine, frames)
+        best = min(best, time.perf_counter() - start)
+
+    # Separate, untimed pass for memory (tracemalloc slows allocation down).
+    # A fresh engine so buffer allocation counts towards the peak.
+    engine = ClaheEngine(backend=backend)
+    tracemalloc.start()
+    run_pass(mode, engine, frames)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def main():
+    rng = np.random.default_rng(SEED)
+    cv2.setNumThreads(1)  # Per-core numbers, same as an ETL worker
+    modes = list(BACKENDS) + ["batched"]
+
+    print(f"🧪 CLAHE benchmark: {NUM_FRAMES} frames/shape, best of {REPEATS}, OpenCV {cv2.__version__}")
+    print(f"{'shape':>12} {'backend':>10} {'ms/img':>9} {'MB/s':>9} {'peak MB':>9} {'speedup':>8}")
+    for h, w in FRAME_SHAPES:
+        frames = [make_smear(h, w, rng) for _ in range(NUM_FRAMES)]
+        mb = sum(f.nbytes for f in frames) / 1e6
+        baseline = None
+        for mode in modes:
+            elapsed, peak = bench(mode, frames)
+            baseline = baseline or elapsed
+            print(f"{f'{h}x{w}':>12} {mode:>10} {1000 * elapsed / NUM_FRAMES:9.2f} "
+                  f"{mb / elapsed:9.1f} {peak / 1e6:9.1f} {baseline / elapsed:7.2f}x")
+
+if __name__ == "__main__":
+    main()
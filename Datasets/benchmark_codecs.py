@@ -0,0 +1,109 @@
+import csv
+import time
+import cv2
+import numpy as np
+from pathlib import Path
+
+from clahe_engine import ClaheEngine
+from benchmark_clahe import make_smear
+
+# ================= CONFIGURATION =================
+# Real source frames are used when present; otherwise synthetic smears.
+IMAGE_DIRS = [
+    "Blood_Roboflow_Workspace_Remastered/BCCD/train/images",
+    "Blood_Roboflow_Workspace_Remastered/Raabin_WBC/train/images",
+    "Blood_Roboflow_Workspace_Remastered/Sickle_Cell/train/images",
+]
+SAMPLES_PER_DIR = 20
+SYNTHETIC_SHAPES = [(480, 640), (1200, 1600)]
+REPEATS = 3            # Timed passes; best pass is reported
+DATASET_IMAGES = 10000  # Projects the on-disk size to a full output tree
+REPORT_CSV = "codec_report.csv"
+SEED = 0
+
+# (label, OUTPUT_CODEC, imwrite params) as merge_remap_and_clahe.py would use them
+CODECS = [
+    ("jpeg q85",  "jpeg", [cv2.IMWRITE_JPEG_QUALITY, 85]),
+    ("jpeg q95",  "jpeg", [cv2.IMWRITE_JPEG_QUALITY, 95]),   # = OpenCV default
+    ("jpeg q100", "jpeg", [cv2.IMWRITE_JPEG_QUALITY, 100]),
+    ("png c1",    "png",  [cv2.IMWRITE_PNG_COMPRESSION, 1]),
+    ("png c3",    "png",  [cv2.IMWRITE_PNG_COMPRESSION, 3]),  # = OpenCV default
+    ("raw bmp",   "raw",  []),
+    ("raw shard", "raw",  None),  # Raw pixels inside a shard: a reshape + copy
+]
+SUFFIX = {"jpeg": ".jpg", "png": ".png", "raw": ".bmp"}
+# =================================================
+
+def load_frames():
+    """CLAHE'd frames, i.e. exactly what the ETL hands to the encoder."""
+    engine = ClaheEngine()
+    frames = []
+    for d in IMAGE_DIRS:
+        for path in sorted(Path(d).glob("*"))[:SAMPLES_PER_DIR] if Path(d).is_dir() else []:
+            img = engine.apply_file(path)
+            if img is not None: frames.append(img)
+    if frames:
+        return frames, "source frames"
+    rng = np.random.default_rng(SEED)
+    frames = [engine.apply(make_smear(h, w, rng)) for h, w in SYNTHETIC_SHAPES for _ in range(SAMPLES_PER_DIR)]
+    return frames, "synthetic smears"
+
+def encode(frame, codec, params):
+    if params is None:
+        return frame.tobytes()
+    return cv2.imencode(SUFFIX[codec], frame, params)[1].tobytes()
+
+def decode(data, shape, params):
+    if params is None:
+        return np.frombuffer(data, dtype=np.uint8).reshape(shape).copy()
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def best_of(fn):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+def main():
+    cv2.setNumThreads(1)  # Per-core numbers, same as an ETL / dataloader worker
+    frames, origin = load_frames()
+    n = len(frames)
+    print(f"🧪 Codec benchmark on {n} CLAHE'd {origin}, best of {REPEATS}, OpenCV {cv2.__version__}")
+
+    rows = []
+    for label, codec, params in CODECS:
+        blobs = [encode(f, codec, params) for f in frames]
+        enc = best_of(lambda: [encode(f, codec, params) for f in frames])
+        dec = best_of(lambda: [decode(b, f.shape, params) for b, f in zip(blobs, frames)])
+        size = sum(len(b) for b in blobs) / n
+        quality = min(psnr(f, decode(b, f.shape, params)) for b, f in zip(blobs, frames))
+        rows.append({
+            "codec": label,
+            "OUTPUT_CODEC": codec,
+            "encode_ms": 1000 * enc / n,
+            "decode_ms": 1000 * dec / n,
+            "kb_per_image": size / 1e3,
+            "dataset_gb": size * DATASET_IMAGES / 1e9,
+            "min_psnr_db": quality,
+        })
+
+    print(f"{'codec':>10} {'encode ms':>10} {'decode ms':>10} {'KB/img':>9} "
+          f"{f'GB/{DATASET_IMAGES // 1000}k':>9} {'min PSNR':>9}")
+    for r in rows:
+        print(f"{r['codec']:>10} {r['encode_ms']:10.2f} {r['decode_ms']:10.2f} {r['kb_per_image']:9.1f} "
+              f"{r['dataset_gb']:9.2f} {r['min_psnr_db']:9.1f}")
+
+    with open(REPORT_CSV, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"📝 Report written to {REPORT_CSV} (decode ms is per epoch and image in the training loader)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import time
+import random
+import cv2
+from pathlib import Path
+
+from letterbox_cache import LetterboxCache, cache_dir, is_cache_dir, resize_frame
+from shard_format import ShardReader, is_shard_dir
+
+# ================= CONFIGURATION =================
+# Compares random-order read + decode from the loose YOLO tree against the
+# packed shards of the same split, and decode + resize to IMGSZ (what the
+# trainer's load_image() does per sample) against a slice of the ETL's
+# letterbox cache.
+# Build them with merge_remap_and_clahe.py (OUTPUT_FORMAT = "files" /
+# "shards", LETTERBOX_IMGSZ = IMGSZ) first; missing sources are skipped.
+DATASET_DIR = "Final_Blood_YOLO_Hierarchical_Remastered_clahe"
+SPLIT = "train"
+IMGSZ = 640
+NUM_SAMPLES = 2000   # Random draws per pass (with replacement, like a sampler)
+REPEATS = 3          # Timed passes; best pass is reported
+SEED = 0
+# =================================================
+
+def read_loose(images_dir, names, order):
+    for i in order:
+        img = cv2.imread(os.path.join(images_dir, names[i]))
+        label = Path(images_dir).parent / "labels" / (Path(names[i]).stem + ".txt")
+        if label.exists():
+            label.read_text()
+        yield img
+
+def read_shards(reader, order):
+    for i in order:
+        img = reader.image(i)
+        reader.label_text(i)
+        yield img
+
+def read_resized(make_iter, order):
+    for img in make_iter(order):
+        yield None if img is None else resize_frame(img, IMGSZ)
+
+def read_letterbox(cache, order):
+    for i in order:
+        img = cache.image(i)
+        cache.label_text(i)
+        yield img
+
+def bench(make_iter, order):
+    """Best (wall s, CPU s, decoded bytes) over REPEATS passes."""
+    best, cpu, nbytes = float("inf"), float("inf"), 0
+    for _ in range(REPEATS):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        nbytes = sum(img.nbytes for img in make_iter(order) if img is not None)
+        best = min(best, time.perf_counter() - start)
+        cpu = min(cpu, time.process_time() - start_cpu)
+    return best, cpu, nbytes
+
+def main():
+    cv2.setNumThreads(1)  # Per-core numbers, same as a dataloader worker
+    shard_dir = Path(DATASET_DIR) / "shards" / SPLIT
+    images_dir = Path(DATASET_DIR) / SPLIT / "images"
+    lb_dir = cache_dir(DATASET_DIR, IMGSZ) / SPLIT
+    have_files, have_shards, have_lb = images_dir.is_dir(), is_shard_dir(shard_dir), is_cache_dir(lb_dir)
+    if not have_files and not have_shards:
+        print(f"❌ Need {images_dir} or {shard_dir}. Run the ETL first.")
+        return
+
+    reader = ShardReader(shard_dir) if have_shards else None
+    names = sorted(os.listdir(images_dir)) if have_files else list(reader.names)
+    if have_files and have_shards:
+        names = [n for n in reader.names if (images_dir / n).exists()]
+        if len(names) != len(reader.names):
+            print(f"⚠️  {len(reader.names) - len(names)} shard records have no loose file, skipping them")
+    cache = LetterboxCache(lb_dir) if have_lb else None
+    if cache is not None:
+        rows = {n: i for i, n in enumerate(cache.names)}
+        if any(n not in rows for n in names):
+            print(f"⚠️  {lb_dir} does not cover the split, skipping it (re-run the ETL with LETTERBOX_IMGSZ = {IMGSZ})")
+            cache = None
+    shard_ids = {n: i for i, n in enumerate(reader.names)} if reader else {}
+    rng = random.Random(SEED)
+    order = [rng.randrange(len(names)) for _ in range(NUM_SAMPLES)]
+
+    decode = (lambda o: read_loose(str(images_dir), names, o)) if have_files else \
+        (lambda o: read_shards(reader, [shard_ids[names[i]] for i in o]))
+    runs = []
+    if have_files:
+        runs.append(("files", decode))
+    if have_shards:
+        runs.append(("shards", lambda o: read_shards(reader, [shard_ids[names[i]] for i in o])))
+    runs.append(("+resize", lambda o: read_resized(decode, o)))
+    if cache is not None:
+        runs.append(("letterbox", lambda o: read_letterbox(cache, [rows[names[i]] for i in o])))
+
+    print(f"🧪 Loader benchmark: {SPLIT}, {len(names)} images, {NUM_SAMPLES} random reads, best of {REPEATS}")
+    print(f"{'source':>10} {'img/s':>9} {'ms/img':>8} {'CPU ms/img':>11} {'MB/s decoded':>13} {'speedup':>8}")
+    results = [(source, bench(make_iter, order)) for source, make_iter in runs]
+    base = results[0][1][0]
+    for source, (elapsed, cpu, nbytes) in results:
+        print(f"{source:>10} {NUM_SAMPLES / elapsed:9.1f} {1000 * elapsed / NUM_SAMPLES:8.2f} "
+              f"{1000 * cpu / NUM_SAMPLES:11.2f} {nbytes / 1e6 / elapsed:13.1f} {base / elapsed:7.2f}x")
+    if cache is not None:
+        resized = dict(results)["+resize"]
+        cached = dict(results)["letterbox"]
+        print(f"📐 Letterbox cache at {IMGSZ}: {resized[1] / max(cached[1], 1e-9):.1f}x less CPU per sample "
+              f"than decode + resize ({1000 * (resized[1] - cached[1]) / NUM_SAMPLES:.2f} ms saved per image)")
+
+    if have_files and have_shards:
+        files_on_disk = sum(1 for _ in images_dir.iterdir()) + sum(1 for _ in (images_dir.parent / "labels").iterdir())
+        shard_files = sum(1 for _ in shard_dir.iterdir())
+        print(f"📁 Files per split: {files_on_disk} loose vs {shard_files} packed")
+
+if __name__ == "__main__":
+    main()
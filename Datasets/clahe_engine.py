@@ -0,0 +1,136 @@
+import cv2
+import numpy as np
+
+# ==========================================
+# CLAHE PREPROCESSING ENGINE
+# ==========================================
+# Shared by the ETL (merge_remap_and_clahe.py) and the inference tools so
+# training and deployment see exactly the same normalization.
+#
+# CLAHE runs on the L (Lightness) channel of LAB only, so the purple/pink
+# stain colors are left alone.
+
+DEFAULT_CLIP_LIMIT = 2.0
+DEFAULT_TILE_GRID = (8, 8)
+
+BACKENDS = ("reference", "inplace")
+
+
+class ClaheEngine:
+    """Reusable CLAHE normalizer.
+
+    backend="reference" is the original BGR->LAB->split->merge->BGR round trip.
+    backend="inplace" keeps one CLAHE object and a set of scratch buffers per
+    frame size, equalizes the L plane in place and never splits/merges the
+    frame. Both produce byte-identical output.
+    """
+
+    def __init__(self, clip_limit=DEFAULT_CLIP_LIMIT, tile_grid_size=DEFAULT_TILE_GRID, backend="inplace"):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown CLAHE backend '{backend}', expected one of {BACKENDS}")
+        self.clip_limit = float(clip_limit)
+        self.tile_grid_size = tuple(int(t) for t in tile_grid_size)
+        self.backend = backend
+        self.clahe = cv2.createCLAHE(clipLimit=self.clip_limit, tileGridSize=self.tile_grid_size)
+
+        # Scratch buffers, (re)allocated only when the frame size changes
+        self._shape = None
+        self._lab = None
+        self._l = None
+
+    def __getstate__(self):
+        # cv2.CLAHE objects can't be pickled (spawned workers, dataloaders);
+        # rebuild from the parameters on the other side.
+        return {"clip_limit": self.clip_limit, "tile_grid_size": self.tile_grid_size, "backend": self.backend}
+
+    def __setstate__(self, state):
+        self.__init__(state["clip_limit"], state["tile_grid_size"], state["backend"])
+
+    @property
+    def params(self):
+        """Everything that changes the output (used for cache keys)."""
+        return {"clipLimit": self.clip_limit, "tileGridSize": self.tile_grid_size}
+
+    def _buffers(self, h, w):
+        if self._shape != (h, w):
+            self._shape = (h, w)
+            self._lab = np.empty((h, w, 3), dtype=np.uint8)
+            self._l = np.empty((h, w), dtype=np.uint8)
+        return self._lab, self._l
+
+    def apply(self, img, out=None):
+        """Equalizes one BGR uint8 frame. Writes into `out` if given."""
+        if self.backend == "reference":
+            return self._apply_reference(img, out)
+
+        h, w = img.shape[:2]
+        lab, l = self._buffers(h, w)
+        cv2.cvtColor(img, cv2.COLOR_BGR2LAB, dst=lab)
+        cv2.extractChannel(lab, 0, dst=l)
+        self.clahe.apply(l, dst=l)
+        cv2.insertChannel(l, lab, 0)
+        if out is None:
+            return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=out)
+
+    def _apply_reference(self, img, out=None):
+        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+        l, a, b = cv2.split(lab)
+        cl = self.clahe.apply(l)
+        limg = cv2.merge((cl, a, b))
+        if out is None:
+            return cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
+        return cv2.cvtColor(limg, cv2.COLOR_LAB2BGR, dst=out)
+
+    def apply_batch(self, images, out=None):
+        """Equalizes N same-size frames (list or (N, H, W, 3) array).
+
+        Color conversion is per-pixel, so the whole batch is converted in one
+        call on an (N*H, W, 3) view; CLAHE itself still runs per frame because
+        its tiles must not straddle two images.
+        """
+        if self.backend == "reference":
+            if out is None:
+                return np.stack([self._apply_reference(im) for im in images])
+            for i, im in enumerate(images):
+                self._apply_reference(im, out[i])
+            return out
+
+        if isinstance(images, np.ndarray) and images.ndim == 4:
+            batch = np.ascontiguousarray(images)
+        else:
+            shapes = {im.shape for im in images}
+            if len(shapes) != 1:
+                raise ValueError(f"apply_batch needs same-size frames, got {sorted(shapes)}")
+            batch = np.stack(images)
+
+        n, h, w = batch.shape[:3]
+        lab, l = self._buffers(n * h, w)
+        cv2.cvtColor(batch.reshape(n * h, w, 3), cv2.COLOR_BGR2LAB, dst=lab)
+        cv2.extractChannel(lab, 0, dst=l)
+        for i in range(n):
+            plane = l[i * h:(i + 1) * h]
+            self.clahe.apply(plane, dst=plane)
+        cv2.insertChannel(l, lab, 0)
+
+        if out is None:
+            out = np.empty_like(batch)
+        cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=out.reshape(n * h, w, 3))
+        return out
+
+    def apply_file(self, image_path):
+        img = cv2.imread(str(image_path))
+        if img is None: return None
+        return self.apply(img)
+
+    def apply_bytes(self, data):
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None: return None
+        return self.apply(img)
+
+
+def build_clahe(clahe):
+    """dict(clip_limit=..., tile_grid_size=...) -> ClaheEngine (None stays None)."""
+    if clahe is None or isinstance(clahe, ClaheEngine):
+        return clahe
+    return ClaheEngine(**clahe)
@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import shutil
+import cv2
+import numpy as np
+from pathlib import Path
+from tqdm import tqdm
+
+from label_index import LabelIndex
+from shard_format import ShardReader, is_shard_dir
+
+# ==========================================
+# RARE-CELL CROP BANK
+# ==========================================
+# Every labeled instance of BANK_CLASSES in one split, cut out once into a
+# memory-mapped bank that the trainer pastes from (hemo_dataset.CropBankPaste)
+# without decoding the image the cell came from:
+#
+#   <bank>/pixels.bin   crops back to back, HxWx4 uint8 (BGR + alpha)
+#   <bank>/index.npy    one CROP_DTYPE record per crop (class, offset, size,
+#                       size of the frame it was cut from)
+#   <bank>/meta.json    class names, per-class counts, source split
+#
+# The alpha channel is the cell's polygon when the remapped label row has
+# one, otherwise the ellipse inscribed in its box (cells are round), with
+# FEATHER px of soft edge so pasted cells carry no hard seams. Crops are cut
+# from the ETL output, so they are already CLAHE'd like the frames they are
+# pasted into. Reads either the loose YOLO tree or the packed shards.
+
+# ================= CONFIGURATION =================
+DATASET_DIR = "Final_Blood_YOLO_Hierarchical_Remastered_clahe"
+SPLIT = "train"               # Never valid/test: pasted val cells would leak into training
+BANK_DIR = f"{DATASET_DIR}/crop_bank"
+BANK_CLASSES = {              # class id -> name (FINAL_CLASSES ids)
+    1: "RBC_Sickle",
+    4: "Neutrophil",
+    5: "Eosinophil",
+    6: "Basophil",
+    7: "Monocyte",
+    8: "Lymphocyte",
+}
+PAD = 0.15                    # Context kept around the box, as a fraction of its size
+FEATHER = 3                   # Alpha edge blur (px)
+MIN_SIDE = 6                  # Skip boxes smaller than this (px)
+# =================================================
+
+BANK_VERSION = 1
+CROP_DTYPE = np.dtype([
+    ("class_id", np.int16),
+    ("offset", np.int64),
+    ("height", np.int32),
+    ("width", np.int32),
+    ("frame_height", np.int32),
+    ("frame_width", np.int32),
+])
+
+
+class CropBank:
+    """Zero-copy random access to a bank written by build_bank()."""
+
+    def __init__(self, bank_dir):
+        self.bank_dir = Path(bank_dir)
+        with open(self.bank_dir / "meta.json", 'r') as f:
+            meta = json.load(f)
+        if meta.get("version") != BANK_VERSION:
+            raise RuntimeError(f"❌ {bank_dir} was built by another crop_bank.py version; rebuild it")
+        self.names = {int(k): v for k, v in meta["names"].items()}
+        self.index = np.load(self.bank_dir / "index.npy")
+        self.by_class = {c: np.flatnonzero(self.index["class_id"] == c) for c in self.names}
+        self._pixels = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def crop(self, i):
+        """(HxWx4 read-only view, (frame_h, frame_w)) of crop i."""
+        if self._pixels is None:
+            path = self.bank_dir / "pixels.bin"
+            self._pixels = np.memmap(path, dtype=np.uint8, mode='r') if path.stat().st_size else np.empty(0, np.uint8)
+        rec = self.index[i]
+        h, w = int(rec["height"]), int(rec["width"])
+        pixels = self._pixels[rec["offset"]:rec["offset"] + h * w * 4].reshape(h, w, 4)
+        return pixels, (int(rec["frame_height"]), int(rec["frame_width"]))
+
+    def __getstate__(self):
+        # Mapped again in each dataloader worker
+        state = self.__dict__.copy()
+        state["_pixels"] = None
+        return state
+
+
+def parse_rows(text):
+    """Label text -> [(class_id, values)]; values are 4 box or 2N polygon coords."""
+    rows = []
+    for line in text.splitlines():
+        parts = line.split()
+        if parts:
+            rows.append((int(parts[0]), np.asarray(parts[1:], dtype=np.float32)))
+    return rows
+
+
+def cut_crop(img, values):
+    """BGR + alpha crop of one label row, or None if it is too small."""
+    H, W = img.shape[:2]
+    if len(values) == 4:
+        xc, yc, w, h = values * [W, H, W, H]
+        x0, y0, x1, y1 = xc - w / 2, yc - h / 2, xc + w / 2, yc + h / 2
+        polygon = None
+    else:
+        polygon = values.reshape(-1, 2) * [W, H]
+        (x0, y0), (x1, y1) = polygon.min(0), polygon.max(0)
+    w, h = x1 - x0, y1 - y0
+    if min(w, h) < MIN_SIDE:
+        return None
+    cx0, cy0 = max(int(x0 - PAD * w), 0), max(int(y0 - PAD * h), 0)
+    cx1, cy1 = min(int(np.ceil(x1 + PAD * w)), W), min(int(np.ceil(y1 + PAD * h)), H)
+
+    alpha = np.zeros((cy1 - cy0, cx1 - cx0), dtype=np.uint8)
+    if polygon is not None:
+        cv2.fillPoly(alpha, [np.round(polygon - [cx0, cy0]).astype(np.int32)], 255)
+    else:
+        center = (int(round((x0 + x1) / 2 - cx0)), int(round((y0 + y1) / 2 - cy0)))
+        cv2.ellipse(alpha, center, (max(int(w / 2), 1), max(int(h / 2), 1)), 0, 0, 360, 255, -1)
+    if FEATHER:
+        alpha = cv2.GaussianBlur(alpha, (0, 0), FEATHER)
+    return np.dstack([img[cy0:cy1, cx0:cx1], alpha])
+
+
+def iter_sources(root, split, class_ids):
+    """(frame loader, label text) of every image in the split with a bank class."""
+    shard_dir = Path(root) / "shards" / split
+    if is_shard_dir(shard_dir):
+        reader = ShardReader(shard_dir)
+        wanted = {str(c) for c in class_ids}
+        for i in range(len(reader)):
+            text = reader.label_text(i)
+            if any(line.split(maxsplit=1)[0] in wanted for line in text.splitlines() if line.strip()):
+                yield (lambda i=i: reader.image(i)), text
+        return
+
+    index = LabelIndex.open(root)
+    images_dir = Path(root) / split / "images"
+    by_stem = {p.stem: p for p in images_dir.iterdir()} if images_dir.is_dir() else {}
+    for image_id in index.images_with_classes(class_ids, split=split):
+        label_path = Path(root) / index.files[image_id]
+        image_path = by_stem.get(label_path.stem)
+        if image_path is not None:
+            yield (lambda p=image_path: cv2.imread(str(p))), label_path.read_text()
+
+
+def build_bank(root=DATASET_DIR, split=SPLIT, bank_dir=BANK_DIR, classes=BANK_CLASSES):
+    """Cuts every instance of `classes` out of the split. Returns per-class counts."""
+    bank_dir = Path(bank_dir)
+    tmp_dir = bank_dir.with_name(bank_dir.name + ".tmp")
+    if tmp_dir.exists(): shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    records, pos = [], 0
+    counts = {name: 0 for name in classes.values()}
+    with open(tmp_dir / "pixels.bin", 'wb') as pixels:
+        for load, text in tqdm(iter_sources(root, split, list(classes)), desc="Cutting crops"):
+            img = None
+            for class_id, values in parse_rows(text):
+                if class_id not in classes:
+                    continue
+                if img is None:
+                    img = load()
+                    if img is None: break
+                crop = cut_crop(img, values)
+                if crop is None:
+                    continue
+                pixels.write(np.ascontiguousarray(crop).tobytes())
+                records.append((class_id, pos, crop.shape[0], crop.shape[1], img.shape[0], img.shape[1]))
+                pos += crop.nbytes
+                counts[classes[class_id]] += 1
+
+    np.save(tmp_dir / "index.npy", np.array(records, dtype=CROP_DTYPE))
+    with open(tmp_dir / "meta.json", 'w') as f:
+        json.dump({"version": BANK_VERSION, "source": str(Path(root) / split),
+                   "names": {str(k): v for k, v in classes.items()}, "counts": counts}, f, indent=2)
+    if bank_dir.exists(): shutil.rmtree(bank_dir)
+    os.replace(tmp_dir, bank_dir)
+    return counts
+
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else DATASET_DIR
+    bank_dir = sys.argv[2] if len(sys.argv) > 2 else BANK_DIR
+    counts = build_bank(root, SPLIT, bank_dir)
+    size = (Path(bank_dir) / "pixels.bin").stat().st_size
+    print(f"🏦 Crop bank {bank_dir}: {sum(counts.values())} crops, {size / 1e6:.1f} MB")
+    for name, n in counts.items():
+        print(f"   {name:<12} {n}")
+
+if __name__ == "__main__":
+    main()
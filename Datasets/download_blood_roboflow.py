@@ -1,79 +1,321 @@
 import os
+import json
 import shutil
-from roboflow import Roboflow
+import hashlib
+import zipfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from source_archive import SourceArchive
 
 # ==========================================
 # 1. SETUP
 # ==========================================
-# Your provided API Key
-rf = Roboflow(api_key="PjUym3maiIS3wU8Ce7zp")
+# Your provided API Key (ROBOFLOW_API_KEY overrides it)
+API_KEY = os.environ.get("ROBOFLOW_API_KEY", "PjUym3maiIS3wU8Ce7zp")
 
 # Create a clean workspace folder
-workspace_dir = "Blood_Roboflow_Workspace_Remastered"
-os.makedirs(workspace_dir, exist_ok=True)
-os.chdir(workspace_dir)
+WORKSPACE_DIR = "Blood_Roboflow_Workspace_Remastered"
+
+# --- SOURCE BACKEND ---
+# "roboflow": download from Roboflow Universe
+# "archive":  copy from ARCHIVE_DIR (<name>.zip or <name>/), no network needed
+BACKEND = "roboflow"
+ARCHIVE_DIR = "Blood_Roboflow_Archive"
+MIRROR_TO_ARCHIVE = True   # After a Roboflow download, also zip it into ARCHIVE_DIR
+                           # (merge_remap_and_clahe.py can read those zips directly)
+EXTRACT = True             # False: keep only the export zips, as ARCHIVE_DIR/<name>.zip, and
+                           # never extract them (merge_remap_and_clahe.py SOURCE_MODE = "archives")
+
+# --- VERIFICATION ---
+# Every file's sha256 is pinned in LOCK_FILE. A rerun skips sources whose
+# folder still matches the lock; anything else is re-fetched (into a scratch
+# folder, so a failed fetch never destroys the copy we already had).
+# With EXTRACT = False the members of each zip are checked the same way, and
+# the lock lives in ARCHIVE_DIR.
+LOCK_FILE = "datasets.lock.json"
+LOCK_VERSION = 1
+MAX_PARALLEL = 3  # Sources fetched at once
+HASH_WORKERS = 8  # Threads hashing files of one source
 
-print(f"🚀 Starting download in: {os.getcwd()}")
+SOURCES = [
+    # folder,        roboflow workspace,          project,                version
+    dict(name="Raabin_WBC",  workspace="memoria",                   project="raabin",               version=4),
+    dict(name="BCCD",        workspace="joseph-nelson",             project="bccd",                 version=4),  # v4 is usually stable
+    dict(name="Sickle_Cell", workspace="researchmethodology-bwfx1", project="sickle-cell-detector", version=2),
+]
+EXPORT_FORMAT = "yolov11"
 
 # ==========================================
-# 2. DOWNLOAD RAABIN (Version 4)
+# 2. SOURCE BACKENDS
 # ==========================================
-try:
-    print("\n⬇️  Downloading Raabin (Memoria)...")
-    project = rf.workspace("memoria").project("raabin")
-    version = project.version(4)
-    dataset = version.download("yolov11")
-    
-    # Rename folder to be consistent
-    if os.path.exists(dataset.location):
-        # Remove old folder if exists to prevent conflicts
-        if os.path.exists("Raabin_WBC"): shutil.rmtree("Raabin_WBC")
-        os.rename(dataset.location, "Raabin_WBC")
-        print("✅ Raabin secured in folder: Raabin_WBC")
-
-except Exception as e:
-    print(f"❌ Raabin Download Failed: {e}")
+def dataset_id(source):
+    """The Roboflow export a folder holds, whichever backend delivered it."""
+    return f"{source['workspace']}/{source['project']}/{source['version']}/{EXPORT_FORMAT}"
+
+class RoboflowBackend:
+    """Downloads a dataset version export from Roboflow Universe."""
+
+    def __init__(self):
+        from roboflow import Roboflow  # Only needed when actually downloading
+        self.rf = Roboflow(api_key=API_KEY)
+
+    def describe(self, source):
+        return f"roboflow:{dataset_id(source)}"
+
+    def fetch(self, source, dest):
+        project = self.rf.workspace(source["workspace"]).project(source["project"])
+        dataset = project.version(source["version"]).download(EXPORT_FORMAT, location=str(dest), overwrite=True)
+        if Path(dataset.location).resolve() != Path(dest).resolve():
+            shutil.move(dataset.location, dest)
+
+    def fetch_zip(self, source, dest_zip):
+        """Streams the export zip to dest_zip as is (download() always extracts it)."""
+        import requests
+        from roboflow.adapters import rfapi
+        version = self.rf.workspace(source["workspace"]).project(source["project"]).version(source["version"])
+        version.export(EXPORT_FORMAT)  # Waits until Roboflow has generated the export
+        info = rfapi.get_version_export(api_key=API_KEY, workspace_url=source["workspace"],
+                                        project_url=source["project"], version=source["version"],
+                                        format=EXPORT_FORMAT)
+        with requests.get(info["export"]["link"], stream=True, timeout=60) as r:
+            r.raise_for_status()
+            with open(dest_zip, 'wb') as f:
+                for chunk in r.iter_content(1 << 20):
+                    f.write(chunk)
+
+
+class ArchiveBackend:
+    """Serves datasets from a local mirror: ARCHIVE_DIR/<name>.zip or ARCHIVE_DIR/<name>/."""
+
+    def __init__(self, archive_dir=None):
+        self.archive_dir = Path(archive_dir or ARCHIVE_DIR)
+
+    def describe(self, source):
+        return f"archive:{self.archive_dir / source['name']}"
+
+    def fetch(self, source, dest):
+        zip_path = self.archive_dir / f"{source['name']}.zip"
+        dir_path = self.archive_dir / source["name"]
+        if zip_path.exists():
+            with zipfile.ZipFile(zip_path) as zf:
+                zf.extractall(dest)
+        elif dir_path.is_dir():
+            shutil.copytree(dir_path, dest)
+        else:
+            raise FileNotFoundError(f"{zip_path} (or {dir_path}/) not in the archive")
+        # Zips made by hand often wrap everything in one top-level folder
+        entries = list(Path(dest).iterdir())
+        if len(entries) == 1 and entries[0].is_dir() and not (Path(dest) / "data.yaml").exists():
+            inner = entries[0]
+            for item in list(inner.iterdir()):
+                shutil.move(str(item), dest)
+            inner.rmdir()
+
+    def fetch_zip(self, source, dest_zip):
+        zip_path = self.archive_dir / f"{source['name']}.zip"
+        dir_path = self.archive_dir / source["name"]
+        if zip_path.exists():
+            shutil.copyfile(zip_path, dest_zip)
+        elif dir_path.is_dir():
+            shutil.move(shutil.make_archive(str(dest_zip.with_suffix("")), "zip", root_dir=dir_path), dest_zip)
+        else:
+            raise FileNotFoundError(f"{zip_path} (or {dir_path}/) not in the archive")
+
+
+BACKENDS = {"roboflow": RoboflowBackend, "archive": ArchiveBackend}
 
 # ==========================================
-# 3. DOWNLOAD BCCD (Platelets/RBC)
+# 3. LOCK FILE / CHECKSUMS
 # ==========================================
-try:
-    print("\n⬇️  Downloading BCCD...")
-    # Standard BCCD from Roboflow Universe
-    project = rf.workspace("joseph-nelson").project("bccd")
-    version = project.version(4) # v4 is usually stable
-    dataset = version.download("yolov11")
-    
-    if os.path.exists(dataset.location):
-        if os.path.exists("BCCD"): shutil.rmtree("BCCD")
-        os.rename(dataset.location, "BCCD")
-        print("✅ BCCD secured in folder: BCCD")
-
-except Exception as e:
-    print(f"❌ BCCD Download Failed: {e}")
+def load_lock(path):
+    if path.exists():
+        with open(path, 'r') as f:
+            lock = json.load(f)
+        if lock.get("version") == LOCK_VERSION:
+            return lock
+    return {"version": LOCK_VERSION, "sources": {}}
+
+def save_lock(lock, path):
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, 'w') as f:
+        json.dump(lock, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def checksum_tree(root):
+    """{relative posix path: {"sha256", "size"}} for every file under root."""
+    root = Path(root)
+    files = sorted(p for p in root.rglob("*") if p.is_file())
+    with ThreadPoolExecutor(HASH_WORKERS) as ex:
+        digests = list(ex.map(sha256_file, files))
+    return {p.relative_to(root).as_posix(): {"sha256": d, "size": p.stat().st_size}
+            for p, d in zip(files, digests)}
+
+def checksum_zip(path):
+    """checksum_tree() for the members of an export zip, hashed straight out of it."""
+    archive = SourceArchive(path)
+    files = {}
+    with zipfile.ZipFile(path) as zf:
+        for member, info in archive.members.items():
+            if not member.startswith(archive.prefix): continue
+            h = hashlib.sha256()
+            with zf.open(info) as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            files[member[len(archive.prefix):]] = {"sha256": h.hexdigest(), "size": info.file_size}
+    return dict(sorted(files.items()))
+
+def verify_tree(root, expected):
+    """Returns a list of problems (empty = folder matches the lock exactly)."""
+    if not Path(root).is_dir():
+        return ["missing folder"]
+    return compare_files(checksum_tree(root), expected)
+
+def verify_zip(path, expected):
+    """verify_tree() for an export zip."""
+    if not Path(path).is_file():
+        return ["missing zip"]
+    return compare_files(checksum_zip(path), expected)
+
+def lock_matches(source, lock_entry):
+    """The lock pins this exact export (a bumped version= in SOURCES must be re-fetched)."""
+    return bool(lock_entry) and lock_entry.get("dataset") == dataset_id(source)
+
+def compare_files(actual, expected):
+    problems = [f"missing {rel}" for rel in expected if rel not in actual]
+    problems += [f"unexpected {rel}" for rel in actual if rel not in expected]
+    problems += [f"checksum {rel}" for rel, meta in actual.items()
+                 if rel in expected and meta["sha256"] != expected[rel]["sha256"]]
+    return problems
+
+# ==========================================
+# 4. ACQUIRE ONE SOURCE
+# ==========================================
+def acquire(source, backend, workspace, lock_entry):
+    """Fetches one source unless it already matches the lock. Returns (status, files)."""
+    name = source["name"]
+    target = workspace / name
+    origin = backend.describe(source)
+
+    if lock_entry and not lock_matches(source, lock_entry):
+        print(f"   ⚠️  {name}: lock pins {lock_entry.get('dataset')}, SOURCES asks for {dataset_id(source)}, re-fetching")
+        lock_entry = None
+    if lock_entry and target.is_dir():
+        problems = verify_tree(target, lock_entry["files"])
+        if not problems:
+            return "verified", lock_entry["files"]
+        print(f"   ⚠️  {name}: {len(problems)} mismatches vs lock (e.g. {problems[0]}), re-fetching")
+
+    scratch = workspace / f".{name}.partial"
+    if scratch.exists(): shutil.rmtree(scratch)
+    try:
+        backend.fetch(source, scratch)
+        files = checksum_tree(scratch)
+        if not files:
+            raise RuntimeError("fetched folder is empty")
+        # A mirror must reproduce what the lock pinned; a fresh download (re)pins it
+        if isinstance(backend, ArchiveBackend) and lock_entry:
+            problems = verify_tree(scratch, lock_entry["files"])
+            if problems:
+                raise RuntimeError(f"archive does not match lock: {len(problems)} mismatches (e.g. {problems[0]})")
+        if target.exists(): shutil.rmtree(target)
+        os.replace(scratch, target)
+    finally:
+        if scratch.exists(): shutil.rmtree(scratch)
+
+    if MIRROR_TO_ARCHIVE and isinstance(backend, RoboflowBackend):
+        Path(ARCHIVE_DIR).mkdir(parents=True, exist_ok=True)
+        shutil.make_archive(str(Path(ARCHIVE_DIR) / name), "zip", root_dir=target)
+    return f"fetched from {origin}", files
+
+def acquire_zip(source, backend, archive_dir, lock_entry):
+    """acquire() for EXTRACT = False: the source ends up as archive_dir/<name>.zip, never extracted."""
+    name = source["name"]
+    target = archive_dir / f"{name}.zip"
+    origin = backend.describe(source)
+
+    if lock_entry and not lock_matches(source, lock_entry):
+        print(f"   ⚠️  {name}: lock pins {lock_entry.get('dataset')}, SOURCES asks for {dataset_id(source)}, re-fetching")
+        lock_entry = None
+    if lock_entry and target.exists():
+        problems = verify_zip(target, lock_entry["files"])
+        if not problems:
+            return "verified", lock_entry["files"]
+        print(f"   ⚠️  {name}: {len(problems)} mismatches vs lock (e.g. {problems[0]}), re-fetching")
+
+    scratch = archive_dir / f".{name}.partial.zip"
+    if scratch.exists(): scratch.unlink()
+    try:
+        backend.fetch_zip(source, scratch)
+        files = checksum_zip(scratch)
+        if not files:
+            raise RuntimeError("fetched zip is empty")
+        if isinstance(backend, ArchiveBackend) and lock_entry:
+            problems = compare_files(files, lock_entry["files"])
+            if problems:
+                raise RuntimeError(f"archive does not match lock: {len(problems)} mismatches (e.g. {problems[0]})")
+        os.replace(scratch, target)
+    finally:
+        if scratch.exists(): scratch.unlink()
+    return f"fetched from {origin}", files
 
 # ==========================================
-# 4. DOWNLOAD SICKLE CELL (Anemia) - UPDATED
+# 5. MAIN
 # ==========================================
-try:
-    print("\n⬇️  Downloading Sickle Cell (researchmethodology-bwfx1)...")
-    
-    # --- UPDATED SOURCE ---
-    project = rf.workspace("researchmethodology-bwfx1").project("sickle-cell-detector")
-    version = project.version(2)
-    dataset = version.download("yolov11")
-    
-    if os.path.exists(dataset.location):
-        if os.path.exists("Sickle_Cell"): shutil.rmtree("Sickle_Cell")
-        os.rename(dataset.location, "Sickle_Cell")
-        print("✅ Sickle Cell secured in folder: Sickle_Cell")
-
-except Exception as e:
-    print(f"❌ Sickle Cell Download Failed: {e}")
-
-print("\n-------------------------------------------------------------")
-print("🎉 ALL DOWNLOADS FINISHED.")
-print("   Location: Blood_Roboflow_Workspace/")
-print("   Next Step: You MUST run the 'Class Remapper' script.")
-print("   (Because '0' means different things in each folder!)")
-print("-------------------------------------------------------------")
\ No newline at end of file
+def main():
+    # No extraction: the zips are the dataset, so they (and the lock) live in ARCHIVE_DIR
+    workspace = Path(WORKSPACE_DIR if EXTRACT else ARCHIVE_DIR).resolve()
+    workspace.mkdir(parents=True, exist_ok=True)
+    lock_path = workspace / LOCK_FILE
+    lock = load_lock(lock_path)
+    backend = BACKENDS[BACKEND]()
+    fetch = acquire if EXTRACT else acquire_zip
+
+    print(f"🚀 Starting download in: {workspace}{'' if EXTRACT else ' (zips only, no extraction)'}")
+    print(f"🔌 Backend: {BACKEND}, {min(MAX_PARALLEL, len(SOURCES))} sources in parallel")
+
+    start = time.perf_counter()
+    failed = []
+    with ThreadPoolExecutor(MAX_PARALLEL) as ex:
+        futures = {ex.submit(fetch, src, backend, workspace, lock["sources"].get(src["name"])): src
+                   for src in SOURCES}
+        for fut in as_completed(futures):
+            src = futures[fut]
+            name = src["name"]
+            try:
+                status, files = fut.result()
+            except Exception as e:
+                failed.append(name)
+                print(f"❌ {name} Download Failed: {e}")
+                continue
+            lock["sources"][name] = {
+                "dataset": dataset_id(src),
+                "files": files,
+            }
+            save_lock(lock, lock_path)
+            size_mb = sum(f["size"] for f in files.values()) / 1e6
+            print(f"✅ {name}: {status} ({len(files)} files, {size_mb:.1f} MB)")
+
+    print("\n-------------------------------------------------------------")
+    if failed:
+        print(f"⚠️  FINISHED WITH FAILURES: {', '.join(failed)} (rerun to retry only those)")
+    else:
+        print(f"🎉 ALL DOWNLOADS FINISHED in {time.perf_counter() - start:.1f}s.")
+    print(f"   Location: {workspace}/")
+    print(f"   Lock file: {workspace / LOCK_FILE}")
+    if not EXTRACT:
+        print("   Set SOURCE_MODE = \"archives\" in merge_remap_and_clahe.py to read the zips directly.")
+    print("   Next Step: You MUST run the 'Class Remapper' script.")
+    print("   (Because '0' means different things in each folder!)")
+    print("-------------------------------------------------------------")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import numpy as np
+from pathlib import Path
+
+# ==========================================
+# COLUMNAR LABEL INDEX
+# ==========================================
+# Every YOLO label row of a dataset (train/valid/test) in a handful of
+# memory-mapped .npy columns:
+#
+#   image_id, class_id, x, y, w, h      (one entry per box)
+#
+# plus a per-image table (label file, split, size/mtime for change detection).
+# Built once, then refreshed incrementally: only label files whose size or
+# mtime changed are re-parsed. Class histograms, rare-class lookups and
+# oversampling multipliers become NumPy reductions over the columns.
+
+INDEX_DIR = ".label_index"
+INDEX_VERSION = 1
+SPLITS = ['train', 'valid', 'test']
+NUM_CLASSES = 9
+
+BOX_COLUMNS = {
+    "image_id": np.int32,
+    "class_id": np.int16,
+    "x": np.float32,
+    "y": np.float32,
+    "w": np.float32,
+    "h": np.float32,
+}
+IMAGE_COLUMNS = {
+    "split": np.int8,
+    "size": np.int64,
+    "mtime_ns": np.int64,
+}
+
+
+def parse_label_lines(lines):
+    """YOLO label rows -> (class_ids, boxes[N, 4]). Polygon rows become their bbox."""
+    class_ids, boxes = [], []
+    for line in lines:
+        parts = line.split()
+        if not parts: continue
+        class_ids.append(int(parts[0]))
+        values = [float(v) for v in parts[1:]]
+        if len(values) == 4:
+            boxes.append(values)
+        else:  # segment: x1 y1 x2 y2 ...
+            xs, ys = values[0::2], values[1::2]
+            x0, x1, y0, y1 = min(xs), max(xs), min(ys), max(ys)
+            boxes.append([(x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0])
+    return class_ids, boxes
+
+
+def parse_label_file(path):
+    """One YOLO label file -> (class_ids, boxes[N, 4])."""
+    with open(path, 'r') as f:
+        return parse_label_lines(f)
+
+
+def scan_label_files(root):
+    """{relative label path: (split index, size, mtime_ns)} for every split."""
+    found = {}
+    for split_idx, split in enumerate(SPLITS):
+        label_dir = Path(root) / split / "labels"
+        if not label_dir.is_dir(): continue
+        with os.scandir(label_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".txt"):
+                    st = entry.stat()
+                    found[f"{split}/labels/{entry.name}"] = (split_idx, st.st_size, st.st_mtime_ns)
+    return found
+
+
+class LabelIndex:
+    """Memory-mapped label columns for one dataset root. Use LabelIndex.open()."""
+
+    def __init__(self, root):
+        self.root = Path(root).resolve()
+        self.index_dir = self.root / INDEX_DIR
+        self.files = []     # image_id -> relative label path
+        self.columns = {}   # box columns (memory-mapped)
+        self.images = {}    # per-image columns
+        self._ids = None
+
+    # ---------- build / update ----------
+    @classmethod
+    def open(cls, root, update=True):
+        """Loads the index, refreshing it first unless update=False."""
+        index = cls(root)
+        if not index._load() or update:
+            index.update()
+        return index
+
+    def _load(self):
+        meta_path = self.index_dir / "meta.json"
+        if not meta_path.exists():
+            return False
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            return False
+        self.files = meta["files"]
+        self.columns = {k: np.load(self.index_dir / f"{k}.npy", mmap_mode='r') for k in BOX_COLUMNS}
+        self.images = {k: np.load(self.index_dir / f"img_{k}.npy", mmap_mode='r') for k in IMAGE_COLUMNS}
+        self._ids = None
+        return True
+
+    def update(self):
+        """Re-parses only new/changed label files. Returns (#parsed, #removed)."""
+        found = scan_label_files(self.root)
+
+        keep_old = np.zeros(len(self.files), dtype=bool)
+        for old_id, rel in enumerate(self.files):
+            current = found.get(rel)
+            if current is not None and current == (int(self.images["split"][old_id]),
+                                                   int(self.images["size"][old_id]),
+                                                   int(self.images["mtime_ns"][old_id])):
+                keep_old[old_id] = True
+        kept_files = [rel for rel, keep in zip(self.files, keep_old) if keep]
+        kept_set = set(kept_files)
+        to_parse = sorted(rel for rel in found if rel not in kept_set)
+        removed = len(self.files) - len(kept_files)
+
+        if not to_parse and not removed and self.columns:
+            return 0, 0
+
+        # Old rows of unchanged files, with image ids compacted to 0..len(kept)-1
+        new_id_of_old = np.cumsum(keep_old) - 1
+        if self.columns:
+            row_mask = keep_old[np.asarray(self.columns["image_id"])]
+            cols = {k: np.asarray(v)[row_mask] for k, v in self.columns.items()}
+            cols["image_id"] = new_id_of_old[cols["image_id"]].astype(BOX_COLUMNS["image_id"])
+            imgs = {k: np.asarray(v)[keep_old] for k, v in self.images.items()}
+        else:
+            cols = {k: np.empty(0, dtype=t) for k, t in BOX_COLUMNS.items()}
+            imgs = {k: np.empty(0, dtype=t) for k, t in IMAGE_COLUMNS.items()}
+
+        # Freshly parsed files
+        new_cls, new_boxes, new_ids = [], [], []
+        for offset, rel in enumerate(to_parse):
+            class_ids, boxes = parse_label_file(self.root / rel)
+            new_cls.extend(class_ids)
+            new_boxes.extend(boxes)
+            new_ids.extend([len(kept_files) + offset] * len(class_ids))
+        new_boxes = np.asarray(new_boxes, dtype=np.float32).reshape(-1, 4)
+        parsed = {
+            "image_id": np.asarray(new_ids, dtype=BOX_COLUMNS["image_id"]),
+            "class_id": np.asarray(new_cls, dtype=BOX_COLUMNS["class_id"]),
+            "x": new_boxes[:, 0], "y": new_boxes[:, 1], "w": new_boxes[:, 2], "h": new_boxes[:, 3],
+        }
+        stats = np.asarray([found[rel] for rel in to_parse], dtype=np.int64).reshape(-1, 3)
+        parsed_imgs = {"split": stats[:, 0], "size": stats[:, 1], "mtime_ns": stats[:, 2]}
+
+        cols = {k: np.concatenate([cols[k], parsed[k]]).astype(t) for k, t in BOX_COLUMNS.items()}
+        imgs = {k: np.concatenate([imgs[k], parsed_imgs[k]]).astype(t) for k, t in IMAGE_COLUMNS.items()}
+        self._write(kept_files + to_parse, cols, imgs)
+        self._load()
+        return len(to_parse), removed
+
+    def _write(self, files, cols, imgs):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        # Drop our own maps before overwriting the files they point at
+        self.columns, self.images = {}, {}
+        for name, arr in [(k, v) for k, v in cols.items()] + [(f"img_{k}", v) for k, v in imgs.items()]:
+            tmp = self.index_dir / f"{name}.tmp.npy"
+            np.save(tmp, arr)
+            os.replace(tmp, self.index_dir / f"{name}.npy")
+        tmp = self.index_dir / "meta.json.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({"version": INDEX_VERSION, "splits": SPLITS, "files": files}, f)
+        os.replace(tmp, self.index_dir / "meta.json")
+
+    # ---------- lookups ----------
+    @property
+    def num_images(self):
+        return len(self.files)
+
+    @property
+    def num_boxes(self):
+        return len(self.columns["image_id"]) if self.columns else 0
+
+    @property
+    def num_classes(self):
+        """NUM_CLASSES, or more if a label uses a higher class id."""
+        if not self.num_boxes:
+            return NUM_CLASSES
+        return max(NUM_CLASSES, int(self.columns["class_id"].max()) + 1)
+
+    def image_id(self, label_path):
+        """Image id of a label file (absolute or root-relative path), or -1."""
+        if self._ids is None:
+            self._ids = {rel: i for i, rel in enumerate(self.files)}
+        rel = Path(label_path)
+        if rel.is_absolute():
+            try:
+                rel = rel.resolve().relative_to(self.root)
+            except ValueError:
+                return -1
+        return self._ids.get(rel.as_posix(), -1)
+
+    def _box_mask(self, split=None, image_ids=None):
+        mask = np.ones(self.num_boxes, dtype=bool)
+        if split is not None:
+            split_of_image = np.asarray(self.images["split"])
+            mask &= split_of_image[self.columns["image_id"]] == SPLITS.index(split)
+        if image_ids is not None:
+            selected = np.zeros(self.num_images, dtype=bool)
+            selected[np.asarray(image_ids)] = True
+            mask &= selected[self.columns["image_id"]]
+        return mask
+
+    # ---------- vectorized queries ----------
+    def class_histogram(self, split=None, image_ids=None):
+        """Box count per class."""
+        cls = np.asarray(self.columns["class_id"])[self._box_mask(split, image_ids)]
+        return np.bincount(cls, minlength=self.num_classes)
+
+    def image_class_counts(self):
+        """(num_images, num_classes) matrix of box counts."""
+        num_classes = self.num_classes
+        flat = self.columns["image_id"].astype(np.int64) * num_classes + self.columns["class_id"]
+        return np.bincount(flat, minlength=self.num_images * num_classes).reshape(self.num_images, num_classes)
+
+    def images_with_classes(self, class_ids, split=None):
+        """Image ids containing at least one box of any of `class_ids`."""
+        mask = self._box_mask(split) & np.isin(self.columns["class_id"], list(class_ids))
+        return np.unique(np.asarray(self.columns["image_id"])[mask])
+
+    def image_multipliers(self, oversample_config):
+        """Per-image max multiplier over its classes (1 for images with no boosted class)."""
+        table = np.ones(max(self.num_classes, max(oversample_config, default=0) + 1), dtype=np.int64)
+        for class_id, multiplier in oversample_config.items():
+            table[class_id] = multiplier
+        multipliers = np.ones(self.num_images, dtype=np.int64)
+        np.maximum.at(multipliers, self.columns["image_id"], table[self.columns["class_id"]])
+        return multipliers
+
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else "Final_Blood_YOLO_Hierarchical_Remastered_clahe"
+    index = LabelIndex.open(root, update=False)
+    parsed, removed = index.update()
+    print(f"🗂️  Label index for {root}: {index.num_images} label files, {index.num_boxes} boxes "
+          f"({parsed} re-parsed, {removed} removed)")
+    for split in SPLITS:
+        print(f"   {split:<5} {index.class_histogram(split).tolist()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import os
+import json
+import math
+import shutil
+import cv2
+import numpy as np
+from pathlib import Path
+
+from shard_format import ShardReader, is_shard_dir
+
+# ==========================================
+# TRAINING-RESOLUTION LETTERBOX CACHE
+# ==========================================
+# Every epoch of every run decodes the full-resolution Raabin / BCCD /
+# Sickle_Cell frames and resizes them to imgsz again. The ETL can do that
+# once (merge_remap_and_clahe.py LETTERBOX_IMGSZ) into
+#
+#   <dataset>/letterbox_<S>/<split>/images.npy    (N, S, S, 3) uint8 slots, memory-mapped;
+#                                                 frame i is images[i, :h, :w]
+#   <dataset>/letterbox_<S>/<split>/shapes.npy    (N, 4) int32 h, w (resized), h0, w0 (source);
+#                                                 all 0 = source frame was unreadable
+#   <dataset>/letterbox_<S>/<split>/labels.bin    label files back to back, as written by the ETL
+#   <dataset>/letterbox_<S>/<split>/label_offsets.npy  (N + 1,) int64, label i = labels.bin[off[i]:off[i+1]]
+#   <dataset>/letterbox_<S>/<split>/meta.json     names + content keys
+#
+# Frames are the ETL output (CLAHE already applied) with the long side resized
+# to S exactly like BaseDataset.load_image() does it, and nothing else: the
+# padding stays with Mosaic / LetterBox, so augmentation sees the same frames
+# as without the cache. The label text is kept verbatim (polygon rows
+# included, for copy_paste and rotation), since normalized coordinates do not
+# change with the resize. The
+# Hemo trainer reads a sample as one slice of the map
+# (build_trainer(letterbox_cache=True)). Rebuilds copy every row whose source
+# image + label did not change.
+#
+# Size: S*S*3 bytes per image slot (1.2 MB at 640), uncompressed on disk.
+
+CACHE_VERSION = 3
+
+
+def cache_dir(root, imgsz):
+    return Path(root) / f"letterbox_{imgsz}"
+
+
+def is_cache_dir(path):
+    return (Path(path) / "images.npy").exists() and (Path(path) / "meta.json").exists()
+
+
+def cache_key(im_file):
+    """"<split>/<name>" of a loose (<split>/images/<name>) or shard (shards/<split>/<name>) path."""
+    p = Path(im_file)
+    split = p.parent.parent.name if p.parent.name == "images" else p.parent.name
+    return f"{split}/{p.name}"
+
+
+def resize_frame(img, size):
+    """Long side to `size`, keeping the aspect ratio: the resize of BaseDataset.load_image(rect_mode=True)."""
+    h0, w0 = img.shape[:2]
+    r = size / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), size), min(math.ceil(h0 * r), size)
+        img = cv2.resize(img, (w, h), interpolation=cv2.INTER_LINEAR)
+    return img
+
+
+class LetterboxCache:
+    """Read access to one split written by build_split()."""
+
+    def __init__(self, split_dir):
+        self.split_dir = Path(split_dir)
+        with open(self.split_dir / "meta.json", 'r') as f:
+            meta = json.load(f)
+        if meta.get("version") != CACHE_VERSION:
+            raise RuntimeError(f"❌ {split_dir} was built by another letterbox_cache.py version; re-run the ETL")
+        self.names = meta["names"]
+        self.keys = meta["keys"]
+        self.imgsz = meta["imgsz"]
+        self.shapes = np.load(self.split_dir / "shapes.npy")
+        self.valid = self.shapes.all(1)
+        self.label_offsets = np.load(self.split_dir / "label_offsets.npy")
+        self._images = None
+        self._labels = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def images(self):
+        if self._images is None:
+            self._images = np.load(self.split_dir / "images.npy", mmap_mode='r')
+        return self._images
+
+    def image(self, i):
+        """Copy of frame i (the caller may draw on it)."""
+        h, w = self.shapes[i, :2]
+        return np.array(self.images[i, :h, :w])
+
+    def source_shape(self, i):
+        """(h0, w0) of the source frame before the resize."""
+        return int(self.shapes[i, 2]), int(self.shapes[i, 3])
+
+    def label_text(self, i):
+        """YOLO label text of frame i, exactly as the ETL wrote it."""
+        if self._labels is None:
+            path = self.split_dir / "labels.bin"
+            self._labels = np.memmap(path, dtype=np.uint8, mode='r') if path.stat().st_size else np.empty(0, np.uint8)
+        return self._labels[self.label_offsets[i]:self.label_offsets[i + 1]].tobytes().decode()
+
+    def __getstate__(self):
+        # Mapped again in each dataloader worker
+        state = self.__dict__.copy()
+        state["_images"], state["_labels"] = None, None
+        return state
+
+
+# --- ETL side ---
+# Per process (pool workers open their own): images.npy maps being written, shard readers
+_TARGETS = {}
+_READERS = {}
+
+
+def _target(path):
+    mm = _TARGETS.get(path)
+    if mm is None:
+        mm = _TARGETS[path] = np.load(path, mmap_mode='r+')
+    return mm
+
+
+def _reader(shard_dir):
+    reader = _READERS.get(shard_dir)
+    if reader is None:
+        reader = _READERS[shard_dir] = ShardReader(shard_dir)
+    return reader
+
+
+def write_frame(task):
+    """Decodes one output frame and writes it resized into slot `row`. Returns (h, w, h0, w0), zeros if unreadable."""
+    images_path, row, size, source = task
+    if isinstance(source, tuple):  # (shard dir, record)
+        img = _reader(source[0]).image(source[1])
+    else:
+        img = cv2.imread(source)
+    if img is None:
+        return (0, 0, 0, 0)
+    frame = resize_frame(img, size)
+    h, w = frame.shape[:2]
+    _target(images_path)[row, :h, :w] = frame
+    return (h, w, *img.shape[:2])
+
+
+def split_sources(root, split):
+    """[(name, key, image source, label text loader)] of one ETL output split."""
+    shard_dir = Path(root) / "shards" / split
+    if is_shard_dir(shard_dir):
+        reader = _reader(str(shard_dir))
+        sources = []
+        for i, (name, key) in enumerate(zip(reader.names, reader.keys)):
+            rec = reader.index[i]
+            key = key or f"{rec['shard']}:{rec['offset']}:{rec['length']}"  # Shards written without content keys
+            sources.append((name, key, (str(shard_dir), i), lambda i=i: reader.label_text(i)))
+        return sources
+
+    images_dir = Path(root) / split / "images"
+    labels_dir = Path(root) / split / "labels"
+    sources = []
+    if not images_dir.is_dir():
+        return sources
+    for entry in sorted(os.scandir(images_dir), key=lambda e: e.name):
+        if not entry.is_file():
+            continue
+        label = labels_dir / (Path(entry.name).stem + ".txt")
+        st = entry.stat()
+        lst = label.stat() if label.exists() else None
+        key = f"{st.st_size}:{st.st_mtime_ns}|{lst.st_size}:{lst.st_mtime_ns}" if lst else f"{st.st_size}:{st.st_mtime_ns}|"
+        sources.append((entry.name, key, entry.path, lambda p=label: p.read_text() if p.exists() else ""))
+    return sources
+
+
+def build_split(root, split, imgsz, pool=None, chunksize=16):
+    """(Re)builds <root>/letterbox_<imgsz>/<split>. Returns (#frames written, #reused)."""
+    split_dir = cache_dir(root, imgsz) / split
+    sources = split_sources(root, split)
+    if not sources:
+        return 0, 0
+    try:
+        previous = LetterboxCache(split_dir) if is_cache_dir(split_dir) else None
+    except RuntimeError:  # Written by an older version: rebuild from scratch
+        previous = None
+    if previous is not None and previous.keys == [s[1] for s in sources]:
+        return 0, len(sources)  # Nothing changed
+    reusable = {key: i for i, key in enumerate(previous.keys)} if previous is not None else {}
+
+    tmp_dir = split_dir.with_name(split_dir.name + ".tmp")
+    if tmp_dir.exists(): shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    images_path = str(tmp_dir / "images.npy")
+    images = np.lib.format.open_memmap(images_path, mode='w+', dtype=np.uint8,
+                                       shape=(len(sources), imgsz, imgsz, 3))
+
+    tasks, labels, shapes = [], [None] * len(sources), np.zeros((len(sources), 4), dtype=np.int32)
+    for row, (name, key, source, _) in enumerate(sources):
+        old = reusable.get(key)
+        if old is not None:
+            images[row] = previous.images[old]
+            labels[row] = previous.label_text(old)
+            shapes[row] = previous.shapes[old]
+        else:
+            tasks.append((images_path, row, imgsz, source))
+    images.flush()
+    del images
+
+    results = pool.imap(write_frame, tasks, chunksize=chunksize) if pool else map(write_frame, tasks)
+    for task, shape in zip(tasks, results):
+        row = task[1]
+        shapes[row] = shape
+        labels[row] = sources[row][3]() if all(shape) else ""
+    _TARGETS.pop(images_path, None)
+
+    encoded = [text.encode() for text in labels]
+    offsets = np.zeros(len(sources) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    with open(tmp_dir / "labels.bin", 'wb') as f:
+        f.write(b"".join(encoded))
+    np.save(tmp_dir / "label_offsets.npy", offsets)
+    np.save(tmp_dir / "shapes.npy", shapes)
+    with open(tmp_dir / "meta.json", 'w') as f:
+        json.dump({"version": CACHE_VERSION, "imgsz": imgsz, "names": [s[0] for s in sources],
+                   "keys": [s[1] for s in sources]}, f)
+    del previous
+    if split_dir.exists(): shutil.rmtree(split_dir)
+    os.replace(tmp_dir, split_dir)
+    return len(tasks), len(sources) - len(tasks)
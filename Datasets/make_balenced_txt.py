@@ -1,9 +1,11 @@
 import os
 from pathlib import Path
-from collections import Counter
+import numpy as np
 import yaml
 from tqdm import tqdm
 
+from label_index import LabelIndex, parse_label_file
+
 # ================= CONFIGURATION =================
 # 1. Path to your dataset's data.yaml
 DATA_YAML_PATH = "/dist_home/suryansh/sharukesh/analog/Datasets/Final_Blood_YOLO_Hierarchical_Remastered_clahe/data.yaml"
@@ -20,6 +22,18 @@ OVERSAMPLE_CONFIG = {
     7: 10,  # Monocyte
     8: 10   # Lymphocyte
 }
+
+# 3. How to express the oversampling.
+#    "weighted":  one line per image in <OUTPUT_NAME>.txt plus a per-image
+#                 weight in <OUTPUT_NAME>_weights.txt. Point the data yaml's
+#                 `sample_weights:` at it and the Hemo trainer draws each
+#                 epoch from the weights (no duplicated paths).
+#    "duplicate": the old behaviour, each rare image path written N times.
+MANIFEST_MODE = "weighted"
+OUTPUT_NAME = "train_balanced_pt2"
+# Data yaml written next to the manifest: data.yaml with `train:` (and in
+# "weighted" mode `sample_weights:`) pointing at what this run wrote.
+OUTPUT_YAML = "data_balenced_pt2.yaml"
 # =================================================
 
 def create_balanced_dataset():
@@ -40,12 +54,18 @@ def create_balanced_dataset():
         # Assuming images are in a folder
         image_files = list(train_images_dir.glob("*.jpg")) + list(train_images_dir.glob("*.png"))
 
+    # All label rows come from the memory-mapped label index (built on first
+    # use, then only changed label files are re-parsed).
+    index = LabelIndex.open(base_path)
+    multipliers = index.image_multipliers(OVERSAMPLE_CONFIG)
+    print(f"🗂️  Label index: {index.num_images} label files, {index.num_boxes} boxes")
     print(f"🧐 Scanning {len(image_files)} images for rare classes...")
 
     # We need to find the corresponding label for each image
     # Assuming standard YOLO layout: images/train/x.jpg -> labels/train/x.txt
     new_train_list = []
-    stats = Counter()
+    indexed_ids = []
+    stats = np.zeros(index.num_classes, dtype=np.int64)
 
     for img_path in tqdm(image_files):
         img_path = Path(img_path)
@@ -66,47 +86,66 @@ def create_balanced_dataset():
         
         if not label_path.exists():
             # If no label, it's a background image (keep it once)
-            new_train_list.append(str(img_path))
+            new_train_list.append((str(img_path), 1))
             continue
 
-        # Read labels to see if a rare class is present
-        has_rare = False
-        max_multiplier = 1
-        
-        with open(label_path, 'r') as f:
-            for line in f:
-                class_id = int(line.split()[0])
-                stats[class_id] += 1
-                
-                # Check if this class is in our boost list
-                if class_id in OVERSAMPLE_CONFIG:
-                    has_rare = True
-                    # Use the highest multiplier if an image has multiple rare classes
-                    max_multiplier = max(max_multiplier, OVERSAMPLE_CONFIG[class_id])
-
-        # Add to list
-        if has_rare:
-            # DUPLICATE THE PATH multiple times
-            for _ in range(max_multiplier):
-                new_train_list.append(str(img_path))
-        else:
-            # Majority class image, add once
-            new_train_list.append(str(img_path))
-
-    # Write the new text file
-    output_txt = base_path / "train_balanced_pt2.txt"
+        image_id = index.image_id(label_path.resolve())  # label_path is cwd-relative with a relative DATA_YAML_PATH
+        if image_id >= 0:
+            # Use the highest multiplier if an image has multiple rare classes
+            indexed_ids.append(image_id)
+            new_train_list.append((str(img_path), int(multipliers[image_id])))
+            continue
+
+        # Label outside the indexed dataset root: read it directly
+        class_ids, _ = parse_label_file(label_path)
+        max_multiplier = max([OVERSAMPLE_CONFIG.get(c, 1) for c in class_ids], default=1)
+        if class_ids:
+            stats = np.pad(stats, (0, max(0, max(class_ids) + 1 - len(stats))))
+            np.add.at(stats, class_ids, 1)
+        new_train_list.append((str(img_path), max_multiplier))
+
+    # Raw instance counts of the listed images, one vectorized pass
+    if indexed_ids:
+        ids, repeats = np.unique(indexed_ids, return_counts=True)
+        per_image = index.image_class_counts()[ids]
+        stats[:per_image.shape[1]] += (per_image * repeats[:, None]).sum(axis=0)
+
+    # Write the new text file(s)
+    output_txt = base_path / f"{OUTPUT_NAME}.txt"
     with open(output_txt, 'w') as f:
-        for line in new_train_list:
-            f.write(f"{line}\n")
+        for img_path, weight in new_train_list:
+            # "duplicate": DUPLICATE THE PATH multiple times
+            for _ in range(weight if MANIFEST_MODE == "duplicate" else 1):
+                f.write(f"{img_path}\n")
+
+    balanced_count = sum(weight for _, weight in new_train_list)
+    if MANIFEST_MODE == "weighted":
+        weights_txt = base_path / f"{OUTPUT_NAME}_weights.txt"
+        with open(weights_txt, 'w') as f:
+            for img_path, weight in new_train_list:
+                f.write(f"{weight} {img_path}\n")
 
     print(f"\n✅ Created Balanced Manifest: {output_txt}")
     print(f"📊 Original Count: {len(image_files)}")
-    print(f"🚀 Balanced Count: {len(new_train_list)} (Effective Weighted Loader)")
+    if MANIFEST_MODE == "weighted":
+        print(f"⚖️  Sample Weights: {weights_txt}")
+        print(f"🚀 Weighted Count: {balanced_count} draws/epoch equivalent, {len(new_train_list)} manifest lines")
+    else:
+        print(f"🚀 Balanced Count: {balanced_count} (Effective Weighted Loader)")
     print("\n--- Class Counts (Raw Instances) ---")
-    for cls_id, count in sorted(stats.items()):
-        print(f"Class {cls_id}: {count}")
+    for cls_id, count in enumerate(stats):
+        if count:
+            print(f"Class {cls_id}: {count}")
 
-    print("\n⚠️  ACTION REQUIRED: Update your data.yaml to point 'train:' to this new .txt file!")
+    # Written in the same step, so the manifest and its weights never go out of sync
+    out_cfg = {k: v for k, v in data_cfg.items() if k != 'sample_weights'}
+    out_cfg['train'] = output_txt.name
+    if MANIFEST_MODE == "weighted":
+        out_cfg['sample_weights'] = weights_txt.name
+    output_yaml = base_path / OUTPUT_YAML
+    with open(output_yaml, 'w') as f:
+        yaml.safe_dump(out_cfg, f, sort_keys=False, default_flow_style=None)
+    print(f"\n📄 Data yaml: {output_yaml} (train on this one)")
 
 if __name__ == "__main__":
     create_balanced_dataset()
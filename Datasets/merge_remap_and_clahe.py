@@ -1,15 +1,80 @@
 import os
+import json
+import hashlib
 import shutil
+import time
 import yaml
 import cv2
 import numpy as np
+from multiprocessing import Pool
 from pathlib import Path
 from tqdm import tqdm
 
+from clahe_engine import ClaheEngine
+from label_index import LabelIndex
+from letterbox_cache import build_split as build_letterbox_split, cache_dir
+from shard_format import ShardReader, ShardWriter, is_shard_dir
+from source_archive import ZipMember, close_archives, find_archive, read_member
+
 # --- CONFIGURATION ---
 WORKSPACE = "Blood_Roboflow_Workspace_Remastered"  
 OUTPUT_DIR = "Final_Blood_YOLO_Hierarchical_Remastered_clahe"
 APPLY_CLAHE = True 
+CLAHE_CLIP_LIMIT = 2.0
+CLAHE_TILE_GRID = (8, 8)
+CLAHE_BACKEND = "inplace"  # See clahe_engine.BACKENDS
+
+# --- SOURCES ---
+# "folders":  extracted Roboflow exports under WORKSPACE/<dataset>/
+# "archives": the export zips under ARCHIVE_DIR/<dataset>.zip (the mirror
+#             download_blood_roboflow.py keeps), read member by member, so
+#             no extracted workspace is needed at all
+SOURCE_MODE = "folders"
+ARCHIVE_DIR = "Blood_Roboflow_Archive"
+
+# --- PARALLELISM ---
+# Number of worker processes for the decode/CLAHE/encode loop.
+# 1 (or 0) runs everything in this process, exactly like the old serial loop.
+NUM_WORKERS = os.cpu_count() or 1
+CHUNKSIZE = 16  # Images handed to a worker at a time (amortizes IPC)
+
+# --- INCREMENTAL BUILDS ---
+# Keep OUTPUT_DIR between runs and only redo outputs whose inputs changed
+# (tracked in a content-addressed manifest). False = old rmtree-and-rebuild.
+INCREMENTAL = True
+MANIFEST_NAME = ".etl_manifest.json"
+MANIFEST_VERSION = 1
+
+# --- OUTPUT CODEC ---
+# "source": keep each image's own format, library-default settings
+# "jpeg":   .jpg at JPEG_QUALITY (lossy; lower = smaller, blurrier chromatin)
+# "png":    .png at PNG_COMPRESSION (lossless; 0-9, low = fast to write)
+# "raw":    uncompressed pixels (.bmp files / raw bytes in shards): biggest
+#           on disk, but no decode cost in the training loader
+# benchmark_codecs.py compares them on real frames.
+OUTPUT_CODEC = "source"
+JPEG_QUALITY = 95
+PNG_COMPRESSION = 1
+
+# --- OUTPUT FORMAT ---
+# "files":  classic YOLO tree, one image + one label file per sample
+# "shards": a few packed files per split under OUTPUT_DIR/shards/ (see
+#           shard_format.py), read by the Hemo trainer through mmap
+# Shards get their own SHARD_YAML for the Hemo trainer's data=. data.yaml is only
+# ever written for the loose tree, since stock tools (model.val(), export
+# calibration, ...) can't read shards.
+OUTPUT_FORMAT = "files"
+SHARD_YAML = "data_shards.yaml"
+
+# --- TRAINING-RESOLUTION CACHE ---
+# Also write the output frames resized to LETTERBOX_IMGSZ (long side, no padding) into
+# OUTPUT_DIR/letterbox_<imgsz>/ (see letterbox_cache.py), so training reads
+# them without decoding or resizing (build_trainer(letterbox_cache=True)).
+# Must match the imgsz of the runs; None = no cache.
+LETTERBOX_IMGSZ = 640  # imgsz of every train_*.py launcher
+LETTERBOX_SPLITS = ['train']
+
+SPLITS = ['train', 'valid', 'test']
 
 FINAL_CLASSES = [
     'RBC_Normal', 'RBC_Sickle', 'Platelets', 'WBC_Base', 
@@ -17,23 +82,41 @@ FINAL_CLASSES = [
 ]
 
 # --- CLAHE FUNCTION ---
+# One engine (CLAHE object + scratch buffers) per process. Pool workers build
+# theirs once in `init_worker` instead of once per image.
+_ENGINE = None
+
+def get_engine():
+    global _ENGINE
+    if _ENGINE is None:
+        _ENGINE = ClaheEngine(CLAHE_CLIP_LIMIT, CLAHE_TILE_GRID, backend=CLAHE_BACKEND)
+    return _ENGINE
+
 def apply_clahe_to_image(image_path):
-    img = cv2.imread(str(image_path))
-    if img is None: return None
+    return get_engine().apply_file(image_path)
     
-    # Convert to LAB (L=Lightness)
-    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
+# --- SOURCE FILES (loose file or zip member) ---
+def read_source(ref):
+    if isinstance(ref, ZipMember):
+        return read_member(ref)
+    with open(ref, 'rb') as f:
+        return f.read()
     
-    # Apply CLAHE to L-channel
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    cl = clahe.apply(l)
+def load_source_image(ref):
+    """CLAHE'd image of a source, or None if it cannot be decoded."""
+    if isinstance(ref, ZipMember):
+        return get_engine().apply_bytes(read_member(ref))
+    return apply_clahe_to_image(ref)
     
-    # Merge back
-    limg = cv2.merge((cl, a, b))
-    final = cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
+def decode_source(ref):
+    return cv2.imdecode(np.frombuffer(read_source(ref), dtype=np.uint8), cv2.IMREAD_COLOR)
     
-    return final
+def copy_source(ref, target_path):
+    if isinstance(ref, ZipMember):
+        with open(target_path, 'wb') as f:
+            f.write(read_member(ref))
+    else:
+        shutil.copy(ref, target_path)
 
 def read_classes(yaml_path):
     with open(yaml_path, 'r') as f:
@@ -85,85 +168,422 @@ def get_mapping(dataset_name, old_names):
             
     return mapping
 
-# --- MAIN EXECUTION ---
-print(f"🧹 Re-building output directory: {OUTPUT_DIR}...")
-if os.path.exists(OUTPUT_DIR): shutil.rmtree(OUTPUT_DIR)
+# --- OUTPUT CODEC ---
+CODEC_SUFFIX = {"jpeg": ".jpg", "png": ".png", "raw": ".bmp"}
+
+def codec_suffix(src_suffix):
+    return CODEC_SUFFIX.get(OUTPUT_CODEC, src_suffix)
+
+def codec_params():
+    if OUTPUT_CODEC == "jpeg": return [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    if OUTPUT_CODEC == "png": return [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    return []
+
+def codec_tag():
+    if OUTPUT_CODEC == "source": return ""  # Keeps manifest keys of older builds valid
+    return f"|codec={OUTPUT_CODEC}|jpegQuality={JPEG_QUALITY}|pngCompression={PNG_COMPRESSION}"
+
+def output_image(img_path):
+    """Frame to encode for one source: CLAHE'd, or decoded for re-encoding.
+
+    None means "copy the source bytes as they are" (no CLAHE and no codec
+    change, or a source OpenCV cannot decode).
+    """
+    if APPLY_CLAHE:
+        return load_source_image(img_path)
+    if OUTPUT_CODEC == "source":
+        return None
+    return decode_source(img_path)
+
+# --- PER-IMAGE WORK ---
+def init_worker():
+    # Each worker already runs on its own core; keep OpenCV single-threaded
+    # so N workers don't each spawn N threads.
+    cv2.setNumThreads(1)
+    get_engine()
 
-# Create Structure
-for split in ['train', 'valid', 'test']:
-    os.makedirs(f"{OUTPUT_DIR}/{split}/images", exist_ok=True)
-    os.makedirs(f"{OUTPUT_DIR}/{split}/labels", exist_ok=True)
+def remap_label_file(lbl_path, remap_dict):
+    lines = read_source(lbl_path).decode().splitlines()
+    new_lines = []
+    for line in lines:
+        parts = line.strip().split()
+        if not parts: continue
+        old_id = int(parts[0])
+        coords = ' '.join(parts[1:])
+        if old_id in remap_dict:
+            for new_id in remap_dict[old_id]:
+                new_lines.append(f"{new_id} {coords}")
+    return new_lines
 
-datasets = ["BCCD", "Raabin_WBC", "Sickle_Cell"]
+def process_image(task):
+    """Writes one output image (+ its remapped label). Safe to run in any process.
 
-print(f"🎨 CLAHE Enhancement: {'ENABLED' if APPLY_CLAHE else 'DISABLED'}")
+    Returns (image_written, label_written); label_written is None when the
+    label was not (re)processed.
+    """
+    img_path, target_img_path, lbl_path, new_lbl_path, remap_dict, do_image, do_label = task
+
+    # --- APPLY CLAHE OR COPY ---
+    if do_image:
+        processed_img = output_image(img_path)
+        if processed_img is not None:
+            cv2.imwrite(target_img_path, processed_img, codec_params())
+        else:
+            copy_source(img_path, target_img_path)
+
+    # --- HANDLE LABELS ---
+    label_written = None
+    if do_label:
+        new_lines = remap_label_file(lbl_path, remap_dict)
+        label_written = bool(new_lines)
+        if new_lines:
+            with open(new_lbl_path, 'w') as f:
+                f.write("\n".join(new_lines))
+        elif os.path.exists(new_lbl_path):
+            os.remove(new_lbl_path)  # Remap rule change left nothing to keep
+    return do_image, label_written
+
+# --- MANIFEST ---
+def load_manifest():
+    path = Path(OUTPUT_DIR) / MANIFEST_NAME
+    if path.exists():
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+    return {"version": MANIFEST_VERSION, "sources": {}, "outputs": {}}
+
+def save_manifest(manifest):
+    path = Path(OUTPUT_DIR) / MANIFEST_NAME
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def file_digest(path, manifest):
+    """sha256 of a source file. Only re-hashed when its size or mtime changed."""
+    st = os.stat(path)
+    cached = manifest["sources"].get(str(path))
+    if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns:
+        return cached["sha256"]
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    manifest["sources"][str(path)] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+    return digest
+
+def member_digest(ref, manifest):
+    """sha256 of a zip member. Only re-hashed when its archive's size or mtime changed."""
+    st = os.stat(ref.archive)
+    key = f"{ref.archive}::{ref.member}"
+    cached = manifest["sources"].get(key)
+    if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns:
+        return cached["sha256"]
+    digest = ref.digest()
+    manifest["sources"][key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+    return digest
+
+def source_digest(ref, manifest):
+    if isinstance(ref, ZipMember):
+        return member_digest(ref, manifest)
+    return file_digest(ref, manifest)
+
+def image_key(src_digest):
+    params = f"clahe={APPLY_CLAHE}|clipLimit={CLAHE_CLIP_LIMIT}|tileGridSize={tuple(CLAHE_TILE_GRID)}{codec_tag()}"
+    return hashlib.sha256(f"{src_digest}|{params}".encode()).hexdigest()
+
+def label_key(src_digest, remap_dict):
+    mapping = json.dumps(sorted(remap_dict.items()))
+    return hashlib.sha256(f"{src_digest}|{mapping}".encode()).hexdigest()
+
+def is_fresh(manifest, out_path, key):
+    entry = manifest["outputs"].get(out_path)
+    return entry is not None and entry["key"] == key and os.path.exists(out_path) == entry["written"]
+
+def folder_split_entries(src_split_path):
+    """Sorted [(image path, label path or None)] of an extracted split folder."""
+    entries = []
+    for img_path in sorted((src_split_path / "images").glob("*")):
+        # --- FIX: SKIP DIRECTORIES AND HIDDEN FILES ---
+        if img_path.is_dir() or img_path.name.startswith('.'):
+            continue
+        lbl_path = src_split_path / "labels" / f"{img_path.stem}.txt"
+        entries.append((img_path, lbl_path if lbl_path.exists() else None))
+    return entries
+
+def dataset_source(ds_name):
+    """(class names, {split: entries}) of one source dataset, or None if it is missing."""
+    if SOURCE_MODE == "archives":
+        archive = find_archive(ARCHIVE_DIR, ds_name)
+        old_classes = archive.read_classes() if archive else None
+        if old_classes is None: return None
+        splits = {}
+        for split in SPLITS:
+            src_split = split if archive.has_split(split) or split != 'valid' else 'val'
+            if archive.has_split(src_split):
+                splits[split] = archive.split_entries(src_split)
+        return old_classes, splits
 
-for ds_name in datasets:
     ds_path = Path(WORKSPACE) / ds_name
     yaml_path = ds_path / "data.yaml"
-    if not yaml_path.exists(): continue
-        
-    old_classes = read_classes(yaml_path)
-    remap_dict = get_mapping(ds_name, old_classes)
-    
-    for split in ['train', 'valid', 'test']:
+    if not yaml_path.exists(): return None
+    splits = {}
+    for split in SPLITS:
         src_split_path = ds_path / split
         if not src_split_path.exists():
             if split == 'valid': src_split_path = ds_path / 'val'
         if not src_split_path.exists(): continue
-        
-        dst_split = split if split != 'val' else 'valid'
-        images = list((src_split_path / "images").glob("*"))
-        
-        print(f"   📦 Processing {ds_name} [{split}]: {len(images)} images...")
-        
-        for img_path in tqdm(images, leave=False):
-            # --- FIX: SKIP DIRECTORIES AND HIDDEN FILES ---
-            if img_path.is_dir() or img_path.name.startswith('.'):
-                continue
-            
-            new_filename = f"{ds_name}_{img_path.name}"
-            target_img_path = f"{OUTPUT_DIR}/{dst_split}/images/{new_filename}"
-            
-            # --- APPLY CLAHE OR COPY ---
-            if APPLY_CLAHE:
-                processed_img = apply_clahe_to_image(img_path)
-                if processed_img is not None:
-                    cv2.imwrite(target_img_path, processed_img)
+        splits[split] = folder_split_entries(src_split_path)
+    return read_classes(yaml_path), splits
+
+def plan_split(ds_name, entries, dst_split, remap_dict, manifest, claim_labels=True):
+    """Builds the (sorted, deterministic) task list for one dataset split.
+
+    Returns (tasks, keys) where keys[i] = (image_key, label_key) of tasks[i].
+    Outputs whose manifest key still matches are flagged so workers skip them.
+    claim_labels=False gives every image its label, even when x.jpg and x.png
+    would share one label file on disk (shards store a label per record).
+    """
+    tasks, keys = [], []
+    claimed_labels, targets = set(), set()
+    for img_path, lbl_path in entries:
+        new_filename = f"{ds_name}_{img_path.stem}{codec_suffix(img_path.suffix)}"
+        if new_filename in targets:
+            # x.jpg and x.png would both become x.<codec ext>; keep them apart
+            new_filename = f"{ds_name}_{img_path.stem}_{img_path.suffix[1:]}{codec_suffix(img_path.suffix)}"
+        targets.add(new_filename)
+        target_img_path = f"{OUTPUT_DIR}/{dst_split}/images/{new_filename}"
+
+        new_lbl_path = f"{OUTPUT_DIR}/{dst_split}/labels/{Path(new_filename).stem}.txt"
+        # x.jpg and x.png share x.txt; only one task may write it so two
+        # workers never race on the same file.
+        if new_lbl_path in claimed_labels:
+            lbl_path = None
+        elif lbl_path is not None and claim_labels:
+            claimed_labels.add(new_lbl_path)
+
+        img_key = image_key(source_digest(img_path, manifest))
+        lbl_key = label_key(source_digest(lbl_path, manifest), remap_dict) if lbl_path else None
+        do_image = not is_fresh(manifest, target_img_path, img_key)
+        do_label = lbl_path is not None and not is_fresh(manifest, new_lbl_path, lbl_key)
+
+        tasks.append((img_path, target_img_path, lbl_path, new_lbl_path, remap_dict, do_image, do_label))
+        keys.append((img_key, lbl_key))
+    return tasks, keys
+
+def record_outputs(manifest, tasks, keys, results):
+    for task, (img_key, lbl_key), (_, label_written) in zip(tasks, keys, results):
+        _, target_img_path, lbl_path, new_lbl_path, *_ = task
+        manifest["outputs"][target_img_path] = {"key": img_key, "written": True}
+        if lbl_path is not None and label_written is not None:
+            manifest["outputs"][new_lbl_path] = {"key": lbl_key, "written": label_written}
+
+def output_dataset(path, datasets):
+    """Which of the datasets an output file came from (files are named <dataset>_<stem>), or None."""
+    name = Path(path).name
+    return max((d for d in datasets if name.startswith(f"{d}_")), key=len, default=None)
+
+def is_stale(path, planned, scanned, datasets):
+    """Not planned, and either its dataset split was scanned this run or its dataset is no longer listed.
+
+    A dataset (split) whose source is missing, e.g. not downloaded yet, keeps its outputs.
+    """
+    if str(Path(path)) in planned: return False
+    ds_name = output_dataset(path, datasets)
+    return ds_name is None or (ds_name, Path(path).parent.parent.name) in scanned
+
+def remove_stale_outputs(manifest, planned, scanned, datasets):
+    """Deletes outputs no current source maps to (removed images, renamed datasets...)."""
+    planned = {str(Path(p)) for p in planned}
+    removed = 0
+    for split in SPLITS:
+        for kind in ['images', 'labels']:
+            for path in Path(f"{OUTPUT_DIR}/{split}/{kind}").glob("*"):
+                if path.is_file() and is_stale(path, planned, scanned, datasets):
+                    path.unlink()
+                    removed += 1
+    manifest["outputs"] = {k: v for k, v in manifest["outputs"].items()
+                           if not is_stale(k, planned, scanned, datasets)}
+    return removed
+
+# --- SHARD OUTPUT ---
+def encode_image(task):
+    """Shard-mode twin of process_image: returns (image bytes, label text, (h, w))."""
+    img_path, _, lbl_path, _, remap_dict, _, _ = task
+    img = output_image(img_path)
+    if img is not None and OUTPUT_CODEC == "raw":
+        data = np.ascontiguousarray(img).tobytes()  # ShardReader reshapes it, no decode
+    elif img is not None:
+        # Same encoder and settings as cv2.imwrite in "files" mode
+        _, buf = cv2.imencode(codec_suffix(img_path.suffix), img, codec_params())
+        data = buf.tobytes()
+    else:
+        data = read_source(img_path)
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    shape = img.shape[:2] if img is not None else (0, 0)
+    label = "\n".join(remap_label_file(lbl_path, remap_dict)) if lbl_path else ""
+    return data, label, shape
+
+def pack_split(tasks, keys, writer, previous, pool, desc):
+    """Appends one dataset split to its shard writer. Returns #images (re)encoded.
+
+    Records whose content key is already in the previous shards are copied
+    from there instead of being decoded/CLAHE'd/encoded again.
+    """
+    reusable = {key: i for i, key in enumerate(previous.keys)} if previous else {}
+    record_keys = [f"{img_key}|{lbl_key}" for img_key, lbl_key in keys]
+    todo = [task for task, key in zip(tasks, record_keys) if key not in reusable]
+
+    results = pool.imap(encode_image, todo, chunksize=CHUNKSIZE) if pool else map(encode_image, todo)
+    results = iter(tqdm(results, total=len(todo), desc=desc, leave=False))
+    for task, key in zip(tasks, record_keys):
+        name = Path(task[1]).name
+        if key in reusable:
+            i = reusable[key]
+            writer.add(name, previous.image_bytes(i), previous.label_text(i), previous.shape(i), key)
+        else:
+            writer.add(name, *next(results), key)
+    return len(todo)
+
+def run_tasks(tasks, pool, desc):
+    # imap (not imap_unordered) keeps the progress bar in submission order.
+    # Fully up-to-date tasks still pass through so the results stay aligned.
+    results = pool.imap(process_image, tasks, chunksize=CHUNKSIZE) if pool else map(process_image, tasks)
+    return list(tqdm(results, total=len(tasks), desc=desc, leave=False))
+
+def build_letterbox_cache():
+    """Refreshes the letterbox cache of LETTERBOX_SPLITS from the finished output."""
+    print(f"🖼️  Letterbox cache at {LETTERBOX_IMGSZ}px: {cache_dir(OUTPUT_DIR, LETTERBOX_IMGSZ)}")
+    pool = Pool(NUM_WORKERS, initializer=init_worker) if NUM_WORKERS > 1 else None
+    try:
+        for split in LETTERBOX_SPLITS:
+            start = time.perf_counter()
+            written, reused = build_letterbox_split(OUTPUT_DIR, split, LETTERBOX_IMGSZ, pool, CHUNKSIZE)
+            print(f"   {split:<5} {written} frames written, {reused} up-to-date in {time.perf_counter() - start:.1f}s")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def print_throughput(stats):
+    print("\n⏱️  Throughput Summary:")
+    total_n, total_t = 0, 0.0
+    for (ds_name, split), (n, skipped, elapsed) in stats.items():
+        rate = n / elapsed if elapsed > 0 else 0.0
+        print(f"   {ds_name:<12} [{split:<5}] {n:>6} images in {elapsed:7.1f}s -> {rate:8.1f} img/s ({skipped} up-to-date)")
+        total_n += n
+        total_t += elapsed
+    if total_t > 0:
+        print(f"   {'TOTAL':<20} {total_n:>6} images in {total_t:7.1f}s -> {total_n / total_t:8.1f} img/s")
+
+# --- MAIN EXECUTION ---
+def main():
+    if INCREMENTAL:
+        print(f"♻️  Incremental update of output directory: {OUTPUT_DIR}...")
+    else:
+        print(f"🧹 Re-building output directory: {OUTPUT_DIR}...")
+        if os.path.exists(OUTPUT_DIR): shutil.rmtree(OUTPUT_DIR)
+
+    # Create Structure
+    shards = OUTPUT_FORMAT == "shards"
+    if shards:
+        shard_dirs = {split: f"{OUTPUT_DIR}/shards/{split}" for split in SPLITS}
+        previous = {split: ShardReader(d) if INCREMENTAL and is_shard_dir(d) else None
+                    for split, d in shard_dirs.items()}
+        shard_codec = "raw" if OUTPUT_CODEC == "raw" else "encoded"
+        previous = {split: r if r is None or r.codec == shard_codec else None for split, r in previous.items()}
+        writers = {split: ShardWriter(d, codec=shard_codec) for split, d in shard_dirs.items()}
+    else:
+        for split in SPLITS:
+            os.makedirs(f"{OUTPUT_DIR}/{split}/images", exist_ok=True)
+            os.makedirs(f"{OUTPUT_DIR}/{split}/labels", exist_ok=True)
+
+    datasets = ["BCCD", "Raabin_WBC", "Sickle_Cell"]
+
+    print(f"🎨 CLAHE Enhancement: {'ENABLED' if APPLY_CLAHE else 'DISABLED'}")
+    print(f"⚙️  Workers: {NUM_WORKERS if NUM_WORKERS > 1 else 'serial'}")
+    print(f"📥 Sources: {ARCHIVE_DIR + '/*.zip' if SOURCE_MODE == 'archives' else WORKSPACE + '/'}")
+    print(f"🗃️  Output format: {OUTPUT_FORMAT}, codec: {OUTPUT_CODEC}")
+
+    pool = Pool(NUM_WORKERS, initializer=init_worker) if NUM_WORKERS > 1 else None
+    manifest = load_manifest()
+    planned = set()
+    scanned = set()  # (dataset, output split) pairs whose source was read
+    stats = {}
+    try:
+        for ds_name in datasets:
+            source = dataset_source(ds_name)
+            if source is None: continue
+
+            old_classes, split_entries = source
+            remap_dict = get_mapping(ds_name, old_classes)
+
+            for split, entries in split_entries.items():
+                dst_split = split
+                scanned.add((ds_name, dst_split))
+                start = time.perf_counter()
+                tasks, keys = plan_split(ds_name, entries, dst_split, remap_dict, manifest,
+                                         claim_labels=not shards)
+                print(f"   📦 Processing {ds_name} [{split}]: {len(tasks)} images...")
+
+                if shards:
+                    n = pack_split(tasks, keys, writers[dst_split], previous[dst_split], pool, f"{ds_name}/{split}")
                 else:
-                    shutil.copy(img_path, target_img_path)
-            else:
-                shutil.copy(img_path, target_img_path)
-            
-            # --- HANDLE LABELS ---
-            lbl_path = src_split_path / "labels" / f"{img_path.stem}.txt"
-            if lbl_path.exists():
-                new_lbl_path = f"{OUTPUT_DIR}/{dst_split}/labels/{ds_name}_{img_path.stem}.txt"
-                with open(lbl_path, 'r') as f:
-                    lines = f.readlines()
-                new_lines = []
-                for line in lines:
-                    parts = line.strip().split()
-                    if not parts: continue
-                    old_id = int(parts[0])
-                    coords = ' '.join(parts[1:])
-                    if old_id in remap_dict:
-                        for new_id in remap_dict[old_id]:
-                            new_lines.append(f"{new_id} {coords}")
-                if new_lines:
-                    with open(new_lbl_path, 'w') as f:
-                        f.write("\n".join(new_lines))
-
-# --- CREATE DATA.YAML ---
-yaml_content = f"""
+                    for task in tasks:
+                        planned.add(task[1])
+                        if task[2] is not None: planned.add(task[3])
+                    results = run_tasks(tasks, pool, f"{ds_name}/{split}")
+                    record_outputs(manifest, tasks, keys, results)
+                    n = sum(did_image for did_image, _ in results)
+                save_manifest(manifest)
+                stats[(ds_name, dst_split)] = (n, len(tasks) - n, time.perf_counter() - start)
+
+        if shards:
+            for writer in writers.values():
+                writer.close()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        close_archives()
+
+    # Shard mode rewrites whole splits, so there is nothing stale to sweep
+    removed = 0 if shards else remove_stale_outputs(manifest, planned, scanned, datasets)
+    manifest["sources"] = {k: v for k, v in manifest["sources"].items() if os.path.exists(k.partition("::")[0])}
+    save_manifest(manifest)
+    if removed:
+        print(f"🗑️  Removed {removed} stale outputs.")
+
+    # --- CREATE DATA.YAML ---
+    split_dirs = {split: f"shards/{split}" if shards else f"{split}/images" for split in SPLITS}
+    yaml_path = f"{OUTPUT_DIR}/{SHARD_YAML if shards else 'data.yaml'}"
+    yaml_content = f"""
 path: {os.path.abspath(OUTPUT_DIR)}
-train: train/images
-val: valid/images
-test: test/images
+train: {split_dirs['train']}
+val: {split_dirs['valid']}
+test: {split_dirs['test']}
 nc: 9
 names: {FINAL_CLASSES}
 """
-with open(f"{OUTPUT_DIR}/data.yaml", 'w') as f:
-    f.write(yaml_content)
+    with open(yaml_path, 'w') as f:
+        f.write(yaml_content)
+    if shards:
+        print(f"📄 Shards written; train the Hemo trainer on {yaml_path} (data.yaml is left as is)")
+
+    # --- REFRESH LABEL INDEX ---
+    # Re-parses only the label files this run touched
+    if not shards:
+        index = LabelIndex.open(OUTPUT_DIR)
+        print(f"🗂️  Label index: {index.num_images} label files, {index.num_boxes} boxes")
+
+    if LETTERBOX_IMGSZ:
+        build_letterbox_cache()
+
+    print_throughput(stats)
+    print("\n🎉 DONE! Images merged, CLAHE applied, and classes remapped.")
 
-print("\n🎉 DONE! Images merged, CLAHE applied, and classes remapped.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os
+import json
+import shutil
+import cv2
+import numpy as np
+from pathlib import Path
+
+from label_index import parse_label_lines
+
+# ==========================================
+# PACKED SHARD FORMAT
+# ==========================================
+# A split stored as a few large files instead of thousands of small ones:
+#
+#   <split>/images-00000.bin   encoded image bytes, back to back (~SHARD_BYTES each)
+#   <split>/labels.bin         remapped YOLO label text, back to back
+#   <split>/index.npy          one INDEX_DTYPE record per image (offsets, sizes, shape)
+#   <split>/meta.json          file names + content keys (for incremental rebuilds)
+#
+# Images are stored either encoded (codec "encoded": any format cv2.imdecode
+# reads) or as raw HxWx3 uint8 pixels (codec "raw"), which skips decoding.
+#
+# Readers memory-map the .bin files, so an image is a zero-copy slice handed
+# straight to cv2.imdecode: no open()/stat() per sample on the network home.
+
+SHARD_BYTES = 1 << 30  # Start a new images-*.bin after ~1 GiB
+SHARD_VERSION = 1
+
+INDEX_DTYPE = np.dtype([
+    ("shard", np.int32),
+    ("offset", np.int64),
+    ("length", np.int64),
+    ("label_offset", np.int64),
+    ("label_length", np.int64),
+    ("height", np.int32),
+    ("width", np.int32),
+])
+
+
+def is_shard_dir(path):
+    return (Path(path) / "index.npy").exists() and (Path(path) / "meta.json").exists()
+
+
+class ShardWriter:
+    """Appends (name, image bytes, label text) records to a split directory.
+
+    Writes into <split_dir>.tmp and swaps it in on close(), so a reader never
+    sees a half-written split and the previous shards stay readable while the
+    new ones are built (incremental rebuilds copy unchanged records from them).
+    """
+
+    def __init__(self, split_dir, shard_bytes=SHARD_BYTES, codec="encoded"):
+        self.split_dir = Path(split_dir)
+        self.codec = codec
+        self.tmp_dir = self.split_dir.with_name(self.split_dir.name + ".tmp")
+        if self.tmp_dir.exists(): shutil.rmtree(self.tmp_dir)
+        self.tmp_dir.mkdir(parents=True)
+        self.shard_bytes = shard_bytes
+
+        self.records = []
+        self.names = []
+        self.keys = []
+        self._shard = -1
+        self._shard_file = None
+        self._shard_pos = 0
+        self._labels = open(self.tmp_dir / "labels.bin", 'wb')
+        self._labels_pos = 0
+        self._next_shard()
+
+    def _next_shard(self):
+        if self._shard_file is not None:
+            self._shard_file.close()
+        self._shard += 1
+        self._shard_file = open(self.tmp_dir / f"images-{self._shard:05d}.bin", 'wb')
+        self._shard_pos = 0
+
+    def add(self, name, image_bytes, label_text, shape, key=None):
+        if self._shard_pos and self._shard_pos + len(image_bytes) > self.shard_bytes:
+            self._next_shard()
+        label_bytes = label_text.encode() if isinstance(label_text, str) else bytes(label_text or b"")
+        self._shard_file.write(image_bytes)
+        self._labels.write(label_bytes)
+        self.records.append((self._shard, self._shard_pos, len(image_bytes),
+                             self._labels_pos, len(label_bytes), shape[0], shape[1]))
+        self.names.append(name)
+        self.keys.append(key)
+        self._shard_pos += len(image_bytes)
+        self._labels_pos += len(label_bytes)
+
+    def close(self):
+        self._shard_file.close()
+        self._labels.close()
+        np.save(self.tmp_dir / "index.npy", np.array(self.records, dtype=INDEX_DTYPE))
+        with open(self.tmp_dir / "meta.json", 'w') as f:
+            json.dump({"version": SHARD_VERSION, "codec": self.codec, "names": self.names, "keys": self.keys}, f)
+        if self.split_dir.exists(): shutil.rmtree(self.split_dir)
+        os.replace(self.tmp_dir, self.split_dir)
+
+
+class ShardReader:
+    """Zero-copy random access to one split written by ShardWriter."""
+
+    def __init__(self, split_dir):
+        self.split_dir = Path(split_dir)
+        with open(self.split_dir / "meta.json", 'r') as f:
+            meta = json.load(f)
+        self.names = meta["names"]
+        self.codec = meta.get("codec", "encoded")
+        self.keys = meta.get("keys") or [None] * len(self.names)
+        self.index = np.load(self.split_dir / "index.npy")
+        self._shards = {}
+        self._labels = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def _shard(self, shard):
+        # Mapped lazily (and per process: forked dataloader workers map their own)
+        mm = self._shards.get(shard)
+        if mm is None:
+            path = self.split_dir / f"images-{shard:05d}.bin"
+            mm = np.memmap(path, dtype=np.uint8, mode='r') if path.stat().st_size else np.empty(0, np.uint8)
+            self._shards[shard] = mm
+        return mm
+
+    def image_bytes(self, i):
+        """Encoded bytes of record i as a view into the mapped shard (no copy)."""
+        rec = self.index[i]
+        return self._shard(int(rec["shard"]))[rec["offset"]:rec["offset"] + rec["length"]]
+
+    def image(self, i, flags=cv2.IMREAD_COLOR):
+        if self.codec != "raw":
+            return cv2.imdecode(self.image_bytes(i), flags)
+        h, w = self.shape(i)
+        data = self.image_bytes(i)
+        if len(data) != h * w * 3:
+            return None
+        # Copy out of the read-only map; the caller may modify the frame
+        img = data.reshape(h, w, 3).copy()
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if flags == cv2.IMREAD_GRAYSCALE else img
+
+    def label_text(self, i):
+        if self._labels is None:
+            path = self.split_dir / "labels.bin"
+            self._labels = np.memmap(path, dtype=np.uint8, mode='r') if path.stat().st_size else np.empty(0, np.uint8)
+        rec = self.index[i]
+        return self._labels[rec["label_offset"]:rec["label_offset"] + rec["label_length"]].tobytes().decode()
+
+    def label(self, i):
+        """(cls[N, 1], boxes_xywh[N, 4]) float32 arrays of record i."""
+        class_ids, boxes = parse_label_lines(self.label_text(i).splitlines())
+        cls = np.asarray(class_ids, dtype=np.float32).reshape(-1, 1)
+        return cls, np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+
+    def shape(self, i):
+        rec = self.index[i]
+        return int(rec["height"]), int(rec["width"])
+
+    def __getstate__(self):
+        # Memory maps are re-opened in each worker process
+        state = self.__dict__.copy()
+        state["_shards"], state["_labels"] = {}, None
+        return state
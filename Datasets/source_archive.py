@@ -0,0 +1,106 @@
+import hashlib
+import zipfile
+import yaml
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple
+
+# ==========================================
+# ZIP SOURCE ARCHIVES
+# ==========================================
+# Lets the ETL read a Roboflow export straight out of its zip
+# (ARCHIVE_DIR/<dataset>.zip, as mirrored by download_blood_roboflow.py)
+# instead of from an extracted folder tree. Members are read one at a time,
+# by whichever process needs them, so memory stays at one image per worker.
+
+
+class ZipMember(NamedTuple):
+    """A file inside a zip; picklable, so it can be handed to worker processes."""
+    archive: str
+    member: str
+    crc: int
+    size: int
+
+    @property
+    def name(self):
+        return PurePosixPath(self.member).name
+
+    @property
+    def stem(self):
+        return PurePosixPath(self.member).stem
+
+    @property
+    def suffix(self):
+        return PurePosixPath(self.member).suffix
+
+    def digest(self):
+        """sha256 of the member's bytes, streamed out of the archive."""
+        h = hashlib.sha256()
+        with open_archive(self.archive).open(self.member) as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+
+# Per-process cache of open archives. Only ever filled by the process doing
+# the reads: a ZipFile inherited across fork() would share its file offset.
+_OPEN = {}
+
+def open_archive(archive):
+    zf = _OPEN.get(archive)
+    if zf is None:
+        zf = _OPEN[archive] = zipfile.ZipFile(archive)
+    return zf
+
+def close_archives():
+    for zf in _OPEN.values():
+        zf.close()
+    _OPEN.clear()
+
+def read_member(ref):
+    return open_archive(ref.archive).read(ref.member)
+
+
+class SourceArchive:
+    """One dataset export zip: data.yaml plus <split>/images + <split>/labels."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        with zipfile.ZipFile(self.path) as zf:
+            infos = [i for i in zf.infolist() if not i.is_dir()]
+        self.members = {i.filename: i for i in infos}
+        # Zips made by hand often wrap everything in one top-level folder
+        yaml_members = sorted((m for m in self.members if PurePosixPath(m).name == "data.yaml"), key=len)
+        self.prefix = str(PurePosixPath(yaml_members[0]).parent) + "/" if yaml_members else ""
+        if self.prefix == "./": self.prefix = ""
+
+    def ref(self, member):
+        info = self.members.get(self.prefix + member)
+        return ZipMember(self.path, info.filename, info.CRC, info.file_size) if info else None
+
+    def read_classes(self):
+        ref = self.ref("data.yaml")
+        if ref is None: return None
+        with zipfile.ZipFile(self.path) as zf:
+            data = yaml.safe_load(zf.read(ref.member))
+        return data.get('names', [])
+
+    def has_split(self, split):
+        return any(m.startswith(f"{self.prefix}{split}/images/") for m in self.members)
+
+    def split_entries(self, split):
+        """Sorted [(image ref, label ref or None)] for one split."""
+        image_dir = f"{self.prefix}{split}/images/"
+        entries = []
+        for member in sorted(self.members):
+            if not member.startswith(image_dir): continue
+            rel = member[len(image_dir):]
+            # Same filter as the folder walk: no nested dirs, no hidden files
+            if "/" in rel or rel.startswith('.'): continue
+            img = self.ref(member[len(self.prefix):])
+            entries.append((img, self.ref(f"{split}/labels/{img.stem}.txt")))
+        return entries
+
+
+def find_archive(archive_dir, ds_name):
+    path = Path(archive_dir) / f"{ds_name}.zip"
+    return SourceArchive(path) if path.exists() else None
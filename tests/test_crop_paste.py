@@ -0,0 +1,61 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "ultralytics"))
+from ultralytics.utils.instance import Instances  # noqa: E402
+
+from hemo_dataset import WBC_BASE, CropBankPaste  # noqa: E402
+
+
+class FakeBank:
+    """One 40x40 RGBA crop of a cell (opaque disc) per class in `classes`."""
+
+    bank_dir = "fake_bank"
+    names = {3: "WBC_Base", 4: "Neutrophil", 1: "RBC_Sickle"}
+
+    def __init__(self, classes):
+        self.by_class = {c: np.arange(1) if c in classes else np.arange(0) for c in self.names}
+
+    def crop(self, i):
+        crop = np.zeros((40, 40, 4), dtype=np.uint8)
+        yy, xx = np.mgrid[:40, :40]
+        crop[..., :3] = 200
+        crop[..., 3] = np.where((yy - 20) ** 2 + (xx - 20) ** 2 < 15 ** 2, 255, 0)
+        return crop, (200, 200)
+
+
+def frame(segments=False):
+    """A 200x200 frame with one labeled RBC (as a polygon if segments=True)."""
+    box = np.array([[0.1, 0.1, 0.1, 0.1]], dtype=np.float32)  # xywh, normalized
+    segs = None
+    if segments:
+        segs = np.array([[[0.05, 0.05], [0.15, 0.05], [0.15, 0.15], [0.05, 0.15]]], dtype=np.float32)
+        segs = np.repeat(segs, 25, axis=1)  # 100 points, like resample_segments() output
+    return {"img": np.zeros((200, 200, 3), dtype=np.uint8), "cls": np.zeros((1, 1), dtype=np.float32),
+            "instances": Instances(box, segs, bbox_format="xywh", normalized=True)}
+
+
+@pytest.mark.parametrize("segments", [False, True])
+def test_pasted_subtype_gets_wbc_base_row(segments):
+    np.random.seed(0)
+    paste = CropBankPaste(FakeBank({4}), {"Neutrophil": 50.0}, max_per_frame=1)
+    label = paste(frame(segments))
+
+    cls = label["cls"][:, 0].tolist()
+    assert cls == [0, 4, WBC_BASE]
+    boxes = label["instances"].bboxes
+    np.testing.assert_array_equal(boxes[1], boxes[2])
+    if segments:
+        segs = label["instances"].segments
+        assert len(segs) == 3
+        np.testing.assert_array_equal(segs[1], segs[2])
+
+
+def test_pasted_non_wbc_is_single_row():
+    np.random.seed(0)
+    paste = CropBankPaste(FakeBank({1}), {"RBC_Sickle": 50.0}, max_per_frame=1)
+    label = paste(frame())
+    assert label["cls"][:, 0].tolist() == [0, 1]
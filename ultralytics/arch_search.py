@@ -0,0 +1,254 @@
+import csv
+import itertools
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import yaml
+from ultralytics import YOLO
+from ultralytics.nn import tasks
+from ultralytics.utils.torch_utils import get_flops, get_num_params
+
+from hemo_trainer import build_trainer
+
+# ==========================================
+# LATENCY-AWARE ARCHITECTURE SEARCH
+# ==========================================
+# Generates hemo-flash.yaml variants, scores them on CPU without training,
+# and only spends training time on the ones worth it:
+#
+#   1. grid over width/depth multipliers x GhostConv placement x head levels
+#   2. training-free scoring: params, GFLOPs, CPU latency (batch 1), memory
+#      (weights + every layer's activation at batch 1)
+#   3. Pareto front over (latency, memory, GFLOPs): GFLOPs stands in for
+#      capacity, so a variant survives if no other one is at least as fast
+#      and as small while doing at least as much work per image
+#   4. short proxy training (PROXY_EPOCHS on PROXY_FRACTION of train) for
+#      the front only, then the latency-vs-mAP frontier with per-class mAP
+#
+# Head choices: "P3P4" is the current amputated-P5 model, "P3P4P5" puts P5
+# back, "P2P3P4" adds a stride-4 level for platelets. The neck is the same
+# truncated Bi-FPN for every choice (lateral 1x1, top-down, bottom-up).
+#
+# Output: OUTPUT_DIR/variants/*.yaml and OUTPUT_DIR/arch_frontier.csv.
+
+# ================= CONFIGURATION =================
+dataset_path = "/dist_home/suryansh/sharukesh/analog/Datasets/Final_Blood_YOLO_Hierarchical_Remastered_clahe"
+DATA_YAML = f"{dataset_path}/data.yaml"
+BASE_YAML = Path(__file__).with_name("hemo-flash.yaml")  # nc / names come from here
+OUTPUT_DIR = Path(f"{dataset_path}/runs/arch_search")
+
+DEPTHS = [0.33, 0.67, 1.0]           # x BLOCK_REPEATS -> 1, 2, 3 refine blocks per stage
+WIDTHS = [0.25, 0.375, 0.5]
+GHOST = ["all", "neck", "backbone", "none"]  # Where the GhostPConv blocks go (Conv elsewhere)
+HEADS = ["P3P4", "P3P4P5", "P2P3P4"]
+BLOCK_REPEATS = 3
+MAX_CHANNELS = 1024
+
+IMGSZ = 640
+LATENCY_ITERS = 10
+THREADS = None                       # torch threads for latency; None = torch default
+MAX_PROXY_TRAIN = 8                  # Front members trained, fastest first
+PROXY_EPOCHS = 10
+PROXY_FRACTION = 0.25
+PROXY_BATCH = 16
+PRETRAINED = "yolo11n.pt"            # Transferable layers are loaded like the train scripts do; None = scratch
+DEVICE = 0
+# =================================================
+
+# Modules from the Hemo-Flash ultralytics fork; a stock install gets the
+# nearest upstream module so the search still runs (flagged in the CSV)
+FALLBACK_MODULES = {"GhostPConv": "GhostConv", "WeightedConcat": "Concat"}
+NECK_CHANNELS = {2: 64, 3: 128, 4: 256, 5: 512}
+STAGE_CHANNELS = {1: 128, 2: 128, 3: 256, 4: 512, 5: 1024}
+
+
+def module(name):
+    return name if hasattr(tasks, name) else FALLBACK_MODULES.get(name, name)
+
+
+def variant_yaml(depth, width, ghost, head, base):
+    """Model dict for one variant, laid out like hemo-flash.yaml."""
+    levels = [int(p) for p in head.split("P")[1:]]
+    top = max(levels)
+    ghost_backbone = ghost in ("all", "backbone")
+    ghost_neck = ghost in ("all", "neck")
+
+    # Depth is baked into the repeats here (the yaml's depth gain stays 1.0):
+    # the first block of a stage changes the channel count, so only the
+    # blocks after it can be a plain repeat
+    n = max(round(BLOCK_REPEATS * depth), 1)
+
+    def block(c, use_ghost):
+        layer = [module("GhostPConv"), [c]] if use_ghost else ["Conv", [c, 3, 1]]
+        return [[-1, 1, *layer]] + ([[-1, n - 1, *layer]] if n > 1 else [])
+
+    # Backbone: P1 stem, then per level a stride-2 Conv + refine block
+    backbone = [[-1, 1, "Conv", [64, 3, 2]]]
+    feature = {}
+    for level in range(2, top + 1):
+        backbone.append([-1, 1, "Conv", [STAGE_CHANNELS[level], 3, 2]])
+        backbone += block(STAGE_CHANNELS[level], ghost_backbone)
+        feature[level] = len(backbone) - 1
+
+    concat = [module("WeightedConcat"), [1]]
+    layers = list(backbone)
+    # Top-down: lateral 1x1 from the level, upsampled deeper map, fuse, refine
+    cur, td = feature[top], {}
+    for level in reversed(levels[:-1]):
+        layers.append([feature[level], 1, "Conv", [NECK_CHANNELS[level], 1, 1]])
+        lateral = len(layers) - 1
+        layers.append([cur, 1, "nn.Upsample", [None, 2, "nearest"]])
+        layers.append([[-1, lateral], 1, *concat])
+        layers += block(NECK_CHANNELS[level], ghost_neck)
+        cur = td[level] = len(layers) - 1
+    # Bottom-up: downsample, fuse with the top-down (or backbone) map, refine
+    outputs = [td[levels[0]]]
+    for level in levels[1:]:
+        layers.append([-1, 1, "Conv", [NECK_CHANNELS[level - 1], 3, 2]])
+        layers.append([[-1, td.get(level, feature[level])], 1, *concat])
+        layers += block(2 * NECK_CHANNELS[level - 1], ghost_neck)
+        outputs.append(len(layers) - 1)
+    layers.append([outputs, 1, "Detect", ["nc"]])
+
+    return {
+        "nc": base["nc"],
+        "names": base["names"],
+        "scale": "n",
+        "scales": {"n": [1.0, width, MAX_CHANNELS]},
+        "backbone": layers[:len(backbone)],
+        "head": layers[len(backbone):],
+    }
+
+
+def variant_name(depth, width, ghost, head):
+    return f"hf_d{depth:g}_w{width:g}_{ghost}_{head}"
+
+
+@torch.no_grad()
+def score(cfg):
+    """Training-free cost of one model dict: params, GFLOPs, latency, memory."""
+    model = tasks.DetectionModel(cfg, verbose=False).eval()
+    params = get_num_params(model)
+    gflops = get_flops(model, IMGSZ)
+    model.fuse(verbose=False)
+
+    act_bytes = []
+    hooks = [m.register_forward_hook(lambda _, __, out: act_bytes.append(
+        sum(t.numel() * t.element_size() for t in (out if isinstance(out, (list, tuple)) else [out])
+            if isinstance(t, torch.Tensor))))
+        for m in model.model]
+    x = torch.zeros(1, 3, IMGSZ, IMGSZ)
+    model(x)
+    for h in hooks:
+        h.remove()
+
+    model(x)  # Warm-up
+    times = []
+    for _ in range(LATENCY_ITERS):
+        t = time.perf_counter()
+        model(x)
+        times.append(time.perf_counter() - t)
+    return {
+        "params_m": params / 1e6,
+        "gflops": gflops,
+        "latency_ms": float(np.median(times) * 1000),
+        "memory_mb": (sum(p.numel() * p.element_size() for p in model.parameters()) + sum(act_bytes)) / 1e6,
+    }
+
+
+def pareto_front(rows, minimize=(), maximize=()):
+    """Indices of rows no other row dominates."""
+    cost = np.array([[r[k] for k in minimize] + [-r[k] for k in maximize] for r in rows], dtype=np.float64)
+    # i is dominated if some j is <= on every objective and < on at least one
+    le = (cost[None, :, :] <= cost[:, None, :]).all(axis=2)
+    lt = (cost[None, :, :] < cost[:, None, :]).any(axis=2)
+    return np.flatnonzero(~(le & lt).any(axis=1)).tolist()
+
+
+def proxy_train(name, cfg_path):
+    model = YOLO(str(cfg_path))
+    if PRETRAINED:
+        try:
+            model.load(PRETRAINED)
+        except Exception as e:
+            print(f"⚠️ Could not load pretrained weights: {e}")
+    model.train(
+        trainer=build_trainer(),
+        data=DATA_YAML,
+        epochs=PROXY_EPOCHS,
+        fraction=PROXY_FRACTION,
+        imgsz=IMGSZ,
+        batch=PROXY_BATCH,
+        project=str(OUTPUT_DIR / "proxy"),
+        name=name,
+        exist_ok=True,
+        plots=False,
+        device=DEVICE,
+    )
+    m = model.trainer.validator.metrics
+    per_class = {model.names[int(c)]: float(ap) for c, ap in zip(m.box.ap_class_index, m.box.all_ap.mean(1))}
+    return {"map50": float(m.box.map50), "map50_95": float(m.box.map), **{f"mAP_{k}": v for k, v in per_class.items()}}
+
+
+def main():
+    if THREADS:
+        torch.set_num_threads(THREADS)
+    with open(BASE_YAML) as f:
+        base = yaml.safe_load(f)
+    fallbacks = sorted(n for n in FALLBACK_MODULES if not hasattr(tasks, n))
+    if fallbacks:
+        print(f"⚠️  {', '.join(fallbacks)} not in this ultralytics install; scoring with "
+              f"{', '.join(FALLBACK_MODULES[n] for n in fallbacks)} instead")
+    (OUTPUT_DIR / "variants").mkdir(parents=True, exist_ok=True)
+
+    grid = list(itertools.product(DEPTHS, WIDTHS, GHOST, HEADS))
+    print(f"🧬 Scoring {len(grid)} variants at imgsz {IMGSZ} (no training) ...")
+    rows = []
+    for depth, width, ghost, head in grid:
+        name = variant_name(depth, width, ghost, head)
+        cfg = variant_yaml(depth, width, ghost, head, base)
+        path = OUTPUT_DIR / "variants" / f"{name}.yaml"
+        with open(path, "w") as f:
+            yaml.safe_dump(cfg, f, sort_keys=False, default_flow_style=None)
+        row = {"variant": name, "depth": depth, "width": width, "ghost": ghost, "head": head,
+               "fallback": "+".join(fallbacks), **score(cfg)}
+        rows.append(row)
+        print(f"   {name:<36} {row['params_m']:6.2f}M {row['gflops']:6.2f} GFLOPs "
+              f"{row['latency_ms']:7.1f} ms {row['memory_mb']:7.1f} MB")
+
+    front = pareto_front(rows, minimize=("latency_ms", "memory_mb"), maximize=("gflops",))
+    for i, row in enumerate(rows):
+        row["pareto"] = i in front
+    front.sort(key=lambda i: rows[i]["latency_ms"])
+    print(f"\n🎯 Pareto front: {len(front)} of {len(rows)} variants; proxy-training {min(len(front), MAX_PROXY_TRAIN)}")
+
+    for i in front[:MAX_PROXY_TRAIN]:
+        name = rows[i]["variant"]
+        print(f"🔥 Proxy training {name} ({PROXY_EPOCHS} epochs, {PROXY_FRACTION:.0%} of train)")
+        rows[i].update(proxy_train(name, OUTPUT_DIR / "variants" / f"{name}.yaml"))
+
+    trained = [r for r in rows if "map50_95" in r]
+    if trained:
+        for j in pareto_front(trained, minimize=("latency_ms",), maximize=("map50_95",)):
+            trained[j]["frontier"] = True
+
+    fields = list(dict.fromkeys(k for r in rows for k in r))
+    out = OUTPUT_DIR / "arch_frontier.csv"
+    with open(out, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for row in sorted(rows, key=lambda r: r["latency_ms"]):
+            writer.writerow({k: round(v, 4) if isinstance(v, float) else v for k, v in row.items()})
+
+    if trained:
+        print(f"\n{'variant':<36} {'ms':>7} {'MB':>7} {'mAP50':>7} {'mAP50-95':>9}")
+        for r in sorted(trained, key=lambda r: r["latency_ms"]):
+            mark = " ⭐" if r.get("frontier") else ""
+            print(f"{r['variant']:<36} {r['latency_ms']:>7.1f} {r['memory_mb']:>7.1f} "
+                  f"{r['map50']:>7.3f} {r['map50_95']:>9.3f}{mark}")
+    print(f"💾 Frontier written to {out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# ==========================================
+# CPU LATENCY BENCHMARK FOR TRAINED CHECKPOINTS
+# ==========================================
+# The accuracy side of every run is in runs/train/*/results.csv; this puts
+# the cost side next to it. For each run's weights it measures, on CPU:
+#   - cold start: process launch -> first prediction (imports + load + first pass)
+#   - per-image latency (p50/p99) and throughput at each BATCH_SIZES x THREADS
+#   - peak RSS of the process
+#   - parameters and GFLOPs at IMGSZ
+# Every (run, thread count) is measured in a fresh child process, so cold
+# start and peak RSS are not polluted by the runs benchmarked before it.
+#
+# Output: <run>/cpu_benchmark.csv next to each results.csv, plus
+# cpu_benchmark_comparison.csv in RUNS_DIR and a table on stdout.
+
+# ================= CONFIGURATION =================
+RUNS_DIR = Path(__file__).resolve().parents[1] / "Datasets/Final_Blood_YOLO_Hierarchical_Remastered_clahe/runs/train"
+# Runs to compare; None = every run directory that has weights
+RUNS = ["baseline_aug_pure_yolo11n", "hemo_flash_v11_9class_aug2", "hemo_flash_v11_9class_phase2_pt2_imb"]
+WEIGHTS_NAME = "best.pt"
+IMGSZ = 640
+BATCH_SIZES = [1, 4, 8]
+THREADS = [1, 2, 4]       # torch intra-op threads; counts above the CPU count are skipped
+WARMUP = 3                # Untimed passes per batch size
+ITERS = 20                # Timed passes per batch size
+OUTPUT_NAME = "cpu_benchmark.csv"
+# =================================================
+
+FIELDS = ["run", "threads", "batch", "p50_ms_per_image", "p99_ms_per_image", "images_per_s",
+          "preprocess_ms", "inference_ms", "postprocess_ms",
+          "cold_start_s", "load_s", "first_pass_s", "peak_rss_mb", "params_m", "gflops"]
+
+
+def make_frames(n):
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Datasets"))
+    from benchmark_clahe import make_smear
+    rng = np.random.default_rng(0)
+    return [make_smear(IMGSZ, IMGSZ, rng) for _ in range(n)]
+
+
+def worker(weights, threads, launched_at):
+    """Runs inside the child process; prints one JSON result line."""
+    import torch
+    from ultralytics import YOLO
+    from ultralytics.utils.torch_utils import get_flops, get_num_params
+
+    torch.set_num_threads(threads)
+    frames = make_frames(max(BATCH_SIZES))
+    t = time.time()
+    model = YOLO(weights)
+    load_s = time.time() - t
+    t = time.time()
+    model.predict(frames[0], imgsz=IMGSZ, device="cpu", verbose=False)
+    first_pass_s = time.time() - t
+    cold_start_s = time.time() - launched_at
+
+    rows = []
+    for bs in BATCH_SIZES:
+        batch = frames[:bs]
+        for _ in range(WARMUP):
+            model.predict(batch, imgsz=IMGSZ, device="cpu", verbose=False)
+        seconds, speed = [], []
+        for _ in range(ITERS):
+            t = time.perf_counter()
+            results = model.predict(batch, imgsz=IMGSZ, device="cpu", verbose=False)
+            seconds.append(time.perf_counter() - t)
+            speed.append([results[0].speed[k] for k in ("preprocess", "inference", "postprocess")])
+        per_image = np.asarray(seconds) * 1000 / bs
+        stages = np.median(speed, axis=0)
+        rows.append({
+            "batch": bs,
+            "p50_ms_per_image": float(np.percentile(per_image, 50)),
+            "p99_ms_per_image": float(np.percentile(per_image, 99)),
+            "images_per_s": bs / float(np.median(seconds)),
+            "preprocess_ms": float(stages[0]),
+            "inference_ms": float(stages[1]),
+            "postprocess_ms": float(stages[2]),
+        })
+
+    common = {
+        "threads": threads,
+        "cold_start_s": cold_start_s,
+        "load_s": load_s,
+        "first_pass_s": first_pass_s,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "params_m": get_num_params(model.model) / 1e6,
+        "gflops": get_flops(model.model, IMGSZ),
+    }
+    print(json.dumps([{**common, **row} for row in rows]))
+
+
+def find_runs():
+    if not RUNS_DIR.is_dir():
+        raise FileNotFoundError(f"❌ Runs directory not found: {RUNS_DIR}")
+    names = RUNS if RUNS is not None else sorted(p.name for p in RUNS_DIR.iterdir() if p.is_dir())
+    runs = []
+    for name in names:
+        weights = RUNS_DIR / name / "weights" / WEIGHTS_NAME
+        if weights.exists():
+            runs.append((name, weights))
+        else:
+            print(f"⚠️  {name}: no {weights.relative_to(RUNS_DIR)}, skipped")
+    return runs
+
+
+def benchmark_run(name, weights):
+    rows = []
+    for threads in THREADS:
+        if threads > (os.cpu_count() or 1):
+            continue
+        proc = subprocess.run([sys.executable, __file__, "--worker", str(weights), str(threads), repr(time.time())],
+                              capture_output=True, text=True, cwd=Path(__file__).parent)
+        if proc.returncode != 0:
+            print(f"❌ {name} @ {threads} threads failed:\n{proc.stderr.strip()[-2000:]}")
+            continue
+        rows += [{"run": name, **row} for row in json.loads(proc.stdout.strip().splitlines()[-1])]
+    return rows
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: round(v, 4) if isinstance(v, float) else v for k, v in row.items()})
+
+
+def print_table(rows):
+    print(f"\n{'run':<38} {'thr':>3} {'bs':>3} {'p50 ms/img':>10} {'img/s':>7} {'cold s':>7} "
+          f"{'RSS MB':>7} {'params M':>8} {'GFLOPs':>7}")
+    for r in rows:
+        print(f"{r['run']:<38} {r['threads']:>3} {r['batch']:>3} {r['p50_ms_per_image']:>10.1f} "
+              f"{r['images_per_s']:>7.1f} {r['cold_start_s']:>7.2f} {r['peak_rss_mb']:>7.0f} "
+              f"{r['params_m']:>8.2f} {r['gflops']:>7.2f}")
+
+
+def main():
+    runs = find_runs()
+    if not runs:
+        print("❌ No checkpoints to benchmark.")
+        return
+    print(f"🧪 CPU benchmark: {len(runs)} runs, batch sizes {BATCH_SIZES}, threads {THREADS}, imgsz {IMGSZ}")
+    all_rows = []
+    for name, weights in runs:
+        print(f"⏱️  {name} ...")
+        rows = benchmark_run(name, weights)
+        if rows:
+            write_csv(RUNS_DIR / name / OUTPUT_NAME, rows)
+            all_rows += rows
+    if not all_rows:
+        return
+    write_csv(RUNS_DIR / "cpu_benchmark_comparison.csv", all_rows)
+    print_table(all_rows)
+    fastest = max((r for r in all_rows if r["batch"] == 1), key=lambda r: r["images_per_s"], default=None)
+    if fastest:
+        print(f"\n🏁 Lowest single-image latency: {fastest['run']} "
+              f"({fastest['p50_ms_per_image']:.1f} ms @ {fastest['threads']} threads)")
+    print(f"💾 Per-run tables: <run>/{OUTPUT_NAME}; comparison: {RUNS_DIR / 'cpu_benchmark_comparison.csv'}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--worker":
+        worker(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))
+    else:
+        main()
@@ -0,0 +1,105 @@
+import time
+
+import numpy as np
+
+from hierarchy import HierarchyFuser, MATCH_IOU
+
+# ==========================================
+# HIERARCHY FUSION BENCHMARK
+# ==========================================
+# Dense, RBC-heavy synthetic frames (what a thick smear gives after NMS):
+# hundreds of red cells, some platelets, and a handful of white cells, most
+# predicted as a WBC_Base + subtype pair. Compares the per-box Python
+# de-doubling that downstream counting used to do with HierarchyFuser on the
+# same detections, and checks both give the same counts.
+
+# ================= CONFIGURATION =================
+NAMES = ['RBC_Normal', 'RBC_Sickle', 'Platelets', 'WBC_Base',
+         'Neutrophil', 'Eosinophil', 'Basophil', 'Monocyte', 'Lymphocyte']
+BATCHES = [1, 8, 32]       # Frames per fused batch
+RBC_PER_FRAME = 600
+PLATELETS_PER_FRAME = 40
+WBC_PER_FRAME = 12         # Of which ~75% paired, the rest base-only or subtype-only
+FRAME = 1280
+REPEATS = 5
+# =================================================
+
+
+def make_frame(rng):
+    """Synthetic post-NMS detections for one frame: (boxes, scores, classes)."""
+    def boxes(n, lo, hi):
+        xy = rng.uniform(0, FRAME - hi, (n, 2))
+        return np.concatenate([xy, xy + rng.uniform(lo, hi, (n, 2))], axis=1)
+
+    parts = [(boxes(RBC_PER_FRAME, 30, 45), rng.choice([0, 1], RBC_PER_FRAME, p=[0.95, 0.05])),
+             (boxes(PLATELETS_PER_FRAME, 6, 12), np.full(PLATELETS_PER_FRAME, 2))]
+    wbc = boxes(WBC_PER_FRAME, 60, 90)
+    kind = rng.choice(3, WBC_PER_FRAME, p=[0.75, 0.15, 0.10])  # pair / base only / subtype only
+    subtype = rng.integers(4, 9, WBC_PER_FRAME)
+    jitter = wbc + rng.normal(0, 1.5, wbc.shape)
+    parts.append((wbc[kind != 2], np.full((kind != 2).sum(), 3)))
+    parts.append((jitter[kind != 1], subtype[kind != 1]))
+    b = np.concatenate([p[0] for p in parts]).astype(np.float32)
+    c = np.concatenate([p[1] for p in parts]).astype(np.int64)
+    return b, rng.uniform(0.3, 0.95, len(b)).astype(np.float32), c
+
+
+def loop_counts(frames, fuser):
+    """The old way: per image, per subtype box, scan the WBC_Base boxes in Python."""
+    out = np.zeros((len(frames), len(NAMES)), dtype=np.int64)
+    for f, (boxes, scores, classes) in enumerate(frames):
+        bases = [i for i in range(len(boxes)) if fuser.parent_of[classes[i]] < 0]
+        subs = sorted((i for i in range(len(boxes)) if fuser.parent_of[classes[i]] >= 0), key=lambda i: -scores[i])
+        claimed = set()
+        for i in subs:
+            best, best_iou = None, MATCH_IOU
+            for j in bases:
+                if classes[j] != fuser.parent_of[classes[i]]:
+                    continue
+                x1, y1 = max(boxes[i][0], boxes[j][0]), max(boxes[i][1], boxes[j][1])
+                x2, y2 = min(boxes[i][2], boxes[j][2]), min(boxes[i][3], boxes[j][3])
+                inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+                union = ((boxes[i][2] - boxes[i][0]) * (boxes[i][3] - boxes[i][1]) +
+                         (boxes[j][2] - boxes[j][0]) * (boxes[j][3] - boxes[j][1]) - inter)
+                iou = inter / max(union, 1e-9)
+                if iou >= best_iou:
+                    best, best_iou = j, iou
+            if best is None:
+                out[f, classes[i]] += 1
+                out[f, fuser.parent_of[classes[i]]] += 1
+            elif best not in claimed:
+                claimed.add(best)
+                out[f, classes[i]] += 1
+        for j in bases:
+            out[f, classes[j]] += 1
+    return out
+
+
+def main():
+    rng = np.random.default_rng(0)
+    fuser = HierarchyFuser(NAMES)
+    print(f"🧪 Hierarchy fusion: {RBC_PER_FRAME} RBC + {PLATELETS_PER_FRAME} platelets + "
+          f"{WBC_PER_FRAME} WBC per frame, best of {REPEATS}")
+    print(f"   {'frames':>6} {'boxes':>7} {'loop ms':>9} {'fused ms':>9} {'speed-up':>9} {'merged':>7}")
+    for n in BATCHES:
+        frames = [make_frame(rng) for _ in range(n)]
+        flat = [np.concatenate([f[k] for f in frames]) for k in range(3)]
+        batch_idx = np.repeat(np.arange(n), [len(f[0]) for f in frames])
+
+        loop_s, fused_s = [], []
+        for _ in range(REPEATS):
+            t = time.perf_counter()
+            expected = loop_counts(frames, fuser)
+            loop_s.append(time.perf_counter() - t)
+            t = time.perf_counter()
+            cells = fuser.fuse(*flat, batch_idx)
+            counts = fuser.counts(cells, n)
+            fused_s.append(time.perf_counter() - t)
+        if not np.array_equal(counts, expected):
+            print(f"   ⚠️  counts differ from the loop on {n} frames")
+        loop_ms, fused_ms = min(loop_s) * 1000, min(fused_s) * 1000
+        print(f"   {n:>6} {len(flat[0]):>7} {loop_ms:>9.2f} {fused_ms:>9.2f} "
+              f"{loop_ms / max(fused_ms, 1e-9):>8.1f}x {cells['merged']:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import json
+import sys
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from inference_server import InferenceService, WEIGHTS
+from perf_stats import LatencyStats, format_summary
+
+# ==========================================
+# LOAD GENERATOR FOR THE INFERENCE SERVER
+# ==========================================
+# Replays frames from CLIENTS concurrent "stations" against one batching
+# policy after another and prints latency / throughput side by side.
+#
+# MODE = "inprocess" drives InferenceService directly (isolates the batching
+# policy); MODE = "http" posts to a running inference_server.py at URL, in
+# which case only that server's policy is measured.
+
+# ================= CONFIGURATION =================
+MODE = "inprocess"
+URL = "http://127.0.0.1:8080/predict"
+IMAGE_DIR = None        # Frames to send; None = synthetic 640x480 smears
+CLIENTS = 8             # Concurrent stations
+REQUESTS_PER_CLIENT = 25
+THINK_MS = 0            # Pause between a station's requests (0 = closed loop)
+# (max_batch, max_wait_ms) policies; (1, 0) is one-image-at-a-time serving
+POLICIES = [(1, 0), (4, 5), (8, 10), (16, 25)]
+# =================================================
+
+def load_frames():
+    if IMAGE_DIR and Path(IMAGE_DIR).is_dir():
+        paths = sorted(Path(IMAGE_DIR).glob("*"))[:64]
+        frames = [p.read_bytes() for p in paths if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".bmp")]
+        if frames:
+            return frames
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Datasets"))
+    from benchmark_clahe import make_smear
+    rng = np.random.default_rng(0)
+    return [cv2.imencode(".jpg", make_smear(480, 640, rng))[1].tobytes() for _ in range(16)]
+
+def run_clients(send, frames):
+    """Fires CLIENTS threads x REQUESTS_PER_CLIENT requests; returns client-side stats."""
+    stats = LatencyStats()
+    errors = []
+
+    def station(k):
+        for r in range(REQUESTS_PER_CLIENT):
+            start = time.perf_counter()
+            try:
+                send(frames[(k * REQUESTS_PER_CLIENT + r) % len(frames)])
+            except Exception as e:
+                errors.append(e)
+                continue
+            stats.record(time.perf_counter() - start)
+            if THINK_MS:
+                time.sleep(THINK_MS / 1000)
+
+    threads = [threading.Thread(target=station, args=(k,)) for k in range(CLIENTS)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    if errors:
+        print(f"   ⚠️  {len(errors)} failed requests (first: {errors[0]})")
+    return stats
+
+def http_send(data):
+    req = urllib.request.Request(URL, data=data, headers={"Content-Type": "application/octet-stream"})
+    with urllib.request.urlopen(req) as resp:
+        resp.read()
+
+def main():
+    weights = sys.argv[1] if len(sys.argv) > 1 else WEIGHTS
+    frames = load_frames()
+    total = CLIENTS * REQUESTS_PER_CLIENT
+    print(f"🧪 Load test: {CLIENTS} stations x {REQUESTS_PER_CLIENT} requests, {len(frames)} distinct frames, {MODE}")
+
+    if MODE == "http":
+        client = run_clients(http_send, frames).summary()
+        with urllib.request.urlopen(URL.rsplit("/", 1)[0] + "/metrics") as resp:
+            client["mean_batch"] = json.load(resp)["mean_batch"]
+        print(f"   {'server':>14}  {format_summary(client)}")
+        return
+
+    results = []
+    for max_batch, max_wait_ms in POLICIES:
+        with InferenceService(weights, max_batch=max_batch, max_wait_ms=max_wait_ms) as service:
+            service.stats.reset()  # Drop the warm-up
+            client = run_clients(service.predict, frames).summary()
+            client["mean_batch"] = service.stats.summary()["mean_batch"]
+        results.append(((max_batch, max_wait_ms), client))
+        print(f"   batch<={max_batch:<3} wait<={max_wait_ms:<3}ms  {format_summary(client)}")
+
+    best = max(results, key=lambda r: r[1]["images_per_s"])
+    base = results[0][1]["images_per_s"]
+    print(f"🏁 Best throughput: batch<={best[0][0]}, wait<={best[0][1]}ms "
+          f"({best[1]['images_per_s'] / base:.2f}x the first policy, {total} requests each)")
+
+if __name__ == "__main__":
+    main()
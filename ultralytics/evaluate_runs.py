@@ -0,0 +1,425 @@
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+# ==========================================
+# CACHED, VECTORIZED CROSS-RUN EVALUATION
+# ==========================================
+# Comparing runs used to mean re-validating every best.pt one after another
+# and reading the PNG curves by eye. This evaluates every run's checkpoint on
+# SPLITS and writes one leaderboard:
+#
+#   - raw pre-NMS outputs go through result_cache.py, one sqlite file per run
+#     (<run>/eval_cache.sqlite). Re-evaluating after a threshold or metric
+#     change costs NMS only; inference runs again only for a new checkpoint
+#     or changed images
+#   - detections are matched to the ground truth for all images at once:
+#     every same-image (detection, GT) pair in one array, IoU and the
+#     one-to-one assignment with numpy (same rule as ultralytics' val, so
+#     mAP matches model.val() at the same conf / iou)
+#   - per-class AP50 / AP50-95 / P / R, a confidence sweep and a confusion
+#     matrix are computed from that one match
+#   - checkpoints are evaluated in parallel worker processes,
+#     THREADS_PER_WORKER torch threads each
+#
+# Output: <run>/eval/<split>_per_class.csv, _thresholds.csv, _confusion.csv
+# and RUNS_DIR/leaderboard.csv (one row per run and split).
+
+# ================= CONFIGURATION =================
+DATASET_DIR = Path(__file__).resolve().parents[1] / "Datasets/Final_Blood_YOLO_Hierarchical_Remastered_clahe"
+DATA_YAML = DATASET_DIR / "data.yaml"
+RUNS_DIR = DATASET_DIR / "runs/train"
+# Runs to compare; None = every run directory that has weights
+RUNS = ["baseline_aug_pure_yolo11n", "hemo_flash_v11_9class_aug2", "hemo_flash_v11_9class_phase1_imb",
+        "hemo_flash_v11_9class_phase2_imb", "hemo_flash_v11_9class_phase2_pt2_imb"]
+WEIGHTS_NAME = "best.pt"
+SPLITS = ["val", "test"]      # data.yaml keys
+IMGSZ = 640
+ONLINE_CLAHE = None           # Same as the runs' ONLINE_CLAHE (None: the dataset is CLAHE'd already)
+BATCH = 16                    # Images per forward pass on a cache miss
+DEVICE = "cpu"
+WORKERS = None                # Checkpoints evaluated at once; None = CPU count // THREADS_PER_WORKER
+THREADS_PER_WORKER = 2
+CACHE_NAME = "eval_cache.sqlite"
+CACHE_MAX_BYTES = 8 * 1024 ** 3
+
+CONF = 0.001                  # NMS settings of ultralytics' val
+NMS_IOU = 0.7
+MAX_DET = 300
+CONF_SWEEP = np.round(np.arange(0.05, 0.96, 0.05), 2)
+CONFUSION_CONF = 0.25
+CONFUSION_IOU = 0.45
+PAIR_CHUNK = 4_000_000        # (detection, GT) pairs matched per block of images
+SORT_BY = "weighted"          # Leaderboard column (descending); "weighted" = successive_halving.score()
+# =================================================
+
+IOUV = np.linspace(0.5, 0.95, 10)
+
+
+# --- Data ---
+def split_samples(data, split):
+    """(name, image, cls[N], xywh[N, 4] normalized) of every image of one data yaml split.
+
+    image is the encoded bytes (or a decoded array for raw-codec shards).
+    """
+    from label_index import parse_label_lines
+    from shard_format import ShardReader, is_shard_dir
+    from ultralytics.data.utils import IMG_FORMATS, img2label_paths
+
+    path = Path(data[split])
+    path = path if path.is_absolute() else Path(data["path"]) / path
+    if is_shard_dir(path):
+        reader = ShardReader(path)
+        for i, name in enumerate(reader.names):
+            cls, xywh = reader.label(i)
+            image = reader.image(i) if reader.codec == "raw" else reader.image_bytes(i).tobytes()
+            yield name, image, cls[:, 0], xywh
+        return
+
+    if path.suffix == ".txt":
+        files = [str(path.parent / f.strip().removeprefix("./")) for f in path.read_text().splitlines() if f.strip()]
+    else:
+        files = sorted(str(p) for p in path.iterdir() if p.suffix[1:].lower() in IMG_FORMATS)
+    for im_file, label_file in zip(files, img2label_paths(files)):
+        text = Path(label_file).read_text() if os.path.exists(label_file) else ""
+        class_ids, boxes = parse_label_lines(text.splitlines())
+        with open(im_file, 'rb') as f:
+            image = f.read()
+        yield Path(im_file).name, image, np.asarray(class_ids, np.int64), np.asarray(boxes, np.float32).reshape(-1, 4)
+
+
+def xywhn2xyxy(xywh, shape):
+    h, w = shape
+    out = np.empty_like(xywh)
+    out[:, 0] = (xywh[:, 0] - xywh[:, 2] / 2) * w
+    out[:, 1] = (xywh[:, 1] - xywh[:, 3] / 2) * h
+    out[:, 2] = (xywh[:, 0] + xywh[:, 2] / 2) * w
+    out[:, 3] = (xywh[:, 1] + xywh[:, 3] / 2) * h
+    return out
+
+
+# --- Inference (cached) ---
+def raw_outputs(detector, images):
+    """Raw output + meta of every image: cache hits first, the misses in one forward pass. None = unreadable."""
+    keys = [detector.key(im) for im in images]
+    out = [detector.cache.get(k) for k in keys]
+    frames = {}
+    for i, hit in enumerate(out):
+        if hit is None:
+            try:
+                frames[i] = detector.preprocess(images[i])
+            except ValueError:
+                print("⚠️  Unreadable image skipped")
+    if frames:
+        for i, (raw, meta) in zip(frames, detector.forward(list(frames.values()))):
+            detector.cache.put(keys[i], raw, meta)
+            out[i] = raw, meta
+    return out
+
+
+def detect_batch(detector, outputs):
+    """NMS over a batch of raw outputs (ultralytics' val settings) -> [(xyxy, score, cls) in original pixels]."""
+    import torch
+    from ultralytics.utils import nms, ops
+
+    raw = torch.from_numpy(np.stack([r for r, _ in outputs]).astype(np.float32))
+    dets = nms.non_max_suppression(raw, CONF, NMS_IOU, multi_label=True, max_det=MAX_DET,
+                                   end2end=getattr(detector.net, "end2end", False))
+    results = []
+    for det, (_, meta) in zip(dets, outputs):
+        boxes = ops.scale_boxes(tuple(meta["input_shape"]), det[:, :4].clone(), tuple(meta["orig_shape"]))
+        results.append((boxes.numpy(), det[:, 4].numpy(), det[:, 5].numpy().astype(np.int64)))
+    return results
+
+
+def collect(detector, data, split):
+    """Flat detection / GT arrays of a split, each tagged with its image number."""
+    dets, gts, batch = [], [], []
+
+    def flush():
+        outputs = raw_outputs(detector, [b[1] for b in batch])
+        ok = [(sample, o) for sample, o in zip(batch, outputs) if o is not None]
+        if ok:
+            for (sample, (_, meta)), det in zip(ok, detect_batch(detector, [o for _, o in ok])):
+                image_id = len(gts)
+                gts.append((image_id, sample[2], xywhn2xyxy(sample[3], meta["orig_shape"])))
+                dets.append((image_id, *det))
+        batch.clear()
+
+    for sample in split_samples(data, split):
+        batch.append(sample)
+        if len(batch) == BATCH:
+            flush()
+    if batch:
+        flush()
+
+    det_img = np.concatenate([np.full(len(d[1]), d[0]) for d in dets]) if dets else np.zeros(0, np.int64)
+    gt_img = np.concatenate([np.full(len(g[1]), g[0]) for g in gts]) if gts else np.zeros(0, np.int64)
+    return {
+        "images": len(gts),
+        "det_img": det_img.astype(np.int64),
+        "det_box": np.concatenate([d[1] for d in dets]).reshape(-1, 4) if dets else np.zeros((0, 4)),
+        "det_score": np.concatenate([d[2] for d in dets]) if dets else np.zeros(0),
+        "det_cls": np.concatenate([d[3] for d in dets]) if dets else np.zeros(0, np.int64),
+        "gt_img": gt_img.astype(np.int64),
+        "gt_box": np.concatenate([g[2] for g in gts]).reshape(-1, 4) if gts else np.zeros((0, 4)),
+        "gt_cls": np.concatenate([g[1] for g in gts]).astype(np.int64) if gts else np.zeros(0, np.int64),
+    }
+
+
+# --- Vectorized matching ---
+def image_pairs(det_img, gt_img, n_images):
+    """Yields (det index, GT index) arrays of every same-image pair, in blocks of whole images.
+
+    det_img / gt_img must be sorted (collect() builds them in image order).
+    """
+    nd = np.bincount(det_img, minlength=n_images)
+    ng = np.bincount(gt_img, minlength=n_images)
+    det_off = np.concatenate([[0], np.cumsum(nd)])
+    gt_off = np.concatenate([[0], np.cumsum(ng)])
+    cum = np.cumsum(nd * ng)
+    start = 0
+    while start < n_images:
+        done = cum[start - 1] if start else 0
+        end = max(int(np.searchsorted(cum, done + PAIR_CHUNK, side="right")), start + 1)
+        d = np.arange(det_off[start], det_off[end])
+        rep = ng[det_img[d]]
+        within = np.arange(rep.sum()) - np.repeat(np.cumsum(rep) - rep, rep)
+        yield np.repeat(d, rep), np.repeat(gt_off[det_img[d]], rep) + within
+        start = end
+
+
+def pair_iou(a, b):
+    """IoU of a[i] with b[i] (xyxy)."""
+    lt = np.maximum(a[:, :2], b[:, :2])
+    rb = np.minimum(a[:, 2:], b[:, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(1)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a + area_b - inter + 1e-7)
+
+
+def one_to_one(di, gi):
+    """Pairs sorted by IoU, descending -> one match per detection, then per GT (ultralytics' rule)."""
+    first = np.unique(di, return_index=True)[1]
+    di, gi = di[first], gi[first]
+    first = np.unique(gi, return_index=True)[1]
+    return di[first], gi[first]
+
+
+def match(ev):
+    """(D, 10) bool true-positive matrix at IOUV."""
+    tp = np.zeros((len(ev["det_score"]), len(IOUV)), dtype=bool)
+    for di, gi in image_pairs(ev["det_img"], ev["gt_img"], ev["images"]):
+        iou = pair_iou(ev["det_box"][di], ev["gt_box"][gi])
+        keep = (ev["det_cls"][di] == ev["gt_cls"][gi]) & (iou >= IOUV[0])
+        order = np.argsort(-iou[keep], kind="stable")
+        di, gi, iou = di[keep][order], gi[keep][order], iou[keep][order]
+        for k, t in enumerate(IOUV):
+            m = iou >= t
+            d, _ = one_to_one(di[m], gi[m])
+            tp[d, k] = True
+    return tp
+
+
+def confusion(ev, nc):
+    """(nc + 1, nc + 1) counts, rows = predicted, columns = true class; index nc = background."""
+    sel = np.flatnonzero(ev["det_score"] >= CONFUSION_CONF)
+    det_cls, gt_cls = ev["det_cls"][sel], ev["gt_cls"]
+    matched_d, matched_g = [], []
+    for di, gi in image_pairs(ev["det_img"][sel], ev["gt_img"], ev["images"]):
+        iou = pair_iou(ev["det_box"][sel[di]], ev["gt_box"][gi])
+        keep = iou > CONFUSION_IOU
+        order = np.argsort(-iou[keep], kind="stable")
+        d, g = one_to_one(di[keep][order], gi[keep][order])
+        matched_d.append(d)
+        matched_g.append(g)
+    d = np.concatenate(matched_d) if matched_d else np.zeros(0, np.int64)
+    g = np.concatenate(matched_g) if matched_g else np.zeros(0, np.int64)
+
+    n = nc + 1
+    matrix = np.bincount(det_cls[d] * n + gt_cls[g], minlength=n * n).reshape(n, n)
+    missed = np.ones(len(gt_cls), dtype=bool)
+    missed[g] = False
+    extra = np.ones(len(det_cls), dtype=bool)
+    extra[d] = False
+    matrix[nc, :nc] += np.bincount(gt_cls[missed], minlength=nc)
+    matrix[:nc, nc] += np.bincount(det_cls[extra], minlength=nc)
+    return matrix
+
+
+# --- Metrics ---
+def evaluate_split(ev, names):
+    """Per-class table, confidence sweep rows, confusion matrix and summary of one split."""
+    from ultralytics.utils.metrics import ap_per_class
+
+    nc = len(names)
+    tp = match(ev)
+    _, _, p, r, _, ap, classes, p_curve, r_curve, f1_curve, x, _ = ap_per_class(
+        tp, ev["det_score"], ev["det_cls"], ev["gt_cls"], names=dict(enumerate(names)))
+    instances = np.bincount(ev["gt_cls"], minlength=nc)
+
+    per_class = []
+    for i, c in enumerate(classes):
+        per_class.append({"class": names[c], "instances": int(instances[c]), "precision": p[i], "recall": r[i],
+                          "AP50": ap[i, 0], "AP50_95": ap[i].mean(),
+                          "best_f1_conf": float(x[f1_curve[i].argmax()])})
+
+    sweep = []
+    cols = np.searchsorted(x, CONF_SWEEP)
+    for conf, col in zip(CONF_SWEEP, cols):
+        for i, c in enumerate(classes):
+            f1 = f1_curve[i, col]
+            sweep.append({"conf": conf, "class": names[c], "precision": p_curve[i, col],
+                          "recall": r_curve[i, col], "f1": f1})
+    mean_f1 = f1_curve.mean(0)[cols] if len(classes) else np.zeros(len(cols))
+
+    summary = {
+        "images": ev["images"],
+        "instances": int(instances.sum()),
+        "precision": float(p.mean()) if len(p) else 0.0,
+        "recall": float(r.mean()) if len(r) else 0.0,
+        "mAP50": float(ap[:, 0].mean()) if len(ap) else 0.0,
+        "mAP50_95": float(ap.mean()) if len(ap) else 0.0,
+        "best_conf": float(CONF_SWEEP[mean_f1.argmax()]),
+    }
+    return per_class, sweep, confusion(ev, nc), summary
+
+
+def write_rows(path, rows):
+    if not rows:
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: round(float(v), 4) if isinstance(v, (float, np.floating)) else v
+                             for k, v in row.items()})
+
+
+def write_confusion(path, matrix, names):
+    labels = list(names) + ["background"]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["predicted \\ true"] + labels)
+        for label, row in zip(labels, matrix):
+            writer.writerow([label] + row.tolist())
+
+
+# --- Worker ---
+def init_worker():
+    import torch
+    torch.set_num_threads(THREADS_PER_WORKER)
+
+
+def evaluate_run(name, weights):
+    """Runs in a worker process: every split of one checkpoint -> its eval files + leaderboard rows."""
+    from ultralytics.data.utils import check_det_dataset
+
+    from result_cache import CachedDetector, ResultCache
+    from successive_halving import score
+
+    data = check_det_dataset(str(DATA_YAML))
+    names = [data["names"][i] for i in range(len(data["names"]))]
+    cache = ResultCache(RUNS_DIR / name / CACHE_NAME, CACHE_MAX_BYTES)
+    detector = CachedDetector(str(weights), cache, IMGSZ, ONLINE_CLAHE, DEVICE)
+    out_dir = RUNS_DIR / name / "eval"
+    out_dir.mkdir(exist_ok=True)
+
+    rows = []
+    for split in SPLITS:
+        if not data.get(split):
+            continue
+        hits, misses = cache.hits, cache.misses
+        t = time.perf_counter()
+        ev = collect(detector, data, split)
+        infer_s = time.perf_counter() - t
+        t = time.perf_counter()
+        per_class, sweep, matrix, summary = evaluate_split(ev, names)
+        metrics_s = time.perf_counter() - t
+
+        write_rows(out_dir / f"{split}_per_class.csv", per_class)
+        write_rows(out_dir / f"{split}_thresholds.csv", sweep)
+        write_confusion(out_dir / f"{split}_confusion.csv", matrix, names)
+        lookups = cache.hits - hits + cache.misses - misses
+        rows.append({
+            "run": name, "split": split, **summary,
+            "weighted": score({c["class"]: c["AP50_95"] for c in per_class}),
+            **{f"AP50_95_{c['class']}": c["AP50_95"] for c in per_class},
+            "cached_pct": 100 * (cache.hits - hits) / lookups if lookups else 0.0,
+            "infer_s": infer_s, "metrics_s": metrics_s,
+        })
+    cache.close()
+    return rows
+
+
+# --- Leaderboard ---
+def find_runs():
+    if not RUNS_DIR.is_dir():
+        raise FileNotFoundError(f"❌ Runs directory not found: {RUNS_DIR}")
+    names = RUNS if RUNS is not None else sorted(p.name for p in RUNS_DIR.iterdir() if p.is_dir())
+    runs = []
+    for name in names:
+        weights = RUNS_DIR / name / "weights" / WEIGHTS_NAME
+        if weights.exists():
+            runs.append((name, weights))
+        else:
+            print(f"⚠️  {name}: no {weights.relative_to(RUNS_DIR)}, skipped")
+    return runs
+
+
+def print_table(rows):
+    print(f"\n{'run':<40} {'split':<5} {'mAP50':>6} {'mAP50-95':>8} {'weighted':>8} {'sickle':>6} "
+          f"{'P':>5} {'R':>5} {'conf*':>5} {'cached':>6} {'s':>6}")
+    for r in rows:
+        print(f"{r['run']:<40} {r['split']:<5} {r['mAP50']:>6.3f} {r['mAP50_95']:>8.3f} {r['weighted']:>8.3f} "
+              f"{r.get('AP50_95_RBC_Sickle', float('nan')):>6.3f} {r['precision']:>5.2f} {r['recall']:>5.2f} "
+              f"{r['best_conf']:>5.2f} {r['cached_pct']:>5.0f}% {r['infer_s'] + r['metrics_s']:>6.1f}")
+
+
+def main():
+    runs = find_runs()
+    if not runs:
+        print("❌ No checkpoints to evaluate.")
+        return
+    workers = WORKERS or max(1, min(len(runs), (os.cpu_count() or 1) // THREADS_PER_WORKER))
+    print(f"🧪 Evaluating {len(runs)} checkpoints on {', '.join(SPLITS)} with {workers} worker(s), "
+          f"{THREADS_PER_WORKER} threads each")
+
+    rows, start = [], time.perf_counter()
+    with ProcessPoolExecutor(workers, mp_context=get_context("spawn"), initializer=init_worker) as pool:
+        futures = {pool.submit(evaluate_run, name, weights): name for name, weights in runs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                run_rows = future.result()
+            except Exception as e:
+                print(f"❌ {name} failed: {e}")
+                continue
+            rows += run_rows
+            summary = ", ".join(f"{r['split']} mAP50-95 {r['mAP50_95']:.3f}" for r in run_rows)
+            print(f"✅ {name}: {summary}")
+    if not rows:
+        return
+
+    rows.sort(key=lambda r: (SPLITS.index(r["split"]), -r[SORT_BY]))
+    fields = list(dict.fromkeys(k for r in rows for k in r))
+    out = RUNS_DIR / "leaderboard.csv"
+    with open(out, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, restval="")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: round(v, 4) if isinstance(v, float) else v for k, v in row.items()})
+    print_table(rows)
+    best = rows[0]
+    print(f"\n🏆 Best on {best['split']} by {SORT_BY}: {best['run']} ({best[SORT_BY]:.3f})")
+    print(f"⏱️  {time.perf_counter() - start:.1f}s total")
+    print(f"💾 Leaderboard: {out}; per-run tables: <run>/eval/")
+
+if __name__ == "__main__":
+    main()
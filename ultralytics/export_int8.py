@@ -0,0 +1,161 @@
+import json
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+from ultralytics.data.utils import check_det_dataset
+
+# ==========================================
+# INT8 EXPORT WITH ACCURACY / LATENCY GATING
+# ==========================================
+# Turns a trained run's FP32 best.pt into an INT8 CPU artifact and only
+# keeps it if it is still good enough to ship:
+#
+#   1. validate the FP32 checkpoint on GATE_SPLIT (mAP + per-class recall)
+#      and time it on CPU
+#   2. export with static INT8 quantization, calibrated on the first
+#      CALIBRATION_FRACTION of the val split (valid/images)
+#   3. validate + time the INT8 artifact the same way
+#   4. reject it if mAP50-95 drops more than MAP_BUDGET or any class in
+#      RARE_CLASSES loses more than RECALL_BUDGET recall
+#
+# Rare classes are the point of the gate: a sickle cell or basophil going
+# missing barely moves the overall mAP, but it is the detection that matters.
+# The gate scores on the test split, never on the images INT8 was calibrated on.
+# A rejected artifact is renamed with a ".rejected" suffix so nothing picks it
+# up by accident, and the script exits non-zero. Either way export_report.json
+# is written next to the weights.
+#
+# EXPORT_FORMAT "openvino" needs `openvino` + `nncf`; "onnx" needs `onnx` +
+# `onnxruntime`. Ultralytics asks for them on first use.
+
+# ================= CONFIGURATION =================
+DATASET_PATH = "/dist_home/suryansh/sharukesh/analog/Datasets/Final_Blood_YOLO_Hierarchical_Remastered_clahe"
+DATA_YAML = f"{DATASET_PATH}/data.yaml"
+RUN_DIR = f"{DATASET_PATH}/runs/train/hemo_flash_v11_9class_phase2_pt2_imb"
+WEIGHTS_NAME = "best.pt"
+EXPORT_FORMAT = "openvino"   # "openvino" (best on x86 CPUs) or "onnx"
+IMGSZ = 640
+CALIBRATION_FRACTION = 0.3   # Of the val split; ~300+ images is plenty
+GATE_SPLIT = "test"          # Scored split; must not be the calibration split
+VAL_BATCH = 16
+RARE_CLASSES = ["RBC_Sickle", "Eosinophil", "Basophil", "Monocyte"]
+RECALL_BUDGET = 0.03         # Max absolute recall drop per rare class
+MAP_BUDGET = 0.02            # Max absolute mAP50-95 drop overall
+LATENCY_IMAGES = 20          # Val images timed (batch 1) per model
+# =================================================
+
+
+def evaluate(model, label):
+    """GATE_SPLIT metrics: overall mAP and recall per class name."""
+    print(f"📏 Validating {label} ...")
+    m = model.val(data=DATA_YAML, split=GATE_SPLIT, imgsz=IMGSZ, batch=VAL_BATCH, device="cpu", plots=False,
+                  verbose=False)
+    recall = {model.names[int(c)]: float(r) for c, r in zip(m.box.ap_class_index, m.box.r)}
+    return {"map50": float(m.box.map50), "map50_95": float(m.box.map), "recall": recall}
+
+
+def val_images():
+    """Paths of the val split's images (as listed by data.yaml)."""
+    val = check_det_dataset(DATA_YAML)["val"]
+    paths = []
+    for entry in val if isinstance(val, list) else [val]:
+        p = Path(entry)
+        if p.is_dir():
+            paths += sorted(f for f in p.rglob("*") if f.suffix.lower() in (".jpg", ".jpeg", ".png", ".bmp"))
+        elif p.suffix == ".txt":
+            paths += [Path(line.strip()) for line in p.read_text().splitlines() if line.strip()]
+    return paths
+
+
+def time_model(model, frames):
+    """Median per-image CPU latency (ms) at batch 1."""
+    for frame in frames[:3]:
+        model.predict(frame, imgsz=IMGSZ, device="cpu", verbose=False)
+    times = []
+    for frame in frames:
+        t = time.perf_counter()
+        model.predict(frame, imgsz=IMGSZ, device="cpu", verbose=False)
+        times.append(time.perf_counter() - t)
+    return float(np.median(times) * 1000)
+
+
+def gate(fp32, int8):
+    """List of reasons to reject the INT8 artifact (empty = accept)."""
+    reasons = []
+    map_drop = fp32["map50_95"] - int8["map50_95"]
+    if map_drop > MAP_BUDGET:
+        reasons.append(f"mAP50-95 dropped {map_drop:.3f} (budget {MAP_BUDGET})")
+    for name in RARE_CLASSES:
+        if name not in fp32["recall"]:
+            continue  # Not in the gate split
+        drop = fp32["recall"][name] - int8["recall"].get(name, 0.0)
+        if drop > RECALL_BUDGET:
+            reasons.append(f"{name} recall dropped {drop:.3f} (budget {RECALL_BUDGET})")
+    return reasons
+
+
+def main():
+    weights = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(RUN_DIR) / "weights" / WEIGHTS_NAME
+    if not weights.exists():
+        raise FileNotFoundError(f"❌ Could not find weights at: {weights}")
+    frames = [cv2.imread(str(p)) for p in val_images()[:LATENCY_IMAGES]]
+    if not frames:
+        raise FileNotFoundError(f"❌ No val images found via {DATA_YAML}")
+    if GATE_SPLIT == "val" or not check_det_dataset(DATA_YAML).get(GATE_SPLIT):
+        raise ValueError(f"❌ GATE_SPLIT must be a split of {DATA_YAML} other than the calibration split (val)")
+
+    fp32_model = YOLO(weights)
+    fp32 = evaluate(fp32_model, "FP32")
+    fp32["latency_ms"] = time_model(fp32_model, frames)
+
+    print(f"🗜️  Exporting INT8 {EXPORT_FORMAT} (calibrating on {CALIBRATION_FRACTION:.0%} of val) ...")
+    artifact = Path(YOLO(weights).export(format=EXPORT_FORMAT, quantize=8, data=DATA_YAML, split="val",
+                                         fraction=CALIBRATION_FRACTION, imgsz=IMGSZ, device="cpu"))
+    int8_model = YOLO(artifact, task="detect")
+    int8 = evaluate(int8_model, "INT8")
+    int8["latency_ms"] = time_model(int8_model, frames)
+
+    print(f"\n{'class':<12} {'FP32 R':>7} {'INT8 R':>7} {'drop':>7}")
+    for name, r in fp32["recall"].items():
+        q = int8["recall"].get(name, 0.0)
+        flag = "  ⚠️" if name in RARE_CLASSES and r - q > RECALL_BUDGET else ""
+        print(f"{name:<12} {r:>7.3f} {q:>7.3f} {r - q:>7.3f}{flag}")
+    print(f"{'mAP50-95':<12} {fp32['map50_95']:>7.3f} {int8['map50_95']:>7.3f} "
+          f"{fp32['map50_95'] - int8['map50_95']:>7.3f}")
+    print(f"{'latency ms':<12} {fp32['latency_ms']:>7.1f} {int8['latency_ms']:>7.1f} "
+          f"({fp32['latency_ms'] / max(int8['latency_ms'], 1e-9):.2f}x)")
+
+    reasons = gate(fp32, int8)
+    if reasons:
+        rejected = artifact.with_name(artifact.name + ".rejected")
+        if rejected.exists():
+            shutil.rmtree(rejected) if rejected.is_dir() else rejected.unlink()
+        artifact = artifact.rename(rejected)
+    report = {
+        "weights": str(weights),
+        "artifact": str(artifact),
+        "format": EXPORT_FORMAT,
+        "accepted": not reasons,
+        "reasons": reasons,
+        "budgets": {"map50_95": MAP_BUDGET, "rare_recall": RECALL_BUDGET, "rare_classes": RARE_CLASSES},
+        "fp32": fp32,
+        "int8": int8,
+    }
+    with open(weights.parent / "export_report.json", "w") as f:
+        json.dump(report, f, indent=2)
+
+    if reasons:
+        print("\n❌ INT8 artifact REJECTED:")
+        for r in reasons:
+            print(f"   - {r}")
+        print(f"   Kept for inspection as {artifact}")
+        sys.exit(1)
+    print(f"\n✅ INT8 artifact accepted: {artifact}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import csv
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from ultralytics.utils import LOGGER, RANK
+from ultralytics.utils.loss import v8DetectionLoss
+from ultralytics.utils.torch_utils import unwrap_model
+
+# ==========================================
+# LOSS-DRIVEN HARD-EXAMPLE SAMPLING
+# ==========================================
+# OVERSAMPLE_CONFIG replays every sickle image 100x whether or not the model
+# already gets it right. With build_trainer(hard_examples=dict(...)) the
+# train loader draws each epoch by how hard each image still is instead:
+#
+#   - the detection loss also reports, per GT cell, 1 - the score of its true
+#     class at its best assigned anchor (its classification error)
+#   - every image keeps an EMA of that error per class it contains (N x nc
+#     float16, ~20 bytes per image); cells not seen yet count as fully hard
+#   - at the end of every epoch each image gets weight
+#         prior x (floor + worst class error of the image)
+#     so an image with one missed basophil among easy RBCs stays hard
+#
+# prior is the data yaml's sample_weights (make_balenced_txt.py) if it has
+# one, otherwise 1: use a plain manifest to let the losses alone decide.
+# A mosaic sample is credited to its first image, and only for the classes
+# that image contains. Per-class errors and the effective sample size are
+# written to <run>/hard_examples.csv; the record itself to
+# hard_examples.npz, which a resumed run picks up again.
+
+
+class HardExampleTracker:
+    """Per-image, per-class classification error EMA over the training set."""
+
+    def __init__(self, im_files, labels, nc, prior=None, momentum=0.7, floor=0.1):
+        self.index = {f: i for i, f in enumerate(im_files)}
+        self.nc = nc
+        self.momentum = momentum
+        self.floor = floor
+        self.prior = np.ones(len(im_files)) if prior is None else np.asarray(prior, dtype=np.float64)
+        # NaN = the image has no cell of that class
+        self.err = np.full((len(im_files), nc), np.nan, dtype=np.float16)
+        for i, label in enumerate(labels):
+            self.err[i, np.unique(label["cls"].astype(int))] = 1.0
+        self.owned = ~np.isnan(self.err)
+        self.active = False
+        self.reset_epoch()
+
+    def reset_epoch(self):
+        self.class_sum = np.zeros(self.nc)
+        self.class_count = np.zeros(self.nc)
+
+    def update(self, im_files, batch_idx, cls, err):
+        """One batch of per-cell errors; batch_idx / cls / err are aligned 1-D arrays."""
+        b = len(im_files)
+        key = batch_idx * self.nc + cls
+        sums = np.bincount(key, weights=err, minlength=b * self.nc).reshape(b, self.nc)
+        counts = np.bincount(key, minlength=b * self.nc).reshape(b, self.nc)
+        self.class_sum += sums.sum(0)
+        self.class_count += counts.sum(0)
+
+        rows = np.array([self.index.get(f, -1) for f in im_files])
+        keep = rows >= 0
+        rows, sums, counts = rows[keep], sums[keep], counts[keep]
+        seen = (counts > 0) & self.owned[rows]  # Mosaic partners' cells are not this image's
+        mean = np.divide(sums, np.maximum(counts, 1))
+        old = self.err[rows].astype(np.float32)
+        self.err[rows] = np.where(seen, self.momentum * old + (1 - self.momentum) * mean, old)
+
+    def weights(self):
+        hardness = np.where(self.owned, self.err, 0).max(1).astype(np.float64)  # Background images: 0
+        return self.prior * (self.floor + hardness)
+
+    def class_errors(self):
+        """Mean error per class over this epoch's cells (NaN if a class was not drawn)."""
+        with np.errstate(invalid="ignore"):
+            return self.class_sum / self.class_count
+
+    def save(self, path):
+        np.savez_compressed(path, err=self.err)
+
+    def load(self, path):
+        err = np.load(path)["err"]
+        if err.shape != self.err.shape:
+            LOGGER.warning(f"⚠️ {path} is for a different training set; starting the hard-example record fresh")
+            return
+        self.err = err
+
+
+class HardExampleLoss(v8DetectionLoss):
+    """v8DetectionLoss that also hands per-cell classification errors to a HardExampleTracker."""
+
+    def __init__(self, model, tracker):
+        super().__init__(model)
+        self.tracker = tracker
+
+    def get_assigned_targets_and_loss(self, preds, batch):
+        out = super().get_assigned_targets_and_loss(preds, batch)
+        if self.tracker.active and len(batch["cls"]):
+            fg_mask, target_gt_idx = out[0][:2]
+            self.record(preds["scores"].detach(), fg_mask, target_gt_idx, batch)
+        return out
+
+    @torch.no_grad()
+    def record(self, scores, fg_mask, target_gt_idx, batch):
+        batch_idx = batch["batch_idx"].view(-1).long().to(self.device)
+        cls = batch["cls"].view(-1).long().to(self.device)
+        # Targets are grouped by image, so a cell's flat index is its image's offset + its index in the image
+        offsets = torch.zeros(scores.shape[0] + 1, dtype=torch.long, device=self.device)
+        offsets.scatter_add_(0, batch_idx + 1, torch.ones_like(batch_idx))
+        offsets = offsets.cumsum(0)
+        img, anchor = fg_mask.nonzero(as_tuple=True)
+        cell = offsets[img] + target_gt_idx[img, anchor]
+        score = scores[img, cls[cell], anchor].float().sigmoid()
+        best = torch.zeros(len(cls), device=self.device).scatter_reduce_(0, cell, score, "amax")  # No anchor: 0
+        self.tracker.update(batch["im_file"], batch_idx.cpu().numpy(), cls.cpu().numpy(), (1 - best).cpu().numpy())
+
+
+class HardExampleSampling:
+    """Trainer callbacks that re-weight the WeightedEpochSampler from the loss every epoch."""
+
+    def __init__(self, trainer, momentum=0.7, floor=0.1):
+        self.trainer = trainer
+        self.options = dict(momentum=momentum, floor=floor)
+        self.tracker = None
+        for event in ("on_train_start", "on_train_epoch_start", "on_train_epoch_end"):
+            trainer.add_callback(event, getattr(self, event))
+
+    def on_train_start(self, trainer):
+        model = unwrap_model(trainer.model)
+        if type(model.init_criterion()) is not v8DetectionLoss:
+            LOGGER.warning("⚠️ Hard-example sampling needs a v8DetectionLoss model; keeping the static weights")
+            return
+        dataset, sampler = trainer.train_loader.dataset, trainer.train_loader.sampler
+        self.tracker = HardExampleTracker(dataset.im_files, dataset.labels, model.nc,
+                                          prior=sampler.weights.numpy(), **self.options)
+        path = trainer.save_dir / "hard_examples.npz"
+        if trainer.resume and path.exists():
+            self.tracker.load(path)
+            sampler.set_weights(self.tracker.weights())
+        model.criterion = HardExampleLoss(model, self.tracker)
+        LOGGER.info(f"🎯 Hard-example sampling over {len(dataset.im_files)} images "
+                    f"(momentum {self.options['momentum']}, floor {self.options['floor']})")
+
+    def on_train_epoch_start(self, trainer):
+        if self.tracker is not None:
+            self.tracker.reset_epoch()
+            self.tracker.active = True
+
+    def on_train_epoch_end(self, trainer):
+        if self.tracker is None:
+            return
+        self.tracker.active = False  # Validation losses must not count
+        weights = self.tracker.weights()
+        if RANK != -1:
+            # Each rank only saw its share of the draws; the sampler needs the same weights on every rank
+            shared = torch.as_tensor(weights, device=trainer.device)
+            dist.all_reduce(shared)
+            weights = (shared / dist.get_world_size()).cpu().numpy()
+        trainer.train_loader.sampler.set_weights(weights)
+        if RANK not in {-1, 0}:
+            return
+        ess = weights.sum() ** 2 / (weights ** 2).sum() / len(weights)
+        errors = self.tracker.class_errors()
+        names = trainer.data["names"]
+        row = {"epoch": trainer.epoch + 1, "effective_sample_pct": 100 * ess,
+               **{f"err_{names[c]}": e for c, e in enumerate(errors)}}
+        self.write_row(row)
+        self.tracker.save(trainer.save_dir / "hard_examples.npz")
+        worst = np.argsort(-np.nan_to_num(errors, nan=-1))[:3]
+        LOGGER.info(f"🎯 Hardest classes: {', '.join(f'{names[c]} {errors[c]:.2f}' for c in worst)}; "
+                    f"effective sample size {100 * ess:.0f}%")
+
+    def write_row(self, row):
+        path = self.trainer.save_dir / "hard_examples.csv"
+        new = not path.exists() or self.trainer.epoch == 0
+        with open(path, "w" if new else "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(row))
+            if new:
+                writer.writeheader()
+            writer.writerow({k: round(v, 4) if isinstance(v, float) else v for k, v in row.items()})
@@ -0,0 +1,468 @@
+import math
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import cv2
+import numpy as np
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.data.utils import img2label_paths
+from ultralytics.utils import LOGGER
+from ultralytics.utils.instance import Instances
+from ultralytics.utils.ops import resample_segments, segments2boxes
+
+# Shared preprocessing lives next to the ETL in Datasets/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Datasets"))
+from clahe_engine import build_clahe  # noqa: E402, F401 (hemo_trainer builds its CLAHE through here)
+from crop_bank import CropBank  # noqa: E402
+from letterbox_cache import LetterboxCache, cache_dir, cache_key, is_cache_dir  # noqa: E402
+from shard_format import ShardReader, is_shard_dir  # noqa: E402
+
+from train_telemetry import SampleTimer, wrap_transforms  # noqa: E402
+
+# ==========================================
+# HEMO-FLASH TRAINING DATASET
+# ==========================================
+# YOLODataset with the Hemo-Flash extras (online CLAHE, packed shards, ...). Built by
+# hemo_trainer.HemoDetectionTrainer; with every extra switched off it behaves
+# exactly like the stock YOLODataset.
+
+# Class hierarchy of the ETL (merge_remap_and_clahe.get_mapping): a typed WBC
+# is labeled twice, as WBC_Base and as its subtype, with the same box
+WBC_BASE = 3
+WBC_SUBTYPES = (4, 5, 6, 7, 8)
+
+
+class FrameCache:
+    """Bounded in-memory cache of processed frames.
+
+    Limited both by item count and by bytes; whichever is hit first evicts.
+    policy="lru" evicts the least recently *used* frame, policy="fifo" the
+    oldest *inserted* one (cheaper bookkeeping, better when every frame is
+    seen exactly once per epoch in random order).
+
+    Note: every dataloader worker process holds its own copy, so the real
+    memory ceiling is max_bytes * workers.
+    """
+
+    POLICIES = ("lru", "fifo")
+
+    def __init__(self, max_items=2000, max_bytes=2 * 1024 ** 3, policy="lru"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown eviction policy '{policy}', expected one of {self.POLICIES}")
+        self.max_items = int(max_items)
+        self.max_bytes = int(max_bytes)
+        self.policy = policy
+        self._items = OrderedDict()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        entry = self._items.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.policy == "lru":
+            self._items.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, nbytes):
+        if nbytes > self.max_bytes or self.max_items <= 0:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[1]
+        self._items[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while len(self._items) > self.max_items or self.nbytes > self.max_bytes:
+            _, (_, evicted_bytes) = self._items.popitem(last=False)
+            self.nbytes -= evicted_bytes
+            self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "items": len(self._items),
+            "MB": self.nbytes / 1e6,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CropBankPaste:
+    """Pastes rare cells from a crop_bank.CropBank into a freshly loaded frame.
+
+    rates: {class name: expected crops per frame}. Each frame draws a Poisson
+    count per class, capped at max_per_frame. With mosaic every one of its
+    four frames draws, so the rate per training sample is ~4x.
+
+    A crop keeps its size relative to the frame it was cut from (+-scale_jitter).
+    It gets a random 90 degree turn and flip, and it only lands where it and
+    every labeled cell overlap each other by at most max_overlap. That keeps
+    the existing labels valid. A pasted WBC subtype also gets its WBC_Base row,
+    like the cells the ETL labeled.
+    """
+
+    def __init__(self, bank, rates, max_per_frame=4, max_overlap=0.1, scale_jitter=0.15, tries=10):
+        ids = {name: c for c, name in bank.names.items()}
+        unknown = sorted(set(rates) - set(ids))
+        if unknown:
+            raise ValueError(f"❌ Not in the crop bank {bank.bank_dir}: {unknown}")
+        usable = [name for name in rates if len(bank.by_class[ids[name]])]
+        self.bank = bank
+        self.classes = np.array([ids[name] for name in usable], dtype=np.int64)
+        self.rates = np.array([rates[name] for name in usable], dtype=np.float64)
+        self.max_per_frame = max_per_frame
+        self.max_overlap = max_overlap
+        self.scale_jitter = scale_jitter
+        self.tries = tries
+
+    def _place(self, ch, cw, h, w, boxes):
+        """Top-left corner for a ch x cw cell box clear of `boxes` (xyxy), or None."""
+        for _ in range(self.tries):
+            x0, y0 = np.random.randint(0, w - cw + 1), np.random.randint(0, h - ch + 1)
+            if not len(boxes):
+                return x0, y0
+            iw = np.clip(np.minimum(boxes[:, 2], x0 + cw) - np.maximum(boxes[:, 0], x0), 0, None)
+            ih = np.clip(np.minimum(boxes[:, 3], y0 + ch) - np.maximum(boxes[:, 1], y0), 0, None)
+            inter = iw * ih
+            area = np.maximum((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]), 1e-6)
+            if (inter / area).max() <= self.max_overlap and inter.max() / (ch * cw) <= self.max_overlap:
+                return x0, y0
+        return None
+
+    def __call__(self, label):
+        img = label["img"]
+        if not len(self.classes) or img.ndim != 3 or img.shape[2] != 3:
+            return label
+        picks = np.repeat(self.classes, np.random.poisson(self.rates))
+        if not len(picks):
+            return label
+        picks = np.random.permutation(picks)[:self.max_per_frame]
+
+        img = img.copy()  # The loaded frame is also held by the mosaic buffer / RAM cache
+        h, w = img.shape[:2]
+        instances = label["instances"]
+        instances.convert_bbox("xyxy")
+        instances.denormalize(w, h)
+        boxes, new_cls = instances.bboxes.reshape(-1, 4), []
+        for c in picks:
+            crop, (fh, fw) = self.bank.crop(np.random.choice(self.bank.by_class[c]))
+            scale = max(h, w) / max(fh, fw) * np.random.uniform(1 - self.scale_jitter, 1 + self.scale_jitter)
+            size = (round(crop.shape[1] * scale), round(crop.shape[0] * scale))
+            if min(size) < 2 or size[0] >= w or size[1] >= h:
+                continue
+            crop = np.rot90(cv2.resize(crop, size, interpolation=cv2.INTER_LINEAR), np.random.randint(4))
+            if np.random.rand() < 0.5:
+                crop = crop[:, ::-1]
+            alpha = crop[..., 3]
+            # Cell box inside the crop, from its alpha (the crop also holds some context)
+            rows, cols = np.flatnonzero((alpha > 127).any(1)), np.flatnonzero((alpha > 127).any(0))
+            if not len(rows):
+                continue
+            ch, cw = crop.shape[:2]
+            corner = self._place(ch, cw, h, w, boxes)
+            if corner is None:
+                continue
+            x0, y0 = corner
+            roi = img[y0:y0 + ch, x0:x0 + cw]
+            a = alpha[..., None].astype(np.float32) / 255
+            roi[:] = (crop[..., :3] * a + roi * (1 - a)).astype(np.uint8)
+            box = [x0 + cols[0], y0 + rows[0], x0 + cols[-1] + 1, y0 + rows[-1] + 1]
+            rows = [c, WBC_BASE] if c in WBC_SUBTYPES else [c]
+            boxes = np.concatenate([boxes, np.asarray([box] * len(rows), dtype=boxes.dtype)])
+            new_cls += rows
+
+        if new_cls:
+            segments = instances.segments
+            if len(segments):  # Pasted cells get their box as polygon
+                rects = [np.array([[b[0], b[1]], [b[2], b[1]], [b[2], b[3]], [b[0], b[3]], [b[0], b[1]]],
+                                  dtype=np.float32) for b in boxes[-len(new_cls):]]
+                segments = np.concatenate([segments, np.stack(resample_segments(rects, segments.shape[1]))])
+            instances = Instances(boxes, segments, instances.keypoints, bbox_format="xyxy", normalized=False)
+            cls = np.asarray(new_cls, dtype=label["cls"].dtype).reshape(-1, 1)
+            label["cls"] = np.concatenate([label["cls"].reshape(-1, 1), cls])
+            label["img"] = img
+        instances.convert_bbox("xywh")
+        instances.normalize(w, h)
+        label["instances"] = instances
+        return label
+
+
+class HemoYOLODataset(YOLODataset):
+    """YOLODataset that can run CLAHE on the fly and read packed shards.
+
+    CLAHE is applied after the usual imgsz resize, so the work (and the cached
+    frame) is training-sized. The tile grid is defined as a tile count, so the
+    tiles still cover the same fraction of the field of view as in the ETL.
+
+    If img_path is a shard directory (merge_remap_and_clahe.py with
+    OUTPUT_FORMAT = "shards", trained on its data_shards.yaml), images and labels
+    come out of the memory-mapped shards; im_files then holds virtual
+    "<split dir>/<name>" paths.
+
+    With profile=True each sample carries a "timing" dict (decode, CLAHE and
+    per-augmentation-op seconds) for train_telemetry.TrainTelemetry.
+
+    crop_paste (a CropBankPaste) pastes rare cells from the crop bank into
+    every frame loaded for augmentation, before mosaic.
+
+    With letterbox_cache=True, frames and labels come from the ETL's
+    <path>/letterbox_<imgsz> cache (letterbox_cache.py) when it covers every
+    image: one memory-mapped slice per sample, no decode and no resize. The
+    frames are what load_image() would return, so the augmentations are unchanged.
+    """
+
+    def __init__(self, *args, clahe=None, frame_cache=None, profile=False, crop_paste=None, letterbox_cache=False,
+                 **kwargs):
+        # Set before super().__init__: cache="ram" already calls load_image()
+        self.clahe = clahe
+        self.frame_cache = frame_cache
+        self.crop_paste = crop_paste
+        self.shards = None
+        self.shard_ids = {}
+        self.use_letterbox = letterbox_cache
+        self.letterbox_rows = None  # (LetterboxCache, row) per image when the cache is in use
+        self.timer = SampleTimer() if profile else None
+        self.caching_raw = False  # True while cache_images() fills self.ims
+        super().__init__(*args, **kwargs)
+
+    # --- Telemetry ---
+    def build_transforms(self, hyp=None):
+        transforms = super().build_transforms(hyp)
+        return wrap_transforms(transforms, self.timer) if self.timer is not None else transforms
+
+    def __getitem__(self, index):
+        if self.timer is None:
+            return super().__getitem__(index)
+        self.timer.start()
+        label = self.transforms(self.get_image_and_label(index))
+        label["timing"] = self.timer.finish()
+        return label
+
+    # --- Crop bank ---
+    def get_image_and_label(self, index):
+        label = super().get_image_and_label(index)
+        if self.crop_paste is None or not self.augment:
+            return label
+        if self.timer is not None:
+            return self.timer.measure("crop_paste", self.crop_paste, label)
+        return self.crop_paste(label)
+
+    # --- Packed shards ---
+    def get_img_files(self, img_path):
+        if isinstance(img_path, list) or not is_shard_dir(img_path):
+            return super().get_img_files(img_path)
+        self.shards = ShardReader(img_path)
+        self.shard_ids = {str(Path(img_path) / name): i for i, name in enumerate(self.shards.names)}
+        im_files = list(self.shard_ids)
+        if not im_files:
+            raise FileNotFoundError(f"{self.prefix}No images found in shards {img_path}")
+        count = self.fraction if isinstance(self.fraction, int) else max(1, round(len(im_files) * self.fraction))
+        return im_files[:count]
+
+    def get_labels(self):
+        if self.use_letterbox:
+            labels = self.get_letterbox_labels()
+            if labels is not None:
+                return labels
+        if self.shards is None:
+            return super().get_labels()
+        labels = []
+        for im_file in self.im_files:
+            i = self.shard_ids[im_file]
+            shape = self.shards.shape(i)
+            if not all(shape):  # Undecodable at ETL time
+                continue
+            try:
+                cls, bboxes, segments = parse_label_text(self.shards.label_text(i))
+            except ValueError as e:
+                LOGGER.warning(f"{self.prefix}{im_file}: ignoring corrupt image/label: {e}")
+                continue
+            labels.append(dict(im_file=im_file, shape=shape, cls=cls, bboxes=bboxes, segments=segments,
+                               keypoints=None, normalized=True, bbox_format="xywh"))
+        if not labels:
+            raise RuntimeError(f"{self.prefix}No valid images found in shards {self.shards.split_dir}")
+        self.im_files = [lb["im_file"] for lb in labels]
+        self.label_files = img2label_paths(self.im_files)
+        drop_mixed_segments(labels, self.prefix)
+        if not any(len(lb["cls"]) for lb in labels):
+            LOGGER.warning(f"{self.prefix}Labels are missing or empty in {self.shards.split_dir}")
+        return labels
+
+    def check_cache_disk(self, safety_margin=0.1):
+        if self.shards is None and self.letterbox_rows is None:
+            return super().check_cache_disk(safety_margin)
+        LOGGER.warning(f"{self.prefix}cache='disk' is redundant for packed shards / the letterbox cache, "
+                       f"reading them directly")
+        return False
+
+    # --- Letterbox cache ---
+    def get_letterbox_labels(self):
+        """Labels from the letterbox cache, or None if it does not cover every image."""
+        root = cache_dir(self.data["path"], self.imgsz)
+        caches, rows = {}, {}
+        found = []
+        for im_file in self.im_files:
+            split, name = cache_key(im_file).split("/", 1)
+            if split not in caches:
+                split_dir = root / split
+                try:
+                    caches[split] = LetterboxCache(split_dir) if is_cache_dir(split_dir) else None
+                except RuntimeError as e:  # Older cache layout
+                    LOGGER.warning(f"{self.prefix}{e}")
+                    caches[split] = None
+                rows[split] = {n: j for j, n in enumerate(caches[split].names)} if caches[split] else {}
+            row = rows[split].get(name)
+            found.append(None if row is None else (caches[split], row))
+        missing = sum(f is None for f in found)
+        if missing:
+            LOGGER.warning(f"{self.prefix}letterbox cache {root} is missing {missing}/{len(found)} images; "
+                           f"decoding the originals (re-run merge_remap_and_clahe.py with LETTERBOX_IMGSZ = {self.imgsz})")
+            return None
+
+        labels, self.letterbox_rows = [], []
+        for im_file, (cache, row) in zip(self.im_files, found):
+            if not cache.valid[row]:  # Undecodable at ETL time
+                continue
+            try:
+                cls, bboxes, segments = parse_label_text(cache.label_text(row))
+            except ValueError as e:
+                LOGGER.warning(f"{self.prefix}{im_file}: ignoring corrupt image/label: {e}")
+                continue
+            labels.append(dict(im_file=im_file, shape=cache.source_shape(row), cls=cls, bboxes=bboxes,
+                               segments=segments, keypoints=None, normalized=True, bbox_format="xywh"))
+            self.letterbox_rows.append((cache, row))
+        if not labels:
+            raise RuntimeError(f"{self.prefix}No valid images in the letterbox cache {root}")
+        self.im_files = [lb["im_file"] for lb in labels]
+        self.label_files = img2label_paths(self.im_files)
+        drop_mixed_segments(labels, self.prefix)
+        LOGGER.info(f"{self.prefix}Reading {len(labels)} frames from the letterbox cache {root}")
+        return labels
+
+    def load_packed_image(self, i, rect_mode=True):
+        """BaseDataset.load_image() for a frame from the letterbox cache or the shards."""
+        if self.ims[i] is not None:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+        if self.letterbox_rows is not None:
+            cache, row = self.letterbox_rows[i]
+            im, (h0, w0) = cache.image(row), cache.source_shape(row)  # Already resized at ETL time
+            if self.cv2_flag == cv2.IMREAD_GRAYSCALE:
+                im = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
+        else:
+            im = self.shards.image(self.shard_ids[self.im_files[i]], self.cv2_flag)
+            if im is None:
+                raise FileNotFoundError(f"Image Not Found {self.im_files[i]}")
+            h0, w0 = im.shape[:2]
+
+        h1, w1 = im.shape[:2]
+        if rect_mode:  # Long side to imgsz, keeping the aspect ratio
+            r = self.imgsz / max(h1, w1)
+            if r != 1:
+                w, h = (min(math.ceil(w1 * r), self.imgsz), min(math.ceil(h1 * r), self.imgsz))
+                im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+        elif not (h1 == w1 == self.imgsz):  # Stretch to a square imgsz
+            im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+        if im.ndim == 2:
+            im = im[..., None]
+
+        # Same mosaic buffer as the parent
+        if self.augment and self.cache != "ram":
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, (h0, w0), im.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return im, (h0, w0), im.shape[:2]
+
+    # --- Image loading ---
+    def load_raw_image(self, i, rect_mode=True):
+        if self.shards is not None or self.letterbox_rows is not None:
+            return self.load_packed_image(i, rect_mode)
+        return super().load_image(i, rect_mode)
+
+    def cache_images(self):
+        # cache="ram" keeps the raw frames; CLAHE still runs per sample in _load_image()
+        self.caching_raw = True
+        try:
+            super().cache_images()
+        finally:
+            self.caching_raw = False
+
+    def load_image(self, i, rect_mode=True):
+        if self.timer is not None:
+            return self.timer.measure("decode", self._load_image, i, rect_mode)
+        return self._load_image(i, rect_mode)
+
+    def _load_image(self, i, rect_mode=True):
+        if self.clahe is None or self.caching_raw:
+            return self.load_raw_image(i, rect_mode)
+
+        key = (i, rect_mode)
+        if self.frame_cache is not None:
+            cached = self.frame_cache.get(key)
+            if cached is not None:
+                return cached
+
+        im, hw0, hw = self.load_raw_image(i, rect_mode)
+        # The parent's mosaic buffer / RAM cache hold the raw frame, so this
+        # never equalizes an already-equalized image.
+        im = self.timer.measure("clahe", self.clahe.apply, im) if self.timer is not None else self.clahe.apply(im)
+        entry = (im, hw0, hw)
+        if self.frame_cache is not None:
+            self.frame_cache.put(key, entry, entry[0].nbytes)
+        return entry
+
+
+def parse_label_text(text):
+    """YOLO label text -> (cls[N, 1], bboxes_xywh[N, 4], segments), parsed like verify_image_label().
+
+    Polygon rows keep their points as segments (copy_paste and rotation use
+    them). Raises ValueError where ultralytics would reject the label as corrupt.
+    """
+    rows = [line.split() for line in text.strip().splitlines() if line.strip()]
+    segments = []
+    if any(len(r) > 6 for r in rows):
+        if any(len(r) == 5 for r in rows):
+            raise ValueError("labels mix segment and detection rows")
+        classes = np.array([r[0] for r in rows], dtype=np.float32)
+        segments = [np.array(r[1:], dtype=np.float32).reshape(-1, 2) for r in rows]
+        lb = np.concatenate((classes.reshape(-1, 1), segments2boxes(segments)), 1)
+    else:
+        lb = np.array(rows, dtype=np.float32).reshape(-1, 5)
+    if len(lb):
+        # Duplicate rows are dropped, like verify_image_label() does
+        _, keep = np.unique(lb, axis=0, return_index=True)
+        if len(keep) < len(lb) and segments:  # Distinct polygons can share a class and box
+            keys = np.array([c.tobytes() + seg.tobytes() for c, seg in zip(lb[:, 0], segments)], dtype=object)
+            _, keep = np.unique(keys, return_index=True)
+        if len(keep) < len(lb):
+            lb = lb[keep]
+            segments = [segments[k] for k in keep] if segments else segments
+    return lb[:, :1], lb[:, 1:], segments
+
+
+def drop_mixed_segments(labels, prefix=""):
+    """Clears all segments when only some labels have them, as YOLODataset.get_labels() does."""
+    n_boxes = sum(len(lb["bboxes"]) for lb in labels)
+    n_segments = sum(len(lb["segments"]) for lb in labels)
+    if n_segments and n_boxes != n_segments:
+        LOGGER.warning(f"{prefix}{n_segments} segments for {n_boxes} boxes (detect-segment mixed dataset); "
+                       f"only boxes will be used")
+        for lb in labels:
+            lb["segments"] = []
+
+
+def build_crop_paste(crop_bank):
+    """dict(path=..., rates={...}, ...) -> CropBankPaste (None stays None)."""
+    if crop_bank is None or isinstance(crop_bank, CropBankPaste):
+        return crop_bank
+    options = dict(crop_bank)
+    return CropBankPaste(CropBank(options.pop("path")), **options)
@@ -0,0 +1,120 @@
+import math
+import os
+from pathlib import Path
+
+import torch
+from torch.utils.data import Sampler
+from ultralytics.utils import LOGGER
+
+# ==========================================
+# WEIGHTED EPOCH SAMPLER
+# ==========================================
+# Replaces "write the sickle image path 100 times" oversampling. The manifest
+# lists every image once; make_balenced_txt.py writes a companion
+# <name>_weights.txt ("<weight> <path>" per line) and the data yaml points at
+# it with `sample_weights:`. Each epoch draws `num_samples` indices with
+# replacement, proportional to those weights. hard_examples.py changes the
+# weights between epochs through set_weights().
+
+
+def read_sample_weights(weights_file):
+    """Parses a make_balenced_txt.py weights file into {abs image path: weight}."""
+    weights = {}
+    with open(weights_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            weight, path = line.split(maxsplit=1)
+            weights[os.path.abspath(path)] = float(weight)
+    return weights
+
+
+def resolve_sample_weights(data):
+    """Returns the weights file a data yaml asks for (or None)."""
+    weights_file = data.get("sample_weights")
+    if not weights_file:
+        train = data.get("train")
+        if isinstance(train, str) and train.endswith(".txt") and Path(train[:-4] + "_weights.txt").exists():
+            # A "weighted" manifest lists each image once: without its weights nothing is oversampled
+            LOGGER.warning(f"{train} has weights in {Path(train).stem}_weights.txt, but the data yaml has no "
+                           f"`sample_weights:` entry. Training WITHOUT oversampling; add the entry (or use the "
+                           f"yaml make_balenced_txt.py wrote).")
+        return None
+    weights_file = Path(weights_file)
+    if not weights_file.is_absolute():
+        weights_file = Path(data["path"]) / weights_file
+    if not weights_file.exists():
+        raise FileNotFoundError(
+            f"❌ sample_weights file not found: {weights_file}\n"
+            f"   Re-run make_balenced_txt.py with MANIFEST_MODE = \"weighted\"."
+        )
+    return weights_file
+
+
+def weights_for_files(im_files, weights_file):
+    """Per-image weights aligned with a dataset's im_files (unlisted images get 1)."""
+    by_path = read_sample_weights(weights_file)
+    return [by_path.get(os.path.abspath(f), 1.0) for f in im_files]
+
+
+class WeightedEpochSampler(Sampler):
+    """Draws `num_samples` indices per epoch, with replacement, by weight.
+
+    num_samples: int, None (= number of images, one "pass" worth of draws) or
+    "weighted" (= sum of weights, as long as the old duplicated manifest).
+    Each epoch is seeded from (seed, epoch), so runs are reproducible.
+
+    chunk: draw the epoch `chunk` indices at a time instead of all at once.
+    The dataloader pulls the next epoch's indices while the current one is
+    still running, so with one draw set_weights() would land an epoch late;
+    with chunks only the prefetched batches use the old weights.
+
+    rank / world_size (DDP): like DistributedSampler, every rank draws the
+    same sequence (same seed, same weights) and keeps every world_size-th
+    index, so the ranks split one epoch of num_samples draws between them.
+    """
+
+    def __init__(self, weights, num_samples=None, seed=0, chunk=None, rank=-1, world_size=1):
+        self.set_weights(weights)
+
+        if num_samples is None:
+            num_samples = len(self.weights)
+        elif num_samples == "weighted":
+            num_samples = int(round(self.weights.sum().item()))
+        self.num_samples = int(num_samples)
+        self.rank = max(rank, 0)
+        self.world_size = world_size if rank != -1 else 1
+        self.per_rank = math.ceil(self.num_samples / self.world_size)
+        self.seed = seed
+        self.chunk = chunk
+        self.epoch = 0
+
+    def set_weights(self, weights):
+        weights = torch.as_tensor(weights, dtype=torch.double)
+        if weights.ndim != 1 or len(weights) == 0:
+            raise ValueError("WeightedEpochSampler needs a non-empty 1-D list of weights")
+        if hasattr(self, "weights") and len(weights) != len(self.weights):
+            raise ValueError(f"Expected {len(self.weights)} weights, got {len(weights)}")
+        if (weights < 0).any() or weights.sum() <= 0:
+            raise ValueError("Sample weights must be non-negative with a positive sum")
+        self.weights = weights
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed * 1_000_003 + self.epoch)
+        self.epoch += 1
+        total = self.per_rank * self.world_size
+        chunk = (self.chunk or self.per_rank) * self.world_size
+        for start in range(0, total, chunk):
+            n = min(chunk, total - start)
+            draws = torch.multinomial(self.weights, n, replacement=True, generator=generator)
+            yield from draws[self.rank::self.world_size].tolist()
+
+    def set_epoch(self, epoch):
+        # The trainer calls this under DDP. The epoch counter in __iter__ already
+        # keeps the ranks in step, and it runs one epoch ahead of the trainer
+        # (the loader prefetches), so resetting it here would repeat an epoch.
+        pass
+
+    def __len__(self):
+        return self.per_rank
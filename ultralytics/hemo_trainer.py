@@ -0,0 +1,152 @@
+import torch.distributed as dist
+from torch.utils.data import BatchSampler
+from ultralytics.data.build import build_dataloader
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils import LOGGER
+from ultralytics.utils.torch_utils import torch_distributed_zero_first, unwrap_model
+
+from hard_examples import HardExampleSampling
+from hemo_dataset import FrameCache, HemoYOLODataset, build_clahe, build_crop_paste
+from hemo_sampler import WeightedEpochSampler, resolve_sample_weights, weights_for_files
+from train_telemetry import TrainTelemetry
+
+# ==========================================
+# HEMO-FLASH TRAINER
+# ==========================================
+# Drop-in DetectionTrainer used by the train_*.py launchers:
+#
+#   model.train(trainer=build_trainer(clahe=ONLINE_CLAHE), data=..., ...)
+#
+# clahe=dict(clip_limit=2.0, tile_grid_size=(8, 8)) runs CLAHE in the dataloader:
+# point the launcher at a raw merge (APPLY_CLAHE = False in
+# merge_remap_and_clahe.py) instead of keeping a second, CLAHE'd copy on disk.
+# clahe=None trains on the images as stored.
+# If the data yaml has a `sample_weights:` entry (see make_balenced_txt.py)
+# the train loader draws each epoch from those weights instead of shuffling.
+# With hard_examples=dict(...) the weights are also re-set every epoch from
+# how hard each image still is for the model (see hard_examples.py).
+# crop_bank=dict(path=..., rates=...) pastes rare cells from a
+# Datasets/crop_bank.py bank into the training frames (CropBankPaste).
+# With telemetry=True, per-epoch timings go to <run>/telemetry.csv + .png
+# (see train_telemetry.py).
+#
+# Ultralytics instantiates the trainer class itself, so options are baked
+# into a subclass by build_trainer() instead of being passed as train args.
+
+DEFAULT_FRAME_CACHE = dict(max_items=2000, max_bytes=2 * 1024 ** 3, policy="lru")
+
+
+class HemoDetectionTrainer(DetectionTrainer):
+    # Set through build_trainer()
+    clahe = None        # dict(clip_limit=..., tile_grid_size=...) -> CLAHE in the dataloader
+    frame_cache = None  # dict(max_items=..., max_bytes=..., policy=...) for CLAHE'd frames
+    epoch_length = "weighted"  # Weighted sampling draws/epoch: "weighted" = sum of weights, None = #images, or int
+    telemetry = False    # Per-epoch dataloader / augmentation / forward-backward timings
+    hard_examples = None  # dict(momentum=..., floor=...) -> loss-driven sample weights
+    crop_bank = None      # dict(path=..., rates={class name: crops per frame}, ...) -> CropBankPaste
+    letterbox_cache = False  # Train frames from the ETL's <path>/letterbox_<imgsz> cache when it exists
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profiler = TrainTelemetry(self) if self.telemetry else None
+        self.hard_miner = HardExampleSampling(self, **self.hard_examples) if self.hard_examples is not None else None
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        gs = max(int(unwrap_model(self.model).stride.max() if self.model else 0), 32)
+        cfg = self.args
+        clahe = build_clahe(self.clahe)
+        frame_cache = FrameCache(**self.frame_cache) if clahe is not None and self.frame_cache else None
+        return HemoYOLODataset(
+            img_path=img_path,
+            imgsz=cfg.imgsz,
+            batch_size=batch,
+            augment=mode == "train",
+            hyp=cfg,
+            rect=cfg.rect or mode == "val",
+            cache=cfg.cache or None,
+            single_cls=cfg.single_cls or False,
+            stride=gs,
+            pad=0.0 if mode == "train" else 0.5,
+            prefix=f"{mode}: ",
+            task=cfg.task,
+            classes=cfg.classes,
+            data=self.data,
+            fraction=cfg.fraction if mode == "train" else 1.0,
+            clahe=clahe,
+            frame_cache=frame_cache,
+            profile=self.telemetry and mode == "train",
+            crop_paste=build_crop_paste(self.crop_bank) if mode == "train" else None,
+            letterbox_cache=self.letterbox_cache and mode == "train",
+        )
+
+    def preprocess_batch(self, batch):
+        timing = batch.pop("timing", None)
+        if timing is not None and self.profiler is not None:
+            self.profiler.add_samples(timing)
+        batch = super().preprocess_batch(batch)
+        if self.profiler is not None:
+            self.profiler.forward_start()  # The trainer calls the model on the batch next
+        return batch
+
+    def get_dataloader(self, dataset_path, batch_size=16, rank=0, mode="train"):
+        weights_file = resolve_sample_weights(self.data) if mode == "train" else None
+        hard = mode == "train" and self.hard_examples is not None
+        if weights_file is None and not hard:
+            return super().get_dataloader(dataset_path, batch_size, rank, mode)
+
+        with torch_distributed_zero_first(rank):  # Labels *.cache written once
+            dataset = self.build_dataset(dataset_path, mode, batch_size)
+        if weights_file is not None:
+            weights = weights_for_files(dataset.im_files, weights_file)
+            if len(set(dataset.im_files)) != len(dataset.im_files):
+                LOGGER.warning("⚠️ Training manifest has duplicated paths AND sample_weights; "
+                               "the duplicates multiply the weights. Regenerate it with MANIFEST_MODE = \"weighted\".")
+        else:
+            weights = [1.0] * len(dataset)
+        # Hard-example weights change between epochs: draw a batch at a time so they apply right away
+        ddp = rank != -1 and dist.is_initialized()
+        sampler = WeightedEpochSampler(weights, num_samples=self.epoch_length, seed=self.args.seed,
+                                       chunk=batch_size if hard else None,
+                                       rank=dist.get_rank() if ddp else -1,
+                                       world_size=dist.get_world_size() if ddp else 1)
+        source = weights_file.name if weights_file is not None else "uniform prior"
+        LOGGER.info(f"⚖️  Weighted sampling from {source}{' + hard examples' if hard else ''}: "
+                    f"{len(dataset)} images, {sampler.num_samples} draws/epoch"
+                    f"{f' ({len(sampler)} per rank)' if ddp else ''}")
+        # Stock worker count (split across devices), pinning and seeding; only the sampler differs
+        loader = build_dataloader(dataset, batch=min(batch_size, len(sampler)), workers=self.args.workers,
+                                  shuffle=True, rank=-1, drop_last=self.args.compile, device=self.device)
+        return use_sampler(loader, sampler)
+
+
+def use_sampler(loader, sampler):
+    """Makes a build_dataloader() loader draw its batches from `sampler`."""
+    # DataLoader refuses new samplers after __init__; InfiniteDataLoader's
+    # _RepeatSampler wraps the batch sampler, so the swap goes under it.
+    loader.batch_sampler.sampler = BatchSampler(sampler, loader.batch_size, loader.drop_last)
+    object.__setattr__(loader, "sampler", sampler)
+    return loader
+
+
+def build_trainer(clahe=None, frame_cache=DEFAULT_FRAME_CACHE, epoch_length="weighted", telemetry=False,
+                  hard_examples=None, crop_bank=None, letterbox_cache=False):
+    """Returns a HemoDetectionTrainer subclass with the given options baked in.
+
+    clahe: None (images used as stored) or dict(clip_limit=2.0, tile_grid_size=(8, 8))
+    frame_cache: LRU/FIFO cache of CLAHE'd frames per dataloader worker, None to disable
+    epoch_length: draws per epoch when the data yaml has `sample_weights` ("weighted" = as many as the
+        old duplicated manifest had lines, None = one per image, or an int)
+    telemetry: write per-epoch timing telemetry (telemetry.csv / .png) next to results.csv
+    hard_examples: None or dict(momentum=0.7, floor=0.1) to re-weight sampling each epoch from the loss
+    crop_bank: None or dict(path=<bank dir>, rates={"RBC_Sickle": 0.5, ...}, max_per_frame=4, ...)
+    letterbox_cache: read training frames from merge_remap_and_clahe.py's LETTERBOX_IMGSZ cache
+    """
+    return type("HemoDetectionTrainer", (HemoDetectionTrainer,), {
+        "clahe": clahe,
+        "frame_cache": frame_cache,
+        "epoch_length": epoch_length,
+        "telemetry": telemetry,
+        "hard_examples": hard_examples,
+        "crop_bank": crop_bank,
+        "letterbox_cache": letterbox_cache,
+    })
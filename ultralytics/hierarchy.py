@@ -0,0 +1,153 @@
+import numpy as np
+
+# ==========================================
+# HIERARCHICAL POST-PROCESSING
+# ==========================================
+# The ETL's get_mapping labels every typed white cell twice with the same
+# box (e.g. [3, 4] = WBC_Base + Neutrophil), so the model predicts a parent
+# box and a subtype box for each of them. This stage folds each
+# parent/child pair into one cell record carrying both levels. It works on a
+# whole batch at once: there are no Python loops over images or boxes.
+#
+#   fuser = HierarchyFuser(model.names)
+#   cells = fuser.fuse_results(model.predict(frames))
+#   fuser.counts(cells, len(frames))  ->  (frames, classes) per-image cell counts
+#
+# Every cell has a `parent` class (its top-level class: RBC_Normal,
+# RBC_Sickle, Platelets or WBC_Base) and a `subtype` class, which is -1 when
+# the model found none. A subtype box with no WBC_Base partner still counts
+# as a WBC, with the subtype's score as the parent score.
+
+# ================= CONFIGURATION =================
+HIERARCHY = {"WBC_Base": ("Neutrophil", "Eosinophil", "Basophil", "Monocyte", "Lymphocyte")}
+MATCH_IOU = 0.7  # Parent/child boxes of one cell are near-identical; 0.7 leaves room for jitter
+# =================================================
+
+
+def box_iou(a, b):
+    """Row-wise IoU of two (N, 4) xyxy arrays."""
+    lt = np.maximum(a[:, :2], b[:, :2])
+    rb = np.minimum(a[:, 2:], b[:, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=1)
+    union = (a[:, 2:] - a[:, :2]).prod(axis=1) + (b[:, 2:] - b[:, :2]).prod(axis=1) - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def group_pairs(child_groups, parent_groups):
+    """All (child, parent) index pairs that share a group id, without a dense
+    child x parent matrix: parents are sorted by group and each child is
+    expanded over its group's slice."""
+    order = np.argsort(parent_groups, kind="stable")
+    sorted_groups = parent_groups[order]
+    start = np.searchsorted(sorted_groups, child_groups, side="left")
+    n = np.searchsorted(sorted_groups, child_groups, side="right") - start
+    ci = np.repeat(np.arange(len(child_groups)), n)
+    offset = np.arange(len(ci)) - np.repeat(np.cumsum(n) - n, n)
+    return ci, order[start[ci] + offset]
+
+
+class HierarchyFuser:
+    """Collapses parent/subtype duplicate detections into one record per cell."""
+
+    def __init__(self, names, hierarchy=HIERARCHY, match_iou=MATCH_IOU):
+        names = list(names.values()) if isinstance(names, dict) else list(names)
+        self.names = names
+        self.match_iou = match_iou
+        # parent_of[c] = class id of c's parent, or -1 for top-level classes
+        self.parent_of = np.full(len(names), -1, dtype=np.int64)
+        for parent, children in hierarchy.items():
+            for child in children:
+                self.parent_of[names.index(child)] = names.index(parent)
+        self.is_parent = np.zeros(len(names), dtype=bool)
+        self.is_parent[self.parent_of[self.parent_of >= 0]] = True
+
+    def fuse(self, boxes, scores, classes, batch_idx=None):
+        """Flat detections of a whole batch -> dict of per-cell arrays.
+
+        `batch_idx` says which image each detection belongs to (all zeros
+        when omitted). Each child is paired with its best-overlapping parent
+        of the right class in the same image; a parent takes at most one
+        child (the highest-scoring one; weaker rival subtypes for the same
+        cell are dropped and counted in `merged`).
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float32)
+        classes = np.asarray(classes, dtype=np.int64)
+        batch_idx = np.zeros(len(boxes), dtype=np.int64) if batch_idx is None else np.asarray(batch_idx, np.int64)
+
+        child = np.flatnonzero(self.parent_of[classes] >= 0)
+        parent = np.flatnonzero(self.is_parent[classes])
+        match = np.full(len(child), -1, dtype=np.int64)  # Index into `parent`
+        rivals = np.zeros(len(child), dtype=bool)
+        # Candidate pairs only within one (image, parent class) group
+        nc = len(self.names)
+        ci, pj = group_pairs(batch_idx[child] * nc + self.parent_of[classes[child]],
+                             batch_idx[parent] * nc + classes[parent])
+        if len(ci):
+            iou = box_iou(boxes[child[ci]], boxes[parent[pj]])
+            # Best parent per child: sort pairs by (child, -iou), take each child's first
+            order = np.lexsort((-iou, ci))
+            kids, first = np.unique(ci[order], return_index=True)
+            best, best_iou = pj[order[first]], iou[order[first]]
+            ok = best_iou >= self.match_iou
+            kids, best, score = kids[ok], best[ok], scores[child[kids[ok]]]
+            # One child per parent: strongest child claims it
+            by_score = np.argsort(-score, kind="stable")
+            _, winner = np.unique(best[by_score], return_index=True)
+            match[kids[by_score[winner]]] = best[by_score[winner]]
+            rivals[kids] = True
+            rivals[kids[by_score[winner]]] = False
+
+        matched = match >= 0
+        claimed = np.zeros(len(parent), dtype=bool)
+        claimed[match[matched]] = True
+        plain = np.ones(len(boxes), dtype=bool)
+        plain[child] = False
+        plain[parent[claimed]] = False
+        lone_child = child[~matched & ~rivals]
+        pair_child, pair_parent = child[matched], parent[match[matched]]
+
+        # Cells: plain detections (incl. unpaired parents), paired cells, lone subtypes
+        plain = np.flatnonzero(plain)
+        # A paired cell keeps whichever of its two boxes is more confident
+        take_child = scores[pair_child] > scores[pair_parent]
+        pair_box = np.where(take_child[:, None], boxes[pair_child], boxes[pair_parent])
+        no_sub = np.full(len(plain), -1, dtype=np.int64)
+        return {
+            "batch": np.concatenate([batch_idx[plain], batch_idx[pair_parent], batch_idx[lone_child]]),
+            "boxes": np.concatenate([boxes[plain], pair_box, boxes[lone_child]]),
+            "parent": np.concatenate([classes[plain], classes[pair_parent], self.parent_of[classes[lone_child]]]),
+            "parent_score": np.concatenate([scores[plain], scores[pair_parent], scores[lone_child]]),
+            "subtype": np.concatenate([no_sub, classes[pair_child], classes[lone_child]]),
+            "subtype_score": np.concatenate([np.zeros(len(plain), np.float32), scores[pair_child],
+                                             scores[lone_child]]),
+            "merged": int(len(pair_child) + rivals.sum()),
+        }
+
+    def fuse_results(self, results):
+        """ultralytics Results list -> fuse() over the whole batch."""
+        n = [len(r.boxes) for r in results]
+        if not sum(n):
+            return self.fuse(np.zeros((0, 4)), np.zeros(0), np.zeros(0))
+        return self.fuse(np.concatenate([r.boxes.xyxy.cpu().numpy() for r in results]),
+                         np.concatenate([r.boxes.conf.cpu().numpy() for r in results]),
+                         np.concatenate([r.boxes.cls.cpu().numpy() for r in results]),
+                         np.repeat(np.arange(len(results)), n))
+
+    def counts(self, cells, n_images):
+        """(n_images, classes) cell counts: each cell counts once at its parent
+        class and once more at its subtype, if it has one."""
+        nc = len(self.names)
+        flat = np.bincount(cells["batch"] * nc + cells["parent"], minlength=n_images * nc)
+        sub = cells["subtype"] >= 0
+        flat += np.bincount(cells["batch"][sub] * nc + cells["subtype"][sub], minlength=n_images * nc)
+        return flat.reshape(n_images, nc)
+
+    def records(self, cells, image=0):
+        """One image's cells as dicts (for JSON output)."""
+        rows = np.flatnonzero(cells["batch"] == image)
+        return [{"box": [round(float(v), 1) for v in cells["boxes"][i]],
+                 "parent": self.names[cells["parent"][i]], "parent_conf": round(float(cells["parent_score"][i]), 4),
+                 "subtype": self.names[cells["subtype"][i]] if cells["subtype"][i] >= 0 else None,
+                 "subtype_conf": round(float(cells["subtype_score"][i]), 4)}
+                for i in rows]
@@ -0,0 +1,238 @@
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+# Shared preprocessing lives next to the ETL in Datasets/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Datasets"))
+from clahe_engine import build_clahe  # noqa: E402
+from perf_stats import LatencyStats, format_summary
+from result_cache import CachedDetector, ResultCache, shape_groups
+
+# ==========================================
+# DYNAMIC MICRO-BATCHING INFERENCE SERVER
+# ==========================================
+# Several microscope stations post frames at once. One forward pass per
+# frame leaves most of the CPU's SIMD width idle, so requests are queued and
+# the model thread forms batches on the fly: it waits for up to MAX_BATCH
+# frames, but never holds the oldest one longer than MAX_WAIT_MS.
+#
+#   decode + CLAHE  --(PREPROCESS_WORKERS threads)-->  queue  -->  model thread (batches)
+#
+#   POST /predict   body = encoded image   -> JSON detections
+#   GET  /metrics                          -> p50/p99 latency, images/s, mean batch
+
+# ================= CONFIGURATION =================
+RUNS_DIR = Path(__file__).resolve().parents[1] / "Datasets/Final_Blood_YOLO_Hierarchical_Remastered_clahe/runs/train"
+WEIGHTS = RUNS_DIR / "hemo_flash_v11_9class_aug2" / "weights" / "best.pt"
+HOST, PORT = "0.0.0.0", 8080
+IMGSZ = 640
+CONF = 0.25
+MAX_BATCH = 8          # Largest batch the model thread will form
+MAX_WAIT_MS = 10       # Latency budget spent waiting for a batch to fill
+PREPROCESS_WORKERS = 2  # Decode + CLAHE threads (OpenCV releases the GIL)
+MODEL_THREADS = None   # torch intra-op threads; None = torch default
+CLAHE = dict(clip_limit=2.0, tile_grid_size=(8, 8))  # Same as the ETL; None if frames are pre-processed
+RESULT_CACHE = None    # e.g. "inference_cache.sqlite": repeated frames skip CLAHE + model (see result_cache.py)
+# =================================================
+
+_STOP = object()
+
+
+class InferenceService:
+    """Queues frames from many callers and runs them through the model in dynamic batches."""
+
+    def __init__(self, weights=WEIGHTS, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS,
+                 preprocess_workers=PREPROCESS_WORKERS, clahe=CLAHE, imgsz=IMGSZ, conf=CONF, device="cpu",
+                 cache=None):
+        self.model = weights if isinstance(weights, YOLO) else YOLO(weights)
+        self.names = self.model.names
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.clahe = build_clahe(clahe)
+        self.imgsz = imgsz
+        self.conf = conf
+        self.device = device
+        self.stats = LatencyStats()
+        # With a cache, frames go through CachedDetector (raw outputs stored, NMS per request)
+        self.detector = CachedDetector(self.model, cache, imgsz, self.clahe, device) if cache is not None else None
+
+        self._queue = queue.Queue()
+        self._preprocess = ThreadPoolExecutor(preprocess_workers, thread_name_prefix="preprocess")
+        self._thread = None
+
+    # --- lifecycle ---
+    def start(self, warmup=True):
+        if MODEL_THREADS:
+            torch.set_num_threads(MODEL_THREADS)
+        if warmup:
+            blank = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+            self._run([blank] * self.max_batch)
+        self._thread = threading.Thread(target=self._batch_loop, name="model", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._preprocess.shutdown(wait=True)
+        self._queue.put(_STOP)
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- request path ---
+    def submit(self, image):
+        """Encoded bytes or a BGR array -> Future of a list of detection dicts."""
+        future = Future()
+        self._preprocess.submit(self._prepare, image, time.perf_counter(), future)
+        return future
+
+    def predict(self, image, timeout=None):
+        return self.submit(image).result(timeout)
+
+    def _prepare(self, image, t0, future):
+        key = None
+        try:
+            if self.detector is not None:
+                key = self.detector.key(image)
+                hit = self.detector.cache.get(key)
+                if hit is not None:
+                    future.set_result(self._format(*self.detector.postprocess(*hit, conf=self.conf)))
+                    self.stats.record(time.perf_counter() - t0)
+                    return
+            if isinstance(image, (bytes, bytearray, memoryview)):
+                image = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if image is None:
+                    raise ValueError("could not decode image")
+            if self.clahe is not None:
+                image = self.clahe.apply(image)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        self._queue.put((image, t0, time.perf_counter(), future, key))
+
+    # --- model thread ---
+    def _batch_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = item[2] + self.max_wait  # Oldest frame's queueing budget
+            stop = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                outputs = self._run([b[0] for b in batch], [b[4] for b in batch])
+            except Exception as e:
+                for b in batch:
+                    b[3].set_exception(e)
+            else:
+                done = time.perf_counter()
+                self.stats.record_batch(len(batch))
+                for (_, t0, _, future, _), out in zip(batch, outputs):
+                    self.stats.record(done - t0)
+                    future.set_result(out)
+            if stop:
+                return
+
+    def _run(self, images, keys=None):
+        if self.detector is not None:
+            outputs = []
+            for (raw, meta), key in zip(self.detector.forward(images), keys or [None] * len(images)):
+                if key is not None:
+                    self.detector.cache.put(key, raw, meta)
+                outputs.append(self._format(*self.detector.postprocess(raw, meta, conf=self.conf)))
+            return outputs
+        outputs = [None] * len(images)
+        for group in shape_groups(images):  # Same (rect) letterbox as the cached path
+            results = self.model.predict([images[i] for i in group], imgsz=self.imgsz, conf=self.conf,
+                                         device=self.device, verbose=False)
+            for i, r in zip(group, results):
+                outputs[i] = self._format(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(),
+                                          r.boxes.cls.cpu().numpy())
+        return outputs
+
+    def _format(self, boxes, scores, classes):
+        return [{"box": [round(float(v), 1) for v in box], "conf": round(float(s), 4),
+                 "class": int(c), "name": self.names[int(c)]}
+                for box, s, c in zip(boxes, scores, classes)]
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path != "/predict":
+                return self._reply(404, {"error": "unknown endpoint"})
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                self._reply(200, {"detections": service.predict(data)})
+            except ValueError as e:
+                self._reply(400, {"error": str(e)})
+            except Exception as e:  # Model / CUDA errors: still answer, don't drop the connection
+                self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                return self._reply(404, {"error": "unknown endpoint"})
+            metrics = service.stats.summary()
+            if service.detector is not None:
+                metrics["cache"] = service.detector.cache.stats()
+            self._reply(200, metrics)
+
+        def log_message(self, *args):
+            pass  # One line per request would drown the metrics printout
+
+    return Handler
+
+
+def main():
+    cache = ResultCache(RESULT_CACHE) if RESULT_CACHE else None
+    service = InferenceService(WEIGHTS, MAX_BATCH, MAX_WAIT_MS, PREPROCESS_WORKERS, CLAHE, IMGSZ, CONF,
+                               cache=cache).start()
+    server = ThreadingHTTPServer((HOST, PORT), make_handler(service))
+    print(f"🚀 Hemo-Flash server on http://{HOST}:{PORT} "
+          f"(batch <= {MAX_BATCH}, wait <= {MAX_WAIT_MS} ms, {PREPROCESS_WORKERS} preprocess workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        print(f"📊 {format_summary(service.stats.summary())}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+# ==========================================
+# LATENCY / THROUGHPUT STATS
+# ==========================================
+# Small thread-safe recorder shared by the serving and benchmark scripts:
+# per-request latencies (sliding window) -> p50/p99, and completions over
+# time -> images/s.
+
+
+class LatencyStats:
+    def __init__(self, window=10000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._done_at = deque(maxlen=window)
+        self.batch_sizes = Counter()
+        self.count = 0
+
+    def record(self, latency_s):
+        with self._lock:
+            self._latencies.append(latency_s)
+            self._done_at.append(time.perf_counter())
+            self.count += 1
+
+    def record_batch(self, size):
+        with self._lock:
+            self.batch_sizes[size] += 1
+
+    def reset(self):
+        with self._lock:
+            self._latencies.clear()
+            self._done_at.clear()
+            self.batch_sizes.clear()
+            self.count = 0
+
+    def summary(self):
+        with self._lock:
+            lat = np.asarray(self._latencies, dtype=np.float64) * 1000
+            done = list(self._done_at)
+            batches = dict(self.batch_sizes)
+            count = self.count
+        span = done[-1] - done[0] if len(done) > 1 else 0.0
+        n_batches = sum(batches.values())
+        return {
+            "requests": count,
+            "p50_ms": float(np.percentile(lat, 50)) if len(lat) else 0.0,
+            "p99_ms": float(np.percentile(lat, 99)) if len(lat) else 0.0,
+            "mean_ms": float(lat.mean()) if len(lat) else 0.0,
+            # n completions span n - 1 intervals
+            "images_per_s": (len(done) - 1) / span if span > 0 else 0.0,
+            "mean_batch": sum(k * v for k, v in batches.items()) / n_batches if n_batches else 0.0,
+        }
+
+
+def format_summary(summary):
+    return (f"p50 {summary['p50_ms']:7.1f} ms | p99 {summary['p99_ms']:7.1f} ms | "
+            f"{summary['images_per_s']:7.1f} img/s | mean batch {summary['mean_batch']:4.1f}")
@@ -0,0 +1,225 @@
+import copy
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+from ultralytics.data.augment import LetterBox
+from ultralytics.utils import nms, ops
+
+# Shared preprocessing lives next to the ETL in Datasets/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Datasets"))
+from clahe_engine import build_clahe  # noqa: E402
+
+# ==========================================
+# CONTENT-HASH INFERENCE RESULT CACHE
+# ==========================================
+# Re-reads, QA review and re-runs after a threshold change keep sending the
+# same field of view. The cache stores the model's raw pre-NMS output under
+#
+#   sha256(image bytes) + sha256(checkpoint) + preprocessing params
+#
+# so a repeat costs a hash and an sqlite lookup instead of CLAHE + a forward
+# pass, and a new conf/iou threshold only re-runs NMS on the cached output.
+# Frames are letterboxed like predict() does for a .pt model (rect: padded
+# only up to a stride multiple), so cached and uncached results match.
+#
+#   detector = CachedDetector("best.pt", ResultCache("inference_cache.sqlite"))
+#   boxes, scores, classes = detector.predict(open("field.jpg", "rb").read(), conf=0.3)
+
+# ================= CONFIGURATION =================
+CACHE_PATH = "inference_cache.sqlite"
+CACHE_MAX_BYTES = 2 * 1024 ** 3  # Least recently used entries go first
+CACHE_DTYPE = "float32"          # "float16" halves the size (boxes then round to ~0.5 px)
+# =================================================
+
+_CHECKPOINT_HASHES = {}
+
+
+def checkpoint_digest(path):
+    """sha256 of a checkpoint file (memoized per path + size + mtime)."""
+    st = os.stat(path)
+    memo = (str(Path(path).resolve()), st.st_size, st.st_mtime_ns)
+    digest = _CHECKPOINT_HASHES.get(memo)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = _CHECKPOINT_HASHES[memo] = h.hexdigest()
+    return digest
+
+
+def shape_groups(images):
+    """Indices of the images grouped by shape, in first-seen order.
+
+    predict() only uses the rect letterbox when every frame of a batch has the
+    same shape, so mixed batches are run one group at a time.
+    """
+    groups = {}
+    for i, im in enumerate(images):
+        groups.setdefault(im.shape, []).append(i)
+    return list(groups.values())
+
+
+def image_digest(image):
+    """sha256 of encoded bytes, or of a decoded array's pixels + shape."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(image).hexdigest()
+    image = np.ascontiguousarray(image)
+    h = hashlib.sha256(f"{image.shape}|{image.dtype}|".encode())
+    h.update(image.data)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """sqlite-backed, size-bounded LRU store of raw model outputs. Thread-safe."""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = str(path)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY, meta TEXT NOT NULL, data BLOB NOT NULL,
+            nbytes INTEGER NOT NULL, last_used REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used)")
+        self._db.commit()
+        self.nbytes = self._db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        """(raw array, meta dict) or None."""
+        with self._lock:
+            row = self._db.execute("SELECT meta, data FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return np.load(io.BytesIO(row[1])), json.loads(row[0])
+
+    def put(self, key, raw, meta):
+        buf = io.BytesIO()
+        np.save(buf, raw.astype(CACHE_DTYPE, copy=False))
+        data = buf.getvalue()
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._db.execute("SELECT nbytes FROM entries WHERE key = ?", (key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                             (key, json.dumps(meta), data, len(data), time.time()))
+            self.nbytes += len(data) - (old[0] if old else 0)
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        if self.nbytes <= self.max_bytes:
+            return
+        for key, nbytes in self._db.execute("SELECT key, nbytes FROM entries ORDER BY last_used").fetchall():
+            if self.nbytes <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+            self._db.commit()
+            self.nbytes = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "MB": self.nbytes / 1e6,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CachedDetector:
+    """YOLO detection whose expensive half (CLAHE + forward pass) goes through a ResultCache."""
+
+    def __init__(self, weights, cache=None, imgsz=640, clahe=None, device="cpu"):
+        self.yolo = weights if isinstance(weights, YOLO) else YOLO(weights)
+        # fuse() works in place, and the YOLO may be shared (InferenceService): fuse a copy
+        self.net = copy.deepcopy(self.yolo.model).fuse(verbose=False).to(device).eval()
+        self.names = self.yolo.names
+        self.cache = cache
+        self.imgsz = imgsz
+        self.clahe = build_clahe(clahe)
+        self.device = device
+        self.letterbox = LetterBox((imgsz, imgsz), auto=True, stride=int(self.net.stride.max()))  # As predict()
+        params = {"imgsz": imgsz, "clahe": self.clahe.params if self.clahe else None, "letterbox": "rect"}
+        checkpoint = self.yolo.ckpt_path if isinstance(weights, YOLO) else weights
+        self._prefix = f"{checkpoint_digest(checkpoint)}|{json.dumps(params, sort_keys=True)}|"
+
+    def key(self, image):
+        return hashlib.sha256((self._prefix + image_digest(image)).encode()).hexdigest()
+
+    def preprocess(self, image):
+        """Encoded bytes / BGR array -> CLAHE'd BGR array."""
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            image = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError("could not decode image")
+        return self.clahe.apply(image) if self.clahe is not None else image
+
+    @torch.no_grad()
+    def forward(self, images):
+        """Preprocessed BGR frames -> [(raw (4 + nc, anchors) array, meta)], one forward pass per frame shape."""
+        outputs = [None] * len(images)
+        for group in shape_groups(images):
+            boxed = [self.letterbox(image=images[i]) for i in group]
+            x = torch.from_numpy(np.stack(boxed)).to(self.device).permute(0, 3, 1, 2).flip(1).float().div_(255)
+            out = self.net(x)
+            out = out[0] if isinstance(out, (list, tuple)) else out
+            raw = out.float().cpu().numpy()
+            for j, i in enumerate(group):
+                outputs[i] = (raw[j], {"orig_shape": list(images[i].shape[:2]), "input_shape": list(boxed[j].shape[:2])})
+        return outputs
+
+    def raw(self, image):
+        """Cached raw output for one image (computed and stored on a miss)."""
+        key = self.key(image) if self.cache is not None else None
+        if key is not None:
+            hit = self.cache.get(key)
+            if hit is not None:
+                return hit
+        raw, meta = self.forward([self.preprocess(image)])[0]
+        if key is not None:
+            self.cache.put(key, raw, meta)
+        return raw, meta
+
+    def postprocess(self, raw, meta, conf=0.25, iou=0.7, max_det=300):
+        """NMS on a raw output -> (boxes xyxy in original pixels, scores, classes)."""
+        det = nms.non_max_suppression(torch.from_numpy(raw.astype(np.float32))[None], conf, iou, max_det=max_det,
+                                      end2end=getattr(self.net, "end2end", False))[0]
+        boxes = ops.scale_boxes(tuple(meta["input_shape"]), det[:, :4].clone(), tuple(meta["orig_shape"]))
+        return boxes.numpy(), det[:, 4].numpy(), det[:, 5].numpy().astype(np.int64)
+
+    def predict(self, image, conf=0.25, iou=0.7, max_det=300):
+        return self.postprocess(*self.raw(image), conf=conf, iou=iou, max_det=max_det)
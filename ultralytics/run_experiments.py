@@ -0,0 +1,380 @@
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from copy import deepcopy
+from datetime import datetime
+from pathlib import Path
+
+import yaml
+
+# ==========================================
+# CONFIG-DRIVEN EXPERIMENT RUNNER
+# ==========================================
+# Replaces launching the train_*.py scripts one by one. Experiments come from
+# EXPERIMENTS_FILE (model, data, hyperparameters, phase chaining). Each one
+# trains in its own child process. The queue starts a run as soon as:
+#   - the run it chains from (init_from) has finished successfully, and
+#   - its cpus / ram_gb / gpus fit in what is still free on the node.
+# A node can therefore hold several small runs at once.
+#
+# Each child gets its GPUs through CUDA_VISIBLE_DEVICES and trains on all of
+# them (DDP when there are several). Its dataloader workers and torch threads
+# are capped at its cpus, so packed runs don't oversubscribe the CPU. Wall time, CPU time and peak RSS come from os.wait4
+# and go to <project>/experiments_log.csv. Each run's output goes to
+# <project>/logs/<name>.log. The queue refuses to start if a run dir it would
+# train into already holds weights, so old runs are never overwritten.
+#
+#   python run_experiments.py                   # everything
+#   python run_experiments.py phase2_pt2 pt3    # experiments whose name contains any of these
+#   python run_experiments.py --dry-run         # print the plan only
+
+# ================= CONFIGURATION =================
+EXPERIMENTS_FILE = Path(__file__).with_name("experiments.yaml")
+POLL_S = 5              # Re-check interval when only outside RAM use blocks the queue
+RAM_HEADROOM_GB = 2     # Always left free on the node
+# =================================================
+
+
+def merge(base, override):
+    out = deepcopy(base)
+    for k, v in (override or {}).items():
+        out[k] = merge(out[k], v) if isinstance(v, dict) and isinstance(out.get(k), dict) else v
+    return out
+
+
+def load_experiments(path=None):
+    path = path or EXPERIMENTS_FILE
+    with open(path) as f:
+        cfg = yaml.safe_load(f)
+    dataset_path = Path(cfg["dataset_path"])
+    project = dataset_path / cfg.get("project", "runs/train")
+    experiments = {}
+    for exp in cfg["experiments"]:
+        exp = merge(cfg.get("defaults", {}), exp)
+        if exp["name"] in experiments:
+            raise ValueError(f"❌ Duplicate experiment name: {exp['name']}")
+        exp["data"] = str(dataset_path / exp["data"])
+        # Model yamls next to the experiments file win over ultralytics' built-in names
+        local = Path(path).parent / exp["model"]
+        exp["model"] = str(local) if local.exists() else exp["model"]
+        exp["project"] = str(project)
+        bank = (exp.get("trainer") or {}).get("crop_bank")
+        if bank:
+            bank["path"] = str(dataset_path / bank["path"])  # An absolute path stays as is
+        experiments[exp["name"]] = exp
+    for exp in experiments.values():
+        parent = exp.get("init_from")
+        if parent and parent not in experiments:
+            raise ValueError(f"❌ {exp['name']}: init_from '{parent}' is not a defined experiment")
+    return cfg.get("node") or {}, experiments
+
+
+def detect_node(node):
+    """cpus / ram_gb / gpu ids this queue may hand out."""
+    cpus = node.get("cpus") or os.cpu_count() or 1
+    ram_gb = node.get("ram_gb")
+    if ram_gb is None:
+        ram_gb = mem_available_gb() - RAM_HEADROOM_GB
+    gpus = node.get("gpus")
+    if gpus is None:
+        try:
+            import torch
+            gpus = torch.cuda.device_count()
+        except Exception:
+            gpus = 0
+    gpu_ids = list(range(gpus)) if isinstance(gpus, int) else list(gpus)
+    return {"cpus": cpus, "ram_gb": ram_gb, "gpus": gpu_ids}
+
+
+def mem_available_gb():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) / 1024 ** 2
+    return float("inf")
+
+
+# --- child side ---
+def stop_at(epochs):
+    """Callback that ends training after `epochs` but keeps it resumable.
+
+    The LR schedule still runs to the full `epochs` of the run. final_eval()
+    strips the optimizer from last.pt, so a copy is kept as resume.pt first.
+    """
+    def on_fit_epoch_end(trainer):
+        if trainer.stop or trainer.epoch + 1 < epochs:
+            return  # Also skips final_eval()'s extra call
+        shutil.copy(trainer.last, trainer.wdir / "resume.pt")
+        trainer.stop = True
+    return on_fit_epoch_end
+
+
+def validate_best(trainer):
+    """final_eval() for a DDP run: it trained in a subprocess, so this trainer never validated.
+
+    best.pt goes through the trainer's own val loader (online CLAHE included) on its first GPU.
+    """
+    trainer.test_loader = trainer.get_dataloader(trainer.data["val"], max(trainer.batch_size, 1) * 2, rank=-1,
+                                                 mode="val")
+    trainer.validator = trainer.get_validator()
+    trainer.validator.args.device = str(trainer.device)
+    trainer.validator(model=str(trainer.best))
+    with open(trainer.save_dir / "results.csv") as f:
+        return sum(1 for _ in csv.DictReader(f))  # One row per trained epoch
+
+
+def save_val_metrics(trainer):
+    """Overall and per-class mAP of the final validation, for whoever schedules the runs."""
+    epoch = validate_best(trainer) if trainer.validator is None else trainer.epoch + 1
+    m = trainer.validator.metrics
+    names = trainer.validator.names
+    metrics = {
+        "epoch": epoch,
+        "map50": float(m.box.map50),
+        "map50_95": float(m.box.map),
+        "per_class": {names[int(c)]: float(ap) for c, ap in zip(m.box.ap_class_index, m.box.all_ap.mean(1))},
+    }
+    with open(trainer.save_dir / "val_metrics.json", "w") as f:
+        json.dump(metrics, f, indent=2)
+
+
+def train_one(exp):
+    """Runs inside the child process: one model.train() call.
+
+    Besides the experiments.yaml fields, `stop_at` (epoch to pause at) and
+    `resume` (a resume.pt to continue from) are set by successive_halving.py.
+    """
+    from ultralytics import YOLO
+    from hemo_trainer import build_trainer
+
+    res = exp["resources"]
+    t = exp.get("trainer") or {}
+    trainer = build_trainer(clahe=t.get("online_clahe"), epoch_length=t.get("epoch_length", "weighted"),
+                            telemetry=t.get("telemetry", False), hard_examples=t.get("hard_examples"),
+                            crop_bank=t.get("crop_bank"), letterbox_cache=t.get("letterbox_cache", False))
+    # The child only sees its own GPUs (CUDA_VISIBLE_DEVICES), renumbered from 0; several -> DDP
+    gpus = res.get("gpus", 0)
+    device = list(range(gpus)) if gpus else "cpu"
+    workers = max(res.get("cpus", 8) // max(gpus, 1), 1)  # Per DDP rank
+
+    if exp.get("resume"):
+        # Everything else comes from the checkpoint's own train args
+        print(f"🔁  {exp['name']}: resuming from {exp['resume']}")
+        model = YOLO(exp["resume"])
+        if exp.get("stop_at"):
+            model.add_callback("on_fit_epoch_end", stop_at(exp["stop_at"]))
+        model.train(trainer=trainer, resume=exp["resume"], device=device, workers=workers)
+        save_val_metrics(model.trainer)
+        print(f"✅  {exp['name']} complete.")
+        return
+
+    pretrained = exp.get("pretrained")
+    if exp.get("init_from"):
+        pretrained = str(Path(exp["project"]) / exp["init_from"] / "weights" / "best.pt")
+    print(f"🚀  {exp['name']}: {exp['model']} on {exp['data']}")
+
+    model = YOLO(exp["model"])
+    if exp.get("stop_at"):
+        model.add_callback("on_fit_epoch_end", stop_at(exp["stop_at"]))
+    if pretrained:
+        try:
+            model.load(pretrained)
+            print(f"✅ Loaded compatible weights from {pretrained}")
+        except Exception as e:
+            if exp.get("init_from"):
+                raise  # A chained phase without its parent's weights is not the experiment
+            print(f"⚠️ Could not load pretrained weights: {e}")
+
+    model.train(
+        trainer=trainer,
+        data=exp["data"],
+        project=exp["project"],
+        name=exp["name"],
+        exist_ok=True,
+        device=device,
+        workers=workers,
+        **exp.get("train", {}),
+    )
+    save_val_metrics(model.trainer)
+    print(f"✅  {exp['name']} complete.")
+
+
+# --- queue ---
+class RunQueue:
+    def __init__(self, experiments, node):
+        self.experiments = experiments
+        self.node = node
+        self.free = {"cpus": node["cpus"], "ram_gb": node["ram_gb"]}
+        self.free_gpus = list(node["gpus"])
+        self.pending = list(experiments)
+        self.running = {}   # pid -> run record
+        self.status = {}    # name -> "ok" | "failed" | "skipped"
+        self.records = []
+
+    def fits(self, res):
+        return (res.get("cpus", 1) <= self.free["cpus"]
+                and res.get("ram_gb", 0) <= min(self.free["ram_gb"], mem_available_gb() - RAM_HEADROOM_GB)
+                and res.get("gpus", 0) <= len(self.free_gpus))
+
+    def check_feasible(self):
+        for name in self.pending:
+            res = self.experiments[name]["resources"]
+            if (res.get("cpus", 1) > self.node["cpus"] or res.get("ram_gb", 0) > self.node["ram_gb"]
+                    or res.get("gpus", 0) > len(self.node["gpus"])):
+                raise ValueError(f"❌ {name} asks for {res}, more than this node has "
+                                 f"({self.node['cpus']} cpus, {self.node['ram_gb']:.0f} GB, "
+                                 f"{len(self.node['gpus'])} gpus)")
+
+    def launch(self, name):
+        exp = self.experiments[name]
+        res = exp["resources"]
+        gpus = [self.free_gpus.pop(0) for _ in range(res.get("gpus", 0))]
+        self.free["cpus"] -= res.get("cpus", 1)
+        self.free["ram_gb"] -= res.get("ram_gb", 0)
+
+        env = dict(os.environ)
+        env["CUDA_VISIBLE_DEVICES"] = ",".join(map(str, gpus))
+        threads = str(res.get("cpus", 1))
+        env.update(OMP_NUM_THREADS=threads, MKL_NUM_THREADS=threads)
+        log_dir = Path(exp["project"]) / "logs"
+        log_dir.mkdir(parents=True, exist_ok=True)
+        log = open(log_dir / f"{name}.log", "w")
+        proc = subprocess.Popen([sys.executable, __file__, "--child", json.dumps(exp)], env=env,
+                                stdout=log, stderr=subprocess.STDOUT, cwd=Path(__file__).parent)
+        log.close()
+        self.running[proc.pid] = {"name": name, "gpus": gpus, "res": res, "start": time.time(), "proc": proc}
+        print(f"▶️  {name} (pid {proc.pid}, {res.get('cpus', 1)} cpus, {res.get('ram_gb', 0)} GB, "
+              f"gpus {gpus or 'none'})")
+
+    def reap(self, block):
+        """Collects one finished child via os.wait4; False if none finished."""
+        try:
+            pid, wait_status, usage = os.wait4(-1, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            return False
+        if pid == 0 or pid not in self.running:
+            return False
+        run = self.running.pop(pid)
+        run["proc"].returncode = os.waitstatus_to_exitcode(wait_status)  # Already reaped by wait4
+        code = run["proc"].returncode
+        res = run["res"]
+        self.free["cpus"] += res.get("cpus", 1)
+        self.free["ram_gb"] += res.get("ram_gb", 0)
+        self.free_gpus += run["gpus"]
+        end = time.time()
+        self.status[run["name"]] = "ok" if code == 0 else "failed"
+        self.records.append({
+            "name": run["name"],
+            "status": self.status[run["name"]],
+            "exit_code": code,
+            "start": datetime.fromtimestamp(run["start"]).isoformat(timespec="seconds"),
+            "end": datetime.fromtimestamp(end).isoformat(timespec="seconds"),
+            "wall_s": round(end - run["start"], 1),
+            # Child plus the dataloader workers it reaped
+            "cpu_user_s": round(usage.ru_utime, 1),
+            "cpu_sys_s": round(usage.ru_stime, 1),
+            "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),  # Largest single process
+            "cpus": res.get("cpus", 1),
+            "ram_gb": res.get("ram_gb", 0),
+            "gpus": ",".join(map(str, run["gpus"])),
+        })
+        icon = "✅" if code == 0 else "❌"
+        print(f"{icon} {run['name']} finished in {end - run['start']:.0f}s (exit {code}, "
+              f"peak RSS {usage.ru_maxrss / 1024:.0f} MB)")
+        return True
+
+    def ready(self):
+        """Pending runs whose parent succeeded; runs whose parent failed are skipped."""
+        out = []
+        for name in list(self.pending):
+            parent = self.experiments[name].get("init_from")
+            if parent in self.pending or any(r["name"] == parent for r in self.running.values()):
+                continue
+            if parent and self.status.get(parent) != "ok":
+                self.pending.remove(name)
+                self.status[name] = "skipped"
+                self.records.append({"name": name, "status": "skipped"})
+                print(f"⏭️  {name} skipped: {parent} did not succeed")
+                continue
+            out.append(name)
+        return out
+
+    def check_fresh(self):
+        """Refuses to retrain into a run dir that already holds weights (exist_ok would overwrite them)."""
+        taken = [name for name, exp in self.experiments.items()
+                 if not exp.get("resume") and any((Path(exp["project"]) / name / "weights").glob("*.pt"))]
+        if taken:
+            raise FileExistsError(f"❌ These runs already have weights in {self.experiments[taken[0]]['project']}: "
+                                  f"{', '.join(taken)}\n   Rename the experiments or move the old run dirs away.")
+
+    def run(self):
+        self.check_feasible()
+        self.check_fresh()
+        for exp in self.experiments.values():
+            # A chained run whose parent is not queued here needs the parent's weights on disk
+            parent = exp.get("init_from")
+            if parent and parent not in self.experiments:
+                self.status[parent] = "ok" if (Path(exp["project"]) / parent / "weights/best.pt").exists() else "failed"
+        while self.pending or self.running:
+            launched = False
+            for name in self.ready():
+                if self.fits(self.experiments[name]["resources"]):
+                    self.pending.remove(name)
+                    self.launch(name)
+                    launched = True
+            if self.reap(block=False) or launched:
+                continue
+            if self.running:
+                self.reap(block=True)  # Nothing fits until a run finishes
+            elif self.pending:
+                time.sleep(POLL_S)  # Waiting for RAM used outside the queue to free up
+        return self.records
+
+
+def write_log(records, project):
+    path = Path(project) / "experiments_log.csv"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fields = ["name", "status", "exit_code", "start", "end", "wall_s", "cpu_user_s", "cpu_sys_s",
+              "peak_rss_mb", "cpus", "ram_gb", "gpus"]
+    new = not path.exists()
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, restval="")
+        if new:
+            writer.writeheader()
+        writer.writerows(records)
+    return path
+
+
+def main(args):
+    dry_run = "--dry-run" in args
+    filters = [a for a in args if not a.startswith("--")]
+    node, experiments = load_experiments()
+    if filters:
+        experiments = {n: e for n, e in experiments.items() if any(f in n for f in filters)}
+    if not experiments:
+        print("❌ No experiments selected.")
+        return
+    node = detect_node(node)
+    print(f"🧪 {len(experiments)} experiments on a node with {node['cpus']} cpus, "
+          f"{node['ram_gb']:.0f} GB RAM, gpus {node['gpus'] or 'none'}")
+    for name, exp in experiments.items():
+        chain = f" <- {exp['init_from']}" if exp.get("init_from") else ""
+        print(f"   {name:<40} {exp['resources']}{chain}")
+    if dry_run:
+        return
+
+    queue = RunQueue(experiments, node)
+    records = queue.run()
+    path = write_log(records, next(iter(experiments.values()))["project"])
+    ok = sum(r["status"] == "ok" for r in records)
+    print(f"\n🏁 {ok}/{len(records)} experiments succeeded; log: {path}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        train_one(json.loads(sys.argv[2]))
+    else:
+        main(sys.argv[1:])
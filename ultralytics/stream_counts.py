@@ -0,0 +1,257 @@
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+# Shared preprocessing lives next to the ETL in Datasets/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Datasets"))
+from clahe_engine import build_clahe  # noqa: E402
+from hierarchy import HierarchyFuser
+from perf_stats import LatencyStats
+
+# ==========================================
+# REAL-TIME MICROSCOPE STREAM MODE
+# ==========================================
+# Camera / video feed -> rolling cell counts, as four concurrent stages
+# joined by bounded queues:
+#
+#   capture+decode --q--> CLAHE --q--> inference --q--> rolling counts
+#
+# When inference falls behind, the queue in front of it fills up and
+# DROP_POLICY decides what gives:
+#   "oldest": discard the stalest waiting frame (live view stays current)
+#   "newest": discard the incoming frame (keeps an even sampling of the past)
+#   "block":  never drop; capture waits (offline video where every frame counts)
+
+# ================= CONFIGURATION =================
+RUNS_DIR = Path(__file__).resolve().parents[1] / "Datasets/Final_Blood_YOLO_Hierarchical_Remastered_clahe/runs/train"
+WEIGHTS = RUNS_DIR / "hemo_flash_v11_9class_aug2" / "weights" / "best.pt"
+SOURCE = 0                 # Camera index, video file or stream URL
+PACE_TO_SOURCE_FPS = True  # For files: emit frames at the file's FPS, like a camera would
+IMGSZ = 640
+CONF = 0.25
+QUEUE_SIZE = 4             # Frames buffered between two stages
+DROP_POLICY = "oldest"
+INFER_BATCH = 4            # Frames already waiting are inferred together (never waits for more)
+COUNT_WINDOW = 30          # Rolling window (frames) for the live counts
+REPORT_EVERY_S = 2.0
+CLAHE = dict(clip_limit=2.0, tile_grid_size=(8, 8))
+# =================================================
+
+DROP_POLICIES = ("oldest", "newest", "block")
+_END = object()
+
+
+class DropQueue:
+    """Bounded queue with a frame-dropping policy on put()."""
+
+    def __init__(self, maxsize, policy="block"):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy '{policy}', expected one of {DROP_POLICIES}")
+        self.q = queue.Queue(maxsize)
+        self.policy = policy
+        self.dropped = 0
+
+    def put(self, item):
+        if self.policy == "block" or item is _END:
+            self.q.put(item)
+            return
+        while True:
+            try:
+                self.q.put_nowait(item)
+                return
+            except queue.Full:
+                if self.policy == "newest":
+                    self.dropped += 1
+                    return
+                try:
+                    self.q.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self):
+        return self.q.get()
+
+    def get_nowait(self):
+        return self.q.get_nowait()
+
+
+class StreamPipeline:
+    """Runs the four stages on their own threads; Frame dicts flow through the queues."""
+
+    def __init__(self, weights, source=SOURCE, drop_policy=DROP_POLICY, queue_size=QUEUE_SIZE,
+                 infer_batch=INFER_BATCH, count_window=COUNT_WINDOW, clahe=CLAHE, imgsz=IMGSZ, conf=CONF,
+                 pace=PACE_TO_SOURCE_FPS, device="cpu"):
+        self.model = weights if isinstance(weights, YOLO) else YOLO(weights)
+        self.names = self.model.names
+        self.fuser = HierarchyFuser(self.names)  # WBC_Base + subtype pairs count as one cell
+        self.source = source
+        self.clahe = build_clahe(clahe)
+        self.imgsz = imgsz
+        self.conf = conf
+        self.infer_batch = infer_batch
+        self.pace = pace
+        self.device = device
+
+        # Only the queue in front of inference drops; the others are tiny and fast
+        self.to_clahe = DropQueue(queue_size, "block")
+        self.to_infer = DropQueue(queue_size, drop_policy)
+        self.to_count = DropQueue(queue_size, "block")
+
+        self.stage_stats = {stage: LatencyStats() for stage in ("capture", "clahe", "inference", "count")}
+        self.end_to_end = LatencyStats()
+        self.window = deque(maxlen=count_window)
+        self.totals = np.zeros(len(self.names), dtype=np.int64)
+        self.frames_in = self.frames_out = 0
+        self.started = None
+        self._lock = threading.Lock()
+
+    # --- stages ---
+    def _capture(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            self.to_clahe.put(_END)
+            raise RuntimeError(f"❌ Could not open video source: {self.source}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        is_file = not isinstance(self.source, int)
+        interval = 1 / fps if self.pace and is_file and fps and fps > 0 else 0
+        next_at = time.perf_counter()
+        try:
+            while True:
+                t0 = time.perf_counter()
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                self.stage_stats["capture"].record(time.perf_counter() - t0)
+                self.frames_in += 1
+                self.to_clahe.put({"id": self.frames_in, "t0": t0, "image": frame})
+                if interval:
+                    next_at += interval
+                    time.sleep(max(0.0, next_at - time.perf_counter()))
+        finally:
+            cap.release()
+            self.to_clahe.put(_END)
+
+    def _clahe(self):
+        while (item := self.to_clahe.get()) is not _END:
+            t = time.perf_counter()
+            if self.clahe is not None:
+                item["image"] = self.clahe.apply(item["image"])
+            self.stage_stats["clahe"].record(time.perf_counter() - t)
+            self.to_infer.put(item)
+        self.to_infer.put(_END)
+
+    def _inference(self):
+        done = False
+        while not done:
+            item = self.to_infer.get()
+            if item is _END:
+                break
+            batch = [item]
+            while len(batch) < self.infer_batch:
+                try:
+                    item = self.to_infer.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _END:
+                    done = True
+                    break
+                batch.append(item)
+
+            t = time.perf_counter()
+            results = self.model.predict([b["image"] for b in batch], imgsz=self.imgsz, conf=self.conf,
+                                         device=self.device, verbose=False)
+            counts = self.fuser.counts(self.fuser.fuse_results(results), len(batch))
+            per_frame = (time.perf_counter() - t) / len(batch)
+            for b, c in zip(batch, counts):
+                self.stage_stats["inference"].record(per_frame)
+                b["counts"] = c
+                del b["image"]  # Counting only needs the per-class cell counts
+                self.to_count.put(b)
+        self.to_count.put(_END)
+
+    def _count(self):
+        while (item := self.to_count.get()) is not _END:
+            t = time.perf_counter()
+            counts = item["counts"]
+            with self._lock:
+                self.window.append(counts)
+                self.totals += counts
+                self.frames_out += 1
+            now = time.perf_counter()
+            self.stage_stats["count"].record(now - t)
+            self.end_to_end.record(now - item["t0"])
+
+    # --- driver ---
+    def run(self, on_report=None, report_every=REPORT_EVERY_S):
+        # Warm up first: the first forward pass is slow enough to flush a live queue
+        blank = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        self.model.predict([blank] * self.infer_batch, imgsz=self.imgsz, device=self.device, verbose=False)
+        self.started = time.perf_counter()
+        threads = [threading.Thread(target=fn, name=fn.__name__, daemon=True)
+                   for fn in (self._capture, self._clahe, self._inference, self._count)]
+        for t in threads: t.start()
+        while threads[-1].is_alive():
+            threads[-1].join(timeout=report_every)
+            if on_report is not None:
+                on_report(self)
+        for t in threads: t.join()
+        return self.report()
+
+    def rolling_counts(self):
+        """Mean cells per frame over the last COUNT_WINDOW frames."""
+        with self._lock:
+            if not self.window:
+                return {name: 0.0 for name in self.names.values()}
+            mean = np.mean(self.window, axis=0)
+        return {self.names[c]: float(v) for c, v in enumerate(mean)}
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "frames_in": self.frames_in,
+            "frames_out": self.frames_out,
+            "dropped": self.to_infer.dropped,
+            "fps": self.frames_out / elapsed if elapsed > 0 else 0.0,
+            "stage_ms": {s: st.summary()["p50_ms"] for s, st in self.stage_stats.items()},
+            "end_to_end_p50_ms": self.end_to_end.summary()["p50_ms"],
+            "end_to_end_p99_ms": self.end_to_end.summary()["p99_ms"],
+            "rolling_counts": self.rolling_counts(),
+            "totals": {self.names[c]: int(n) for c, n in enumerate(self.totals)},
+        }
+
+
+def print_report(pipeline):
+    r = pipeline.report()
+    stages = " | ".join(f"{s} {ms:.1f}" for s, ms in r["stage_ms"].items())
+    live = ", ".join(f"{name} {v:.1f}" for name, v in r["rolling_counts"].items() if v)
+    print(f"🎥 {r['fps']:5.1f} FPS | e2e p50 {r['end_to_end_p50_ms']:.0f} ms, p99 {r['end_to_end_p99_ms']:.0f} ms | "
+          f"dropped {r['dropped']} | stage p50 ms: {stages}")
+    print(f"   🩸 per frame: {live or '-'}")
+
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else SOURCE
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    pipeline = StreamPipeline(WEIGHTS, source=source)
+    print(f"🚀 Streaming {source} (drop policy: {DROP_POLICY}, queues of {QUEUE_SIZE})")
+    try:
+        final = pipeline.run(on_report=print_report)
+    except KeyboardInterrupt:
+        final = pipeline.report()
+    print(f"\n✅ {final['frames_out']}/{final['frames_in']} frames processed, {final['dropped']} dropped, "
+          f"{final['fps']:.1f} FPS sustained")
+    print("🩸 Total detections:")
+    for name, n in final["totals"].items():
+        print(f"   {name:<12} {n:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import csv
+import itertools
+import json
+import math
+from copy import deepcopy
+from pathlib import Path
+
+from run_experiments import RunQueue, detect_node, load_experiments
+
+# ==========================================
+# SUCCESSIVE-HALVING SWEEP CONTROLLER
+# ==========================================
+# The phase2 runs use patience=0 and always train all 100 epochs, including
+# the configs that are clearly behind by epoch 20. This script sweeps GRID
+# on top of BASE_EXPERIMENT (from experiments.yaml) with successive halving:
+#
+#   rung 0   every config trains to MIN_EPOCHS
+#   rung k   the best 1/ETA of the previous rung (by SCORE) continue to
+#            MIN_EPOCHS * ETA^k epochs; the last rung ends at MAX_EPOCHS
+#
+# Every config trains with epochs=MAX_EPOCHS, so the LR schedule is the one
+# of a full run. Each rung pauses the run (run_experiments.stop_at) and the
+# next rung resumes from its checkpoint with the optimizer and EMA state, so
+# a promoted config never re-trains epochs it already did. The winner ends up
+# identical to a plain MAX_EPOCHS run of the same config.
+#
+# SCORE is mAP50-95 per class, averaged with CLASS_WEIGHTS, so RBC_Sickle and
+# the rare WBC subtypes decide the promotions rather than RBC_Normal. Runs go
+# through the run_experiments queue, so several configs share a node when
+# their resources allow. Re-running the script skips rungs that a config has
+# already finished (its val_metrics.json epoch shows it).
+#
+# Output: <project>/<SWEEP_NAME>_sweep.csv, one row per (config, rung).
+
+# ================= CONFIGURATION =================
+BASE_EXPERIMENT = "hemo_flash_v11_9class_phase2_pt2_imb"
+SWEEP_NAME = "sh_phase2"
+GRID = {                      # model.train() args swept on top of the base experiment
+    "cls": [1.5, 2.5, 4.0],
+    "mixup": [0.2, 0.5],
+    "copy_paste": [0.3, 0.5],
+}
+MIN_EPOCHS = 10
+MAX_EPOCHS = 100
+ETA = 3                       # Keep the best 1/ETA at every rung
+CLASS_WEIGHTS = {             # Classes not listed weigh 1.0
+    "RBC_Sickle": 4.0,
+    "Eosinophil": 3.0,
+    "Basophil": 3.0,
+    "Monocyte": 2.0,
+}
+# =================================================
+
+
+def rungs():
+    """Epoch budget of every rung, ending at MAX_EPOCHS."""
+    budgets, epochs = [], MIN_EPOCHS
+    while epochs < MAX_EPOCHS:
+        budgets.append(epochs)
+        epochs *= ETA
+    return budgets + [MAX_EPOCHS]
+
+
+def score(per_class):
+    """CLASS_WEIGHTS-weighted mean of the per-class mAP50-95."""
+    if not per_class:
+        return 0.0
+    weights = {name: CLASS_WEIGHTS.get(name, 1.0) for name in per_class}
+    return sum(weights[n] * ap for n, ap in per_class.items()) / sum(weights.values())
+
+
+def configs(base):
+    """One experiment per GRID point, all with the full MAX_EPOCHS schedule."""
+    out = {}
+    keys = list(GRID)
+    for values in itertools.product(*GRID.values()):
+        exp = deepcopy(base)
+        exp["train"].update(dict(zip(keys, values)), epochs=MAX_EPOCHS, save=True)
+        exp["name"] = "_".join([SWEEP_NAME] + [f"{k}{v}" for k, v in zip(keys, values)])
+        out[exp["name"]] = exp
+    return out
+
+
+def read_metrics(exp):
+    path = Path(exp["project"]) / exp["name"] / "val_metrics.json"
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    node, experiments = load_experiments()
+    if BASE_EXPERIMENT not in experiments:
+        raise ValueError(f"❌ {BASE_EXPERIMENT} is not in the experiments file")
+    node = detect_node(node)
+    sweep = configs(experiments[BASE_EXPERIMENT])
+    budgets = rungs()
+    alive = list(sweep)
+    print(f"🪜 {len(sweep)} configs, rungs {budgets} epochs, keeping 1/{ETA} per rung")
+
+    rows, spent = [], 0
+    for i, budget in enumerate(budgets):
+        to_run = {}
+        for name in alive:
+            metrics = read_metrics(sweep[name])
+            if metrics and metrics["epoch"] >= budget:
+                continue  # Done in an earlier invocation
+            exp = dict(sweep[name])
+            exp["init_from"] = None if i else exp.get("init_from")
+            exp["resume"] = str(Path(exp["project"]) / name / "weights" / "resume.pt") if i else None
+            exp["stop_at"] = budget if budget < MAX_EPOCHS else None
+            to_run[name] = exp
+        print(f"\n🔥 Rung {i}: {len(alive)} configs to {budget} epochs ({len(alive) - len(to_run)} already there)")
+        if to_run:
+            RunQueue(to_run, node).run()
+        spent += len(alive) * (budget - (budgets[i - 1] if i else 0))
+
+        scored = []
+        for name in alive:
+            metrics = read_metrics(sweep[name])
+            if not metrics or metrics["epoch"] < budget:
+                print(f"❌ {name} did not reach epoch {budget}; dropped")
+                continue
+            s = score(metrics["per_class"])
+            scored.append((s, name))
+            rows.append({"config": name, "rung": i, "epochs": budget, "score": round(s, 4),
+                         "map50_95": round(metrics["map50_95"], 4),
+                         **{f"mAP_{k}": round(v, 4) for k, v in metrics["per_class"].items()}})
+        scored.sort(reverse=True)
+        for s, name in scored:
+            print(f"   {name:<48} score {s:.3f}")
+        if not scored:
+            raise RuntimeError(f"❌ No config finished rung {i}")
+        alive = [name for _, name in scored[:max(math.ceil(len(scored) / ETA), 1)]]
+        if i < len(budgets) - 1:
+            print(f"⬆️  Promoted: {', '.join(alive)}")
+
+    project = Path(next(iter(sweep.values()))["project"])
+    out = project / f"{SWEEP_NAME}_sweep.csv"
+    fields = list(dict.fromkeys(k for r in rows for k in r))
+    with open(out, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    full = len(sweep) * MAX_EPOCHS
+    print(f"\n🏆 Winner: {alive[0]} ({project / alive[0] / 'weights' / 'best.pt'})")
+    print(f"⏱️  {spent} epochs trained vs {full} for the full grid ({full / spent:.1f}x fewer)")
+    print(f"💾 Sweep log written to {out}")
+
+if __name__ == "__main__":
+    main()
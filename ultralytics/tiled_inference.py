@@ -0,0 +1,216 @@
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+# Shared preprocessing lives next to the ETL in Datasets/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Datasets"))
+from clahe_engine import build_clahe  # noqa: E402
+
+# ==========================================
+# TILED SLIDE INFERENCE
+# ==========================================
+# The models are trained at imgsz=640 on camera-field crops; a whole slide
+# capture is many times larger and shrinking it to 640 erases platelets and
+# sickle morphology. Instead the slide is cut into overlapping TILE x TILE
+# windows at native resolution, the windows go through the model in batches,
+# and the detections are shifted back into slide coordinates. Cells in the
+# strips two tiles share show up in both (or in four); a spatial grid hash
+# finds those duplicates without comparing every box against every other one.
+#
+#   detector = TiledDetector("best.pt", clahe=dict(clip_limit=2.0, tile_grid_size=(8, 8)))
+#   result = detector.detect(cv2.imread("slide.png"))
+#   result["counts"]  ->  {'RBC_Normal': 5231, 'Platelets': 402, ...}
+
+# ================= CONFIGURATION =================
+RUNS_DIR = Path(__file__).resolve().parents[1] / "Datasets/Final_Blood_YOLO_Hierarchical_Remastered_clahe/runs/train"
+WEIGHTS = RUNS_DIR / "hemo_flash_v11_9class_aug2" / "weights" / "best.pt"
+IMAGE = "slide.png"
+TILE = 640            # Training imgsz
+OVERLAP = 0.2         # Fraction of a tile shared with its neighbour (> largest cell)
+BATCH = 8             # Tiles per forward pass
+CONF = 0.25
+IOU = 0.5             # Per-tile NMS
+DEDUP_IOS = 0.6       # Cross-tile duplicate: intersection / smaller box area
+DEDUP_CELL_PCT = 95   # Dedupe grid cell = this percentile of the box sides
+# The training frames were CLAHE'd by the ETL, so slides need the same
+# treatment. It runs per tile, which keeps CLAHE's tile grid the same
+# physical size as on a training frame.
+CLAHE = dict(clip_limit=2.0, tile_grid_size=(8, 8))
+SAVE_ANNOTATED = None  # e.g. "slide_pred.jpg"
+# =================================================
+
+
+def tile_origins(length, tile, overlap):
+    """Start offsets along one axis; the last tile is pulled back to end at the border."""
+    if length <= tile:
+        return [0]
+    step = max(1, int(tile * (1 - overlap)))
+    origins = list(range(0, length - tile, step))
+    origins.append(length - tile)
+    return origins
+
+
+def dedupe_detections(boxes, scores, classes, tile_ids, seam, ios_thresh=DEDUP_IOS, cell_pct=DEDUP_CELL_PCT):
+    """Indices to keep after cross-tile duplicate removal (highest score wins).
+
+    Only boxes on a seam (reaching into another tile, see TiledDetector.seam_mask)
+    are candidates, and only against boxes from a different tile: overlapping
+    cells seen by the same tile were already sorted out by its NMS. Two such
+    same-class boxes are duplicates when their intersection covers `ios_thresh`
+    of the smaller one (a cell cut by a tile border is a partial box, so plain
+    IoU would miss it). Boxes go into every grid bucket they cover; the bucket
+    side is the `cell_pct` percentile of the box sides, so one huge box does
+    not put every box in the same bucket.
+    """
+    keep = np.ones(len(boxes), dtype=bool)
+    candidates = np.flatnonzero(seam)
+    if len(candidates) == 0:
+        return np.flatnonzero(keep)
+    wh = boxes[:, 2:] - boxes[:, :2]
+    cell = max(float(np.percentile(wh[candidates].max(axis=1), cell_pct)), 1.0)
+    lo = np.floor(boxes[:, :2] / cell).astype(np.int64)
+    hi = np.floor(boxes[:, 2:] / cell).astype(np.int64)
+    areas = wh.prod(axis=1)
+
+    grid = defaultdict(list)
+    for i in candidates[np.argsort(-scores[candidates], kind="stable")]:
+        c = int(classes[i])
+        keys = [(gx, gy, c) for gx in range(lo[i, 0], hi[i, 0] + 1) for gy in range(lo[i, 1], hi[i, 1] + 1)]
+        neighbours = list({j for key in keys for j in grid.get(key, ()) if tile_ids[j] != tile_ids[i]})
+        if neighbours:
+            nb = boxes[neighbours]
+            iw = np.minimum(nb[:, 2], boxes[i, 2]) - np.maximum(nb[:, 0], boxes[i, 0])
+            ih = np.minimum(nb[:, 3], boxes[i, 3]) - np.maximum(nb[:, 1], boxes[i, 1])
+            inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+            smaller = np.minimum(areas[neighbours], areas[i])
+            if (inter >= ios_thresh * np.maximum(smaller, 1e-9)).any():
+                keep[i] = False
+                continue
+        for key in keys:
+            grid[key].append(i)
+    return np.flatnonzero(keep)
+
+
+class TiledDetector:
+    """Runs a YOLO checkpoint over a large image tile by tile."""
+
+    def __init__(self, weights, tile=TILE, overlap=OVERLAP, batch=BATCH, conf=CONF, iou=IOU,
+                 dedup_ios=DEDUP_IOS, clahe=CLAHE, device="cpu"):
+        self.model = weights if isinstance(weights, YOLO) else YOLO(weights)
+        self.names = self.model.names
+        self.tile = tile
+        self.overlap = overlap
+        self.batch = batch
+        self.conf = conf
+        self.iou = iou
+        self.dedup_ios = dedup_ios
+        self.clahe = build_clahe(clahe)
+        self.device = device
+
+    def tiles(self, h, w):
+        """(x0, y0, x1, y1) of every tile, row by row."""
+        return [(x, y, min(x + self.tile, w), min(y + self.tile, h))
+                for y in tile_origins(h, self.tile, self.overlap)
+                for x in tile_origins(w, self.tile, self.overlap)]
+
+    def seam_mask(self, boxes, h, w):
+        """Boxes (image coordinates) that reach into more than one tile."""
+        seam = np.zeros(len(boxes), dtype=bool)
+        for lo, hi, length in ((boxes[:, 0], boxes[:, 2], w), (boxes[:, 1], boxes[:, 3], h)):
+            starts = np.asarray(tile_origins(length, self.tile, self.overlap))
+            ends = np.minimum(starts + self.tile, length)
+            seam |= ((lo[:, None] < ends[None]) & (hi[:, None] > starts[None])).sum(axis=1) > 1
+        return seam
+
+    def _predict(self, crops):
+        if self.clahe is not None:
+            crops = [self.clahe.apply(c) for c in crops]
+        results = self.model.predict(crops, imgsz=self.tile, conf=self.conf, iou=self.iou,
+                                     device=self.device, verbose=False)
+        return [(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy())
+                for r in results]
+
+    def detect(self, image):
+        """Detections for one BGR image in image coordinates.
+
+        Returns dict(boxes=(N, 4) xyxy, scores, classes, counts, tiles, seconds).
+        Only one batch of tile crops is alive at a time, so memory does not
+        grow with the slide beyond the image itself and its detections.
+        """
+        if isinstance(image, (str, Path)):
+            path, image = image, cv2.imread(str(image))
+            if image is None:
+                raise FileNotFoundError(f"❌ Could not read image: {path}")
+        start = time.perf_counter()
+        h, w = image.shape[:2]
+        tiles = self.tiles(h, w)
+
+        all_boxes, all_scores, all_classes, all_tiles = [], [], [], []
+        for b in range(0, len(tiles), self.batch):
+            batch_tiles = tiles[b:b + self.batch]
+            # Slices are views; CLAHE / letterbox make the only copies
+            crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in batch_tiles]
+            for t, ((x0, y0, _, _), (boxes, scores, classes)) in enumerate(zip(batch_tiles, self._predict(crops)), b):
+                all_boxes.append(boxes + np.array([x0, y0, x0, y0], dtype=boxes.dtype))
+                all_scores.append(scores)
+                all_classes.append(classes)
+                all_tiles.append(np.full(len(scores), t, dtype=np.int64))
+
+        boxes = np.concatenate(all_boxes).astype(np.float32) if all_boxes else np.zeros((0, 4), np.float32)
+        scores = np.concatenate(all_scores).astype(np.float32) if all_scores else np.zeros(0, np.float32)
+        classes = np.concatenate(all_classes).astype(np.int64) if all_classes else np.zeros(0, np.int64)
+        tile_ids = np.concatenate(all_tiles) if all_tiles else np.zeros(0, np.int64)
+        keep = dedupe_detections(boxes, scores, classes, tile_ids, self.seam_mask(boxes, h, w), self.dedup_ios)
+        boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+
+        per_class = np.bincount(classes, minlength=len(self.names))
+        return {
+            "boxes": boxes,
+            "scores": scores,
+            "classes": classes,
+            "counts": {self.names[c]: int(n) for c, n in enumerate(per_class)},
+            "tiles": len(tiles),
+            "duplicates": len(np.concatenate(all_scores)) - len(keep) if all_scores else 0,
+            "seconds": time.perf_counter() - start,
+        }
+
+
+def draw_detections(image, result, names):
+    out = image.copy()
+    for (x0, y0, x1, y1), c in zip(result["boxes"].astype(int), result["classes"]):
+        color = tuple(int(v) for v in np.random.default_rng(int(c)).integers(64, 255, 3))
+        cv2.rectangle(out, (x0, y0), (x1, y1), color, 2)
+        cv2.putText(out, names[int(c)], (x0, max(y0 - 4, 0)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    return out
+
+
+def main():
+    image_path = sys.argv[1] if len(sys.argv) > 1 else IMAGE
+    weights = sys.argv[2] if len(sys.argv) > 2 else WEIGHTS
+    image = cv2.imread(image_path)
+    if image is None:
+        raise FileNotFoundError(f"❌ Could not read image: {image_path}")
+
+    detector = TiledDetector(weights)
+    h, w = image.shape[:2]
+    print(f"🔬 {image_path}: {w}x{h} -> {len(detector.tiles(h, w))} tiles of {TILE}px ({OVERLAP:.0%} overlap)")
+    result = detector.detect(image)
+
+    mpix = h * w / 1e6
+    print(f"⏱️  {result['seconds']:.2f}s, {mpix / result['seconds']:.2f} MP/s, "
+          f"{result['tiles'] / result['seconds']:.1f} tiles/s ({result['duplicates']} cross-tile duplicates removed)")
+    print("🩸 Cell counts:")
+    for name, n in result["counts"].items():
+        print(f"   {name:<12} {n:>7}")
+
+    if SAVE_ANNOTATED:
+        cv2.imwrite(SAVE_ANNOTATED, draw_detections(image, result, detector.names))
+        print(f"🖼️  Annotated slide saved to {SAVE_ANNOTATED}")
+
+if __name__ == "__main__":
+    main()
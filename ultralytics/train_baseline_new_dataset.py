@@ -1,6 +1,8 @@
 import os
 from ultralytics import YOLO
 
+from hemo_trainer import build_trainer
+
 # ==========================================
 # 1. SETUP PATHS & CONFIG
 # ==========================================
@@ -8,6 +10,18 @@ from ultralytics import YOLO
 dataset_path = "/dist_home/suryansh/sharukesh/analog/Datasets/Final_Blood_YOLO_Hierarchical_Remastered_clahe"
 data_yaml = os.path.join(dataset_path, "data.yaml")
 
+# Online CLAHE (None = images as stored): see the header of hemo_trainer.py.
+ONLINE_CLAHE = None
+
+# Per-epoch timing telemetry (dataloader wait, decode / augmentation cost,
+# forward / backward, images/s) -> telemetry.csv + telemetry.png in the run dir.
+TELEMETRY = False
+
+# Read train frames from the ETL's pre-resized letterbox cache
+# (merge_remap_and_clahe.py LETTERBOX_IMGSZ = imgsz); falls back to decoding if it is missing.
+# Off until the ETL has been re-run to write the current cache layout.
+LETTERBOX_CACHE = False
+
 print(f"🚀  Initializing Base Model Training...")
 print(f"📂  Target Dataset: {data_yaml}")
 
@@ -24,6 +38,8 @@ model = YOLO("yolo11n.pt")
 print("🔥  Starting training...")
 
 results = model.train(
+    trainer=build_trainer(clahe=ONLINE_CLAHE, telemetry=TELEMETRY,
+                          letterbox_cache=LETTERBOX_CACHE),
     data=data_yaml,
     epochs=100,             # Keeping consistency with your request
     imgsz=640,
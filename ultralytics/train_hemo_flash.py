@@ -1,6 +1,8 @@
 import os
 from ultralytics import YOLO
 
+from hemo_trainer import build_trainer
+
 # ==========================================
 # 1. SETUP PATHS
 # ==========================================
@@ -11,6 +13,18 @@ data_yaml = os.path.join(dataset_path, "data.yaml")
 # Path to your custom architecture YAML file
 custom_model_yaml = "ultralytics/cfg/models/11/hemo-flash.yaml"
 
+# Online CLAHE (None = images as stored): see the header of hemo_trainer.py.
+ONLINE_CLAHE = None
+
+# Per-epoch timing telemetry (dataloader wait, decode / augmentation cost,
+# forward / backward, images/s) -> telemetry.csv + telemetry.png in the run dir.
+TELEMETRY = False
+
+# Read train frames from the ETL's pre-resized letterbox cache
+# (merge_remap_and_clahe.py LETTERBOX_IMGSZ = imgsz); falls back to decoding if it is missing.
+# Off until the ETL has been re-run to write the current cache layout.
+LETTERBOX_CACHE = False
+
 print(f"🚀  Initializing Hemo-Flash-v11 Training...")
 print(f"📂  Target Dataset: {data_yaml}")
 print(f"🏗️  Model Architecture: {custom_model_yaml}")
@@ -40,6 +54,8 @@ except Exception as e:
 print("🔥  Starting training with Heavy Geometric Augmentations...")
 
 results = model.train(
+    trainer=build_trainer(clahe=ONLINE_CLAHE, telemetry=TELEMETRY,
+                          letterbox_cache=LETTERBOX_CACHE),
     data=data_yaml,
     epochs=100,
     imgsz=640,
@@ -1,6 +1,8 @@
 import os
 from ultralytics import YOLO
 
+from hemo_trainer import build_trainer
+
 # ==========================================
 # 1. SETUP PATHS
 # ==========================================
@@ -8,6 +10,24 @@ dataset_path = "/dist_home/suryansh/sharukesh/analog/Datasets/Final_Blood_YOLO_H
 data_yaml = os.path.join(dataset_path, "data_balenced.yaml")
 custom_model_yaml = "ultralytics/cfg/models/11/hemo-flash.yaml"
 
+# Online CLAHE (None = images as stored): see the header of hemo_trainer.py.
+ONLINE_CLAHE = None
+
+# Per-epoch timing telemetry (dataloader wait, decode / augmentation cost,
+# forward / backward, images/s) -> telemetry.csv + telemetry.png in the run dir.
+TELEMETRY = False
+
+# Read train frames from the ETL's pre-resized letterbox cache
+# (merge_remap_and_clahe.py LETTERBOX_IMGSZ = imgsz); falls back to decoding if it is missing.
+# Off until the ETL has been re-run to write the current cache layout.
+LETTERBOX_CACHE = False
+
+# Weighted sampling: the data yaml's `sample_weights` (make_balenced_txt.py,
+# MANIFEST_MODE = "weighted") sets how often each image is drawn. Draws per
+# epoch: "weighted" = as many as the old duplicated manifest had lines,
+# None = one per image (a much shorter epoch), or an int.
+EPOCH_LENGTH = "weighted"
+
 print(f"🚀  Initializing Hemo-Flash-v11 Training...")
 
 # ==========================================
@@ -25,6 +45,8 @@ except Exception as e:
 print("🔥  Starting training with Valid Phase2 Imbalance Fixes...")
 
 results = model.train(
+    trainer=build_trainer(clahe=ONLINE_CLAHE, epoch_length=EPOCH_LENGTH, telemetry=TELEMETRY,
+                          letterbox_cache=LETTERBOX_CACHE),
     data=data_yaml,
     epochs=100,
     imgsz=640,
@@ -0,0 +1,249 @@
+import csv
+import time
+from collections import defaultdict
+
+import torch
+from ultralytics.utils import LOGGER, RANK
+
+# ==========================================
+# PER-EPOCH TRAINING TELEMETRY
+# ==========================================
+# results.csv only has a cumulative `time` column. With
+# build_trainer(telemetry=True) every epoch also gets a row in
+# <run>/telemetry.csv, and <run>/telemetry.png is drawn at the end:
+#
+#   main process  images/s, dataloader wait (time blocked on the next batch),
+#                 forward (+loss), backward + optimizer step, validation
+#   workers       per-image decode, CLAHE and each augmentation op (Mosaic,
+#                 CopyPaste, RandomPerspective, MixUp, ...), in ms of CPU time
+#
+# Op times are exclusive: Mosaic's time does not include decoding its three
+# extra frames (that goes to decode), and MixUp's does not include the
+# mosaic it builds for its second image. worker_capacity_img_s is what the
+# dataloader workers could deliver flat out (workers x 1000 / worker ms per
+# image). If it is close to images/s and dataloader_wait_pct is high, the
+# augmentation CPU is the bottleneck; if the workers have headroom but the
+# wait is still high, look at disk I/O; if the wait is low, it's the GPU.
+#
+# forward_s is timed around the trainer's own model(batch) call, which also
+# computes the loss (with compile=True the loss runs after it and lands in
+# backward_optim_s). On CUDA that costs two synchronizes per batch, so
+# telemetry is off unless a launcher asks for it.
+
+
+class SampleTimer:
+    """Exclusive per-op timings for one sample, collected in a dataloader worker."""
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self._stack = []
+
+    def start(self):
+        self.times = defaultdict(float)
+        self._stack = []
+
+    def measure(self, name, fn, *args):
+        self._stack.append(0.0)
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            total = time.perf_counter() - t0
+            nested = self._stack.pop()
+            self.times[name] += total - nested
+            if self._stack:
+                self._stack[-1] += total
+
+    def finish(self):
+        return dict(self.times)
+
+
+class TimedTransform:
+    """Wraps one augmentation op so its time lands in a SampleTimer."""
+
+    def __init__(self, op, timer):
+        self.op = op
+        self.name = type(op).__name__
+        self.timer = timer
+
+    def __call__(self, labels):
+        return self.timer.measure(self.name, self.op, labels)
+
+    def __getattr__(self, name):
+        if name == "op":  # Not set yet (unpickling)
+            raise AttributeError(name)
+        return getattr(self.op, name)
+
+
+def wrap_transforms(compose, timer):
+    """Wraps every leaf op of a (nested) Compose in place."""
+    for i, op in enumerate(compose.transforms):
+        if isinstance(op, TimedTransform):
+            continue
+        if hasattr(op, "transforms") and isinstance(op.transforms, list):
+            wrap_transforms(op, timer)
+        else:
+            compose.transforms[i] = TimedTransform(op, timer)
+    return compose
+
+
+class TrainTelemetry:
+    """Trainer callbacks that time each epoch and write telemetry.csv / .png."""
+
+    def __init__(self, trainer):
+        self.trainer = trainer
+        self.rows = []
+        self.train_end = None
+        self._forward_t0 = None
+        self._hook = None
+        self._reset()
+        for event in ("on_train_start", "on_train_epoch_start", "on_train_batch_start", "on_train_batch_end",
+                      "on_train_epoch_end", "on_fit_epoch_end", "on_train_end"):
+            trainer.add_callback(event, getattr(self, event))
+
+    def _reset(self):
+        self.images = self.batches = 0
+        self.wait = self.step = self.forward = 0.0
+        self.sample_ops = defaultdict(float)
+        self.samples = 0
+        self._mark = None
+
+    def _sync(self):
+        if self.trainer.device.type == "cuda":
+            torch.cuda.synchronize(self.trainer.device)
+
+    def add_samples(self, timings):
+        """Per-sample worker timings of one batch (popped from the batch by the trainer)."""
+        for timing in timings:
+            for op, seconds in timing.items():
+                self.sample_ops[op] += seconds
+        self.samples += len(timings)
+        self.images += len(timings)
+
+    # --- forward timing ---
+    def forward_start(self):
+        """Called by the trainer's preprocess_batch(), right before it calls the model on the batch."""
+        self._forward_t0 = time.perf_counter()  # on_train_batch_end already synced
+
+    def _forward_end(self, module, args, output):
+        # Hooked on trainer.model itself (DDP / compiled wrapper included), so
+        # it fires once per batch, when the trainer's call returns
+        if self._forward_t0 is not None:
+            self._sync()
+            self.forward += time.perf_counter() - self._forward_t0
+            self._forward_t0 = None
+
+    # --- callbacks ---
+    def on_train_start(self, trainer):
+        self._hook = trainer.model.register_forward_hook(self._forward_end)
+
+    def on_train_epoch_start(self, trainer):
+        self._reset()
+        self.epoch_start = self._mark = time.perf_counter()
+
+    def on_train_batch_start(self, trainer):
+        now = time.perf_counter()
+        self.wait += now - self._mark
+        self._mark = now
+
+    def on_train_batch_end(self, trainer):
+        self._sync()
+        now = time.perf_counter()
+        self.step += now - self._mark
+        self._mark = now
+        self.batches += 1
+
+    def on_train_epoch_end(self, trainer):
+        self.train_end = time.perf_counter()
+
+    def on_fit_epoch_end(self, trainer):
+        if RANK not in {-1, 0} or self.train_end is None:
+            return  # final_eval() fires this again without a training epoch
+        train_s = self.train_end - self.epoch_start
+        images = self.images or self.batches * trainer.batch_size  # No per-sample timings: assume full batches
+        row = {
+            "epoch": trainer.epoch + 1,
+            "images": images,
+            "train_s": train_s,
+            "val_s": time.perf_counter() - self.train_end,
+            "images_per_s": images / train_s if train_s > 0 else 0.0,
+            "dataloader_wait_s": self.wait,
+            "dataloader_wait_pct": 100 * self.wait / train_s if train_s > 0 else 0.0,
+            "forward_s": self.forward,
+            "backward_optim_s": max(self.step - self.forward, 0.0),
+        }
+        if self.samples:
+            per_image = {op: 1000 * s / self.samples for op, s in self.sample_ops.items()}
+            worker_ms = sum(per_image.values())
+            workers = max(getattr(trainer.train_loader, "num_workers", 0), 1)
+            row["worker_ms_per_image"] = worker_ms
+            row["worker_capacity_img_s"] = workers * 1000 / worker_ms if worker_ms > 0 else 0.0
+            for op in ("decode", "clahe"):
+                if op in per_image:
+                    row[f"{op}_ms"] = per_image.pop(op)
+            row.update({f"aug_{op}_ms": ms for op, ms in per_image.items()})
+        self.rows.append(row)
+        self.train_end = None
+        self.write_csv()
+
+    def on_train_end(self, trainer):
+        if self._hook is not None:
+            self._hook.remove()
+            self._hook = None
+        if RANK in {-1, 0} and self.rows:
+            self.plot()
+            LOGGER.info(f"⏱️  Telemetry saved to {trainer.save_dir / 'telemetry.csv'} and telemetry.png")
+
+    # --- output ---
+    def write_csv(self):
+        # Rewritten every epoch: ops can come and go (close_mosaic drops Mosaic)
+        fields = list(dict.fromkeys(k for row in self.rows for k in row))
+        with open(self.trainer.save_dir / "telemetry.csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, restval=0.0)
+            writer.writeheader()
+            for row in self.rows:
+                writer.writerow({k: round(v, 4) if isinstance(v, float) else v for k, v in row.items()})
+
+    def plot(self):
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        epochs = [r["epoch"] for r in self.rows]
+        fig, ax = plt.subplots(2, 2, figsize=(14, 9))
+
+        ax[0, 0].plot(epochs, [r["images_per_s"] for r in self.rows], "o-", label="training")
+        if "worker_capacity_img_s" in self.rows[0]:
+            ax[0, 0].plot(epochs, [r.get("worker_capacity_img_s", 0.0) for r in self.rows], "s--",
+                          label="dataloader worker capacity")
+        ax[0, 0].set_title("Images / s")
+        ax[0, 0].legend()
+
+        bottom = [0.0] * len(self.rows)
+        for key, label in (("dataloader_wait_s", "dataloader wait"), ("forward_s", "forward + loss"),
+                           ("backward_optim_s", "backward + optimizer"), ("val_s", "validation")):
+            values = [r[key] for r in self.rows]
+            ax[0, 1].bar(epochs, values, bottom=bottom, label=label)
+            bottom = [b + v for b, v in zip(bottom, values)]
+        ax[0, 1].set_title("Epoch time (s)")
+        ax[0, 1].legend()
+
+        ops = [k for k in dict.fromkeys(k for r in self.rows for k in r) if k.endswith("_ms")]
+        bottom = [0.0] * len(self.rows)
+        for key in ops:
+            values = [r.get(key, 0.0) for r in self.rows]
+            ax[1, 0].bar(epochs, values, bottom=bottom, label=key[:-3].removeprefix("aug_"))
+            bottom = [b + v for b, v in zip(bottom, values)]
+        ax[1, 0].set_title("Worker CPU per image (ms)")
+        if ops:
+            ax[1, 0].legend(fontsize=8)
+
+        ax[1, 1].plot(epochs, [r["dataloader_wait_pct"] for r in self.rows], "o-", color="tab:red")
+        ax[1, 1].set_title("Dataloader wait (% of training time)")
+        ax[1, 1].set_ylim(0, 100)
+
+        for a in ax.flat:
+            a.set_xlabel("epoch")
+        fig.tight_layout()
+        fig.savefig(self.trainer.save_dir / "telemetry.png", dpi=120)
+        plt.close(fig)